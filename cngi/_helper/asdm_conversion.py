@@ -0,0 +1,355 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#################################
+# Helper File
+#
+# Not exposed in API
+#
+#################################
+import os
+import re
+import mmap
+import numpy as np
+import xml.etree.ElementTree as ET
+
+
+# casacore Stokes codes of the ASDM StokesParameter names and receptor indices of the PolarizationType names
+stokes_codes = {'I': 1, 'Q': 2, 'U': 3, 'V': 4, 'RR': 5, 'RL': 6, 'LR': 7, 'LL': 8, 'XX': 9, 'XY': 10, 'YX': 11, 'YY': 12}
+receptor_codes = {'X': 0, 'Y': 1, 'R': 0, 'L': 1}
+
+# primitive types of the BDF binary attachments, the subset header may override the type of the data attachments
+bdf_types = {'INT16_TYPE': 'i2', 'INT32_TYPE': 'i4', 'INT64_TYPE': 'i8', 'FLOAT32_TYPE': 'f4', 'FLOAT64_TYPE': 'f8'}
+attachment_types = {'flags': 'u4', 'actualTimes': 'i8', 'actualDurations': 'i8', 'zeroLags': 'f4', 'crossData': 'i4', 'autoData': 'f4'}
+
+
+
+##################################################################
+# element tag without its xml namespace
+def local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+
+##################################################################
+# read the rows of an ASDM table stored in XML format as a list of dicts of element name : text
+# entity references (ie the dataUID of the Main table) are replaced by their entityId
+# the rows are parsed incrementally so large tables are never held as a full element tree
+def read_asdm_table(infile, name):
+    filename = os.path.join(infile, name + '.xml')
+    if not os.path.exists(filename):
+        if os.path.exists(os.path.join(infile, name + '.bin')):
+            print('WARNING : table %s is stored in binary format, which is not supported, skipping' % name)
+        return []
+    rows = []
+    for event, elem in ET.iterparse(filename):
+        if local(elem.tag) != 'row': continue
+        row = {}
+        for child in elem:
+            refs = list(child)
+            row[local(child.tag)] = refs[0].attrib.get('entityId', '') if len(refs) > 0 else (child.text or '').strip()
+        rows += [row]
+        elem.clear()
+    return rows
+
+
+
+##################################################################
+# ASDM XML arrays are written as "ndim dim1 ... dimN value1 value2 ..."
+def parse_array(text, dtype=float):
+    tokens = text.split()
+    ndim = int(tokens[0])
+    shape = [int(tt) for tt in tokens[1:ndim + 1]]
+    return np.array(tokens[ndim + 1:], dtype=dtype).reshape(shape)
+
+
+
+##################################################################
+# row number of an ASDM tag identifier such as "Antenna_3"
+def asdm_id(text):
+    return int(text.strip().rsplit('_', 1)[-1])
+
+
+
+##################################################################
+# BDF files are stored in the ASDMBinary directory under their uid with the separators replaced
+def bdf_filename(infile, uid):
+    return os.path.join(infile, 'ASDMBinary', re.sub('[:/]', '_', uid))
+
+
+
+##################################################################
+# per spectral window values of a SpectralWindow row, from its array element or its scalar element repeated over the channels
+def spw_values(row, name, nchan):
+    if (name + 'Array') in row:
+        return parse_array(row[name + 'Array']).ravel()
+    return np.full(nchan, float(row.get(name, 'nan')))
+
+
+
+##################################################################
+# channel frequencies of a SpectralWindow row
+def spw_frequencies(row):
+    nchan = int(row['numChan'])
+    if 'chanFreqArray' in row:
+        return parse_array(row['chanFreqArray']).ravel()
+    return float(row['chanFreqStart']) + float(row['chanFreqStep']) * np.arange(nchan)
+
+
+
+##################################################################
+# MIME header lines starting at pos, returns a dict of lower case header name : value and the position of the part body
+def mime_headers(mm, pos):
+    headers, last = {}, None
+    while True:
+        end = mm.find(b'\n', pos)
+        raw = mm[pos:end]
+        pos = end + 1
+        line = raw.decode('ascii', 'replace').strip()
+        if len(line) == 0: break
+        if raw[:1] in [b' ', b'\t'] and last is not None:  # folded continuation of the previous header
+            headers[last] += ' ' + line
+        elif ':' in line:
+            last, value = line.split(':', 1)
+            last = last.strip().lower()
+            headers[last] = value.strip()
+    return headers, pos
+
+
+
+##################################################################
+# position after the line starting at pos (ie a boundary delimiter line)
+def skip_line(mm, pos):
+    return mm.find(b'\n', pos) + 1
+
+
+
+##################################################################
+def mime_boundary(content_type):
+    return b'--' + re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode()
+
+
+
+##################################################################
+# layout of the binary attachments of every integration, from the sdmDataHeader part of a BDF
+def bdf_layout(xml):
+    root = ET.fromstring(xml)
+    layout = {'byteorder': '>' if root.attrib.get('byteOrder', 'Little_Endian').startswith('Big') else '<',
+              'nant': 0, 'mode': 'CROSS_AND_AUTO', 'apc': ['AP_UNCORRECTED'], 'spws': [], 'axes': {}}
+    for elem in root:
+        tag = local(elem.tag)
+        if tag == 'numAntenna':
+            layout['nant'] = int(elem.text)
+        elif tag == 'correlationMode':
+            layout['mode'] = elem.text.strip()
+        elif tag == 'dataStruct':
+            if 'apc' in elem.attrib: layout['apc'] = elem.attrib['apc'].split()
+            for part in elem:
+                if local(part.tag) == 'baseband':
+                    for sw in part:
+                        layout['spws'] += [{'cross': sw.attrib.get('crossPolProducts', '').split(), 'sd': sw.attrib.get('sdPolProducts', '').split(),
+                                            'nspp': int(sw.attrib['numSpectralPoint']), 'nbin': int(sw.attrib.get('numBin', 1)),
+                                            'scale': float(sw.attrib.get('scaleFactor', 1.0))}]
+                elif 'axes' in part.attrib:
+                    layout['axes'][local(part.tag)] = [ax for ax in part.attrib['axes'].split() if ax != 'TIM']
+    return layout
+
+
+
+##################################################################
+# iterate over the integrations of a BDF file, yielding its layout, the subset header and the binary attachments
+# the file is memory mapped and each attachment is copied out of it as it is reached, so only one integration is in memory
+def bdf_integrations(filename):
+    with open(filename, 'rb') as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        headers, pos = mime_headers(mm, 0)
+        outer = mime_boundary(headers['content-type'])
+        headers, body = mime_headers(mm, skip_line(mm, mm.find(outer, pos)))
+        pos = mm.find(outer, body)
+        layout = bdf_layout(mm[body:pos].strip())
+        while (pos >= 0) and (mm[pos:pos + len(outer) + 2] != outer + b'--'):
+            headers, body = mime_headers(mm, skip_line(mm, pos))
+            inner = mime_boundary(headers['content-type'])
+            headers, body = mime_headers(mm, skip_line(mm, mm.find(inner, body)))
+            ipos = mm.find(inner, body)
+            subset = ET.fromstring(mm[body:ipos].strip())
+            types = dict([(local(ee.tag), bdf_types[ee.attrib['type']]) for ee in subset if ee.attrib.get('type') in bdf_types])
+            attachments = {}
+            while mm[ipos:ipos + len(inner) + 2] != inner + b'--':
+                headers, body = mime_headers(mm, skip_line(mm, ipos))
+                ipos = mm.find(inner, body)
+                end = ipos - 2 if mm[ipos - 2:ipos] == b'\r\n' else ipos - 1
+                name = headers.get('content-location', '').split('/')[-1].split('.')[0]
+                if name not in attachment_types: continue
+                dtype = np.dtype(layout['byteorder'] + types.get(name, attachment_types[name]))
+                attachments[name] = np.frombuffer(mm, dtype=dtype, count=(end - body) // dtype.itemsize, offset=body).astype(dtype.newbyteorder('='))
+            yield layout, subset, attachments
+            pos = mm.find(outer, ipos + len(inner))
+    finally:
+        mm.close()
+
+
+
+##################################################################
+# split the values of one attachment in to one block per spectral window
+# rows (baselines or antennas) are outermost, the spectral windows of every baseband follow each other within a row
+# shapes are the sizes of the axes inside the SPW axis for each spectral window, returns None when the size does not match
+def split_spws(values, nrows, shapes):
+    counts = [int(np.prod(shape)) for shape in shapes]
+    if values.size != nrows * sum(counts): return None
+    values = values.reshape(nrows, -1)
+    offsets = np.cumsum([0] + counts)
+    return [values[:, offsets[ii]:offsets[ii + 1]].reshape((nrows,) + tuple(shape)) for ii, shape in enumerate(shapes)]
+
+
+
+##################################################################
+# reduce a spectral window block to (rows, SPP, POL, ...) keeping the first bin and atmospheric phase correction
+# axes missing from the attachment (ie SPP of the flags) are added with length one
+def spw_block(block, inner):
+    block = block[(slice(None),) + tuple([0 if ax in ['BIN', 'APC'] else slice(None) for ax in inner])]
+    kept = [ax for ax in inner if ax not in ['BIN', 'APC']]
+    for ax in ['SPP', 'POL']:
+        if ax not in kept:
+            block = np.expand_dims(block, len(kept) + 1)
+            kept += [ax]
+    return np.moveaxis(block, [kept.index('SPP') + 1, kept.index('POL') + 1], [1, 2])
+
+
+
+##################################################################
+# decode the attachments of one integration in to per spectral window arrays
+# cross is (baseline, chan, pol) complex in BDF baseline order, auto is a dict of sd product name : (antenna, chan) values
+# flags are (baseline or antenna, chan or 1, pol) booleans of the cross and auto rows, None when not present
+def decode_integration(layout, attachments):
+    nant, spws, axes = layout['nant'], layout['spws'], layout['axes']
+    nbl = nant * (nant - 1) // 2
+    sizes = lambda ax, sw, npol: {'BIN': sw['nbin'], 'APC': len(layout['apc']), 'SPP': sw['nspp'], 'POL': npol}.get(ax, 1)
+    inner = lambda name: axes[name][axes[name].index('SPW') + 1:]
+    cross, auto = [None] * len(spws), [None] * len(spws)
+    cross_flags, auto_flags = [None] * len(spws), [None] * len(spws)
+
+    if ('crossData' in attachments) and ('crossData' in axes):
+        values = attachments['crossData']
+        blocks = split_spws(values, nbl, [[sizes(ax, sw, len(sw['cross'])) for ax in inner('crossData')] + [2] for sw in spws])
+        for ii, sw in enumerate(spws if blocks is not None else []):
+            block = spw_block(blocks[ii], inner('crossData') + ['RI']).astype(np.float32)
+            if values.dtype.kind in 'iu': block = block / np.float32(sw['scale'])
+            cross[ii] = block[..., 0] + 1j * block[..., 1]
+
+    # single dish products of three or four correlations are stored as XX, Re(XY), Im(XY), YY
+    if ('autoData' in attachments) and ('autoData' in axes):
+        nvals = lambda sw: 4 if len(sw['sd']) > 2 else len(sw['sd'])
+        blocks = split_spws(attachments['autoData'], nant, [[sizes(ax, sw, nvals(sw)) for ax in inner('autoData')] for sw in spws])
+        for ii, sw in enumerate(spws if blocks is not None else []):
+            block = spw_block(blocks[ii], inner('autoData'))
+            if len(sw['sd']) <= 2:
+                auto[ii] = dict([(name, block[:, :, pp]) for pp, name in enumerate(sw['sd'])])
+            else:
+                xy = block[:, :, 1] + 1j * block[:, :, 2]
+                auto[ii] = {sw['sd'][0]: block[:, :, 0], sw['sd'][-1]: block[:, :, 3], sw['sd'][1]: xy, sw['sd'][1][::-1]: np.conj(xy)}
+
+    # flags of the baselines come before the flags of the antennas
+    if ('flags' in attachments) and ('flags' in axes):
+        values, fl_inner = attachments['flags'], inner('flags')
+        sections = [(ax, nn, kind) for ax, nn, kind in [('BAL', nbl, 'cross'), ('ANT', nant, 'sd')] if ax in axes['flags']]
+        counts = [nn * sum([int(np.prod([sizes(ax, sw, len(sw[kind])) for ax in fl_inner])) for sw in spws]) for ax, nn, kind in sections]
+        if sum(counts) == values.size:
+            offset = 0
+            for (ax, nn, kind), count in zip(sections, counts):
+                blocks = split_spws(values[offset:offset + count], nn, [[sizes(ax, sw, len(sw[kind])) for ax in fl_inner] for sw in spws])
+                flags = [spw_block(block, fl_inner) != 0 for block in blocks]
+                if kind == 'cross': cross_flags = flags
+                else: auto_flags = flags
+                offset += count
+        else:
+            print('WARNING : unexpected size of the BDF flags, they are ignored')
+
+    return cross, auto, cross_flags, auto_flags
+
+
+
+##################################################################
+# baselines (antenna id pairs) of the integrations of a BDF, cross correlations in BDF order followed by the autos
+# BDF cross baselines are ordered by the second antenna then the first: (0,1), (0,2), (1,2), (0,3), ...
+def bdf_baselines(antennas, mode):
+    baselines = []
+    if mode != 'AUTO_ONLY':
+        baselines += [(antennas[ii], antennas[jj]) for jj in range(1, len(antennas)) for ii in range(jj)]
+    if mode != 'CROSS_ONLY':
+        baselines += [(aa, aa) for aa in antennas]
+    return np.array(baselines, dtype=np.int32).reshape(-1, 2)
+
+
+
+##################################################################
+# read every integration of one BDF file in to (integration, baseline, chan, pol) arrays of each of its spectral windows
+# pols are the correlation names of each spectral window (data description) of the configuration in the output order
+# baselines are in bdf_baselines order, correlations not present in the file are NaN and flagged
+def read_bdf(filename, antennas, mode, pols, nint):
+    nbl = len(antennas) * (len(antennas) - 1) // 2 if mode != 'AUTO_ONLY' else 0
+    nrows = len(bdf_baselines(antennas, mode))
+    data, flag = [], []
+    for kk, (layout, subset, attachments) in enumerate(bdf_integrations(filename)):
+        if kk >= nint: break
+        if layout['nant'] != len(antennas):
+            print('WARNING : %s has %s antennas, the configuration has %s, skipping' % (filename, str(layout['nant']), str(len(antennas))))
+            break
+        cross, auto, cross_flags, auto_flags = decode_integration(layout, attachments)
+        for ii, sw in enumerate(layout['spws'][:len(pols)]):
+            if kk == 0:
+                data += [np.full((nint, nrows, sw['nspp'], len(pols[ii])), np.nan, dtype=np.complex64)]
+                flag += [np.ones((nint, nrows, sw['nspp'], len(pols[ii])), dtype=bool)]
+            for pp, name in enumerate(pols[ii]):
+                if (cross[ii] is not None) and (name in sw['cross']):
+                    cc = sw['cross'].index(name)
+                    data[ii][kk, :nbl, :, pp] = cross[ii][:, :, cc]
+                    flag[ii][kk, :nbl, :, pp] = cross_flags[ii][:, :, min(cc, cross_flags[ii].shape[2] - 1)] if cross_flags[ii] is not None else False
+                if (auto[ii] is not None) and (name in auto[ii]):
+                    sd = sw['sd'].index(name) if name in sw['sd'] else sw['sd'].index(name[::-1])
+                    data[ii][kk, nbl:, :, pp] = auto[ii][name]
+                    flag[ii][kk, nbl:, :, pp] = auto_flags[ii][:, :, min(sd, auto_flags[ii].shape[2] - 1)] if auto_flags[ii] is not None else False
+    return data, flag
+
+
+
+##################################################################
+# global partition variables and coordinates from the Antenna, Station and Field tables
+# dimensions without coordinates are named by their size as in the global partition of convert_ms
+def convert_asdm_global(tables):
+    mvars, mcoords = {}, {}
+    dimname = lambda values: ['d%s' % str(ss) for ss in values.shape]
+
+    antennas = sorted(tables['Antenna'], key=lambda row: asdm_id(row['antennaId']))
+    if len(antennas) > 0:
+        stations = dict([(row['stationId'], row.get('name', '')) for row in tables.get('Station', [])])
+        mcoords['antenna'] = np.array([asdm_id(row['antennaId']) for row in antennas])
+        mvars['ANT_NAME'] = (['antenna'], np.array([row['name'] for row in antennas]))
+        mvars['ANT_STATION'] = (['antenna'], np.array([stations.get(row.get('stationId'), '') for row in antennas]))
+        mvars['ANT_DISH_DIAMETER'] = (['antenna'], np.array([float(row['dishDiameter']) for row in antennas]))
+        for col, name in [('position', 'ANT_POSITION'), ('offset', 'ANT_OFFSET')]:
+            values = np.array([parse_array(row[col]) for row in antennas])
+            mvars[name] = (['antenna'] + dimname(values[0]), values)
+
+    fields = sorted(tables['Field'], key=lambda row: asdm_id(row['fieldId']))
+    if len(fields) > 0:
+        from cngi._helper.ms_conversion import unique_names
+        mcoords['field'] = np.array(unique_names([row['fieldName'] for row in fields]))
+        mvars['FIELD_CODE'] = (['field'], np.array([row.get('code', '') for row in fields]))
+        for col, name in [('delayDir', 'FIELD_DELAY_DIR'), ('phaseDir', 'FIELD_PHASE_DIR'), ('referenceDir', 'FIELD_REFERENCE_DIR')]:
+            values = np.array([parse_array(row[col]) for row in fields])
+            mvars[name] = (['field'] + dimname(values[0]), values)
+
+    return mvars, mcoords
@@ -0,0 +1,730 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#################################
+# Helper File
+#
+# Not exposed in API
+#
+#################################
+import os
+import re
+import struct
+import numpy as np
+
+
+# casacore DataType enum values of the column types this reader supports
+casacore_types = {0: 'bool', 1: 'i1', 2: 'u1', 3: 'i2', 4: 'u2', 5: 'i4', 6: 'u4', 7: 'f4', 8: 'f8', 9: 'c8', 10: 'c16', 11: 'str', 29: 'i8'}
+
+# column description option bits
+option_direct, option_undefined, option_fixedshape = 1, 2, 4
+
+magic_number = b'\xbe\xbe\xbe\xbe'
+
+
+
+##################################################################
+# sequential reader of the AipsIO object streams used by table.dat and the storage manager headers
+# an object is its length in bytes (including the length itself), type name and version, followed by its members
+# only the outermost object of a stream is preceded by the magic number
+class AipsIO:
+    def __init__(self, data, endian='>', pos=0):
+        self.data, self.endian, self.pos = data, endian, pos
+
+    def get(self, fmt):
+        values = struct.unpack_from(self.endian + fmt, self.data, self.pos)
+        self.pos += struct.calcsize(self.endian + fmt)
+        return values[0] if len(values) == 1 else values
+
+    def getbool(self):
+        self.pos += 1
+        return self.data[self.pos - 1] != 0
+
+    def getstring(self):
+        length = self.get('I')
+        self.pos += length
+        return self.data[self.pos - length:self.pos].decode('utf-8', errors='replace')
+
+    def getmagic(self):
+        if self.data[self.pos:self.pos + 4] != magic_number:
+            raise ValueError('invalid AipsIO stream, magic number not found at byte %i' % self.pos)
+        self.pos += 4
+
+    # start of an object, returns its version and the position of its end
+    def getstart(self, name=None):
+        start = self.pos
+        length = self.get('I')
+        stype = self.getstring()
+        if (name is not None) and (stype != name):
+            raise ValueError('expected AipsIO object %s, found %s' % (name, stype))
+        return self.get('I'), start + length
+
+    def skipobject(self):
+        length = self.get('I')
+        self.pos += length - 4
+
+    def getiposition(self):
+        version, end = self.getstart('IPosition')
+        nelem = self.get('I')
+        values = [self.get('q' if version > 1 else 'i') for ii in range(nelem)]
+        self.pos = end
+        return values
+
+    def getblock(self, fmt='i'):
+        version, end = self.getstart('Block')
+        nelem = self.get('I')
+        values = np.array(struct.unpack_from(self.endian + fmt * nelem, self.data, self.pos), dtype=np.int64)
+        self.pos = end
+        return values
+
+
+
+##################################################################
+# parse the table.dat file of a table, describing its columns and the data managers that store them
+# returns the number of rows, data endianness ('<' or '>'), list of column dicts and list of data manager dicts
+def read_table_dat(tablename):
+    with open(os.path.join(tablename, 'table.dat'), 'rb') as fid:
+        aio = AipsIO(fid.read(), '>')
+    aio.getmagic()
+    version, end = aio.getstart('Table')
+    nrow = aio.get('Q' if version > 2 else 'I')
+    endian = '>' if aio.get('I') == 0 else '<'
+    aio.getstring()  # table type (PlainTable)
+
+    # table description
+    tdversion, tdend = aio.getstart('TableDesc')
+    for ii in range(3): aio.getstring()  # description name, version and comment
+    aio.skipobject()  # table keywords
+    aio.skipobject()  # private keywords
+    columns = []
+    for ii in range(aio.get('I')):
+        aio.get('I')
+        cls = aio.getstring()
+        aio.get('I')
+        cd = {'name': aio.getstring()}
+        aio.getstring()  # comment
+        cd['dmtype'], cd['dmgroup'] = aio.getstring(), aio.getstring()
+        cd['dtype'], cd['option'], cd['ndim'] = aio.get('i'), aio.get('i'), aio.get('i')
+        cd['shape'] = aio.getiposition() if cd['ndim'] != 0 else []
+        cd['maxlen'] = aio.get('I')
+        aio.skipobject()  # column keywords
+        aio.get('I')
+        if cls.startswith('ArrayColumnDesc'):
+            aio.getbool()
+        elif cls.startswith('ScalarColumnDesc'):  # skip the default value
+            if cd['dtype'] == 11:
+                aio.getstring()
+            elif cd['dtype'] in casacore_types:
+                aio.pos += np.dtype(casacore_types[cd['dtype']]).itemsize
+        cd['isarray'] = cls.startswith('ArrayColumnDesc')
+        columns += [cd]
+    aio.pos = tdend
+
+    # column set, binding each column to a data manager
+    csversion = aio.get('i')
+    csversion = -csversion if csversion < 0 else 1
+    aio.get('Q' if csversion > 2 else 'I')  # nrow
+    aio.get('I')  # data manager sequence number counter
+    dms = [{'type': aio.getstring(), 'seqnr': aio.get('I')} for ii in range(aio.get('I'))]
+    for cd in columns:
+        aio.get('I')
+        aio.getstring()
+        aio.get('I')
+        cd['seqnr'] = aio.get('I')
+        if cd['isarray'] and aio.getbool():
+            cd['shape'] = aio.getiposition()
+    for dm in dms:
+        length = aio.get('I')
+        dm['blob'] = aio.data[aio.pos:aio.pos + length]
+        aio.pos += length
+
+    # table.dat is not rewritten on every change, the sync record of table.lock holds the current number of rows
+    lockfile = os.path.join(tablename, 'table.lock')
+    if os.path.isfile(lockfile):
+        with open(lockfile, 'rb') as fid:
+            lock = fid.read()
+        if lock.find(magic_number) >= 0:
+            aio = AipsIO(lock, '>', lock.find(magic_number))
+            aio.getmagic()
+            sversion, send = aio.getstart('sync')
+            nrow = aio.get('Q' if sversion > 1 else 'I')
+    return nrow, endian, columns, dms
+
+
+
+##################################################################
+# reader of the StManArrayFile (table.f<n>i) holding the indirectly stored arrays of StandardStMan and IncrementalStMan
+# each array is [reference count (file version > 0)], ndim, shape, then the values in Fortran order
+# arrays are gathered with vectorized fancy indexing of a memory map, one block per distinct cell shape
+class ArrayFile:
+    def __init__(self, filename, endian):
+        self.endian = endian
+        self.mm = np.memmap(filename, dtype=np.uint8, mode='r') if os.path.getsize(filename) > 0 else np.zeros(16, np.uint8)
+        self.version = int(self.mm[:4].view(endian + 'u4')[0])
+
+    def ints(self, offsets, count, fmt='i4'):
+        idx = np.asarray(offsets, dtype=np.int64)[:, None] + np.arange(count * 4)
+        return np.ascontiguousarray(self.mm[idx]).view(self.endian + fmt).reshape(len(offsets), count)
+
+    # shapes (casacore order) of the arrays at offsets, and the offsets of their values
+    def shapes(self, offsets):
+        offsets = np.asarray(offsets, dtype=np.int64) + (4 if self.version > 0 else 0)
+        ndims = self.ints(offsets, 1)[:, 0]
+        shapes = [None] * len(offsets)
+        for ndim in np.unique(ndims):
+            sel = np.where(ndims == ndim)[0]
+            for ii, shape in zip(sel, self.ints(offsets[sel] + 4, ndim)):
+                shapes[ii] = tuple(shape)
+        return shapes, offsets + 4 + 4 * ndims
+
+    # shapes of the arrays at offsets, () where offset is 0 (undefined), only the array headers are read
+    def cellshapes(self, offsets):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        cellshapes = [()] * len(offsets)
+        defined = np.where(offsets > 0)[0]
+        if len(defined) == 0: return cellshapes
+        for ii, shape in zip(defined, self.shapes(offsets[defined])[0]):
+            cellshapes[ii] = tuple([int(ss) for ss in shape])
+        return cellshapes
+
+    # list of the arrays at offsets, as C ordered numpy arrays (reversed casacore shape), None where offset is 0 (undefined)
+    def cells(self, offsets, dtype):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        cells = [None] * len(offsets)
+        defined = np.where(offsets > 0)[0]
+        if len(defined) == 0: return cells
+        shapes, dataoffs = self.shapes(offsets[defined])
+        for shape in set(shapes):
+            sel = np.array([ii for ii, ss in enumerate(shapes) if ss == shape])
+            nelem = int(np.prod(shape))
+            if dtype == 'str':
+                block = [self.strings(off, nelem).reshape(shape[::-1]) for off in dataoffs[sel]]
+            elif dtype == 'bool':
+                raw = self.mm[dataoffs[sel][:, None] + np.arange((nelem + 7) // 8)]
+                block = np.unpackbits(raw, axis=1, bitorder='little')[:, :nelem].astype(bool).reshape((len(sel),) + shape[::-1])
+            else:
+                itemsize = np.dtype(dtype).itemsize
+                raw = np.ascontiguousarray(self.mm[dataoffs[sel][:, None] + np.arange(nelem * itemsize)])
+                block = raw.view(self.endian + dtype).astype(dtype).reshape((len(sel),) + shape[::-1])
+            for ii, cell in zip(sel, block):
+                cells[defined[ii]] = cell
+        return cells
+
+    def strings(self, offset, count):
+        values = []
+        for ii in range(count):
+            length = int(self.mm[offset:offset + 4].view(self.endian + 'u4')[0])
+            values += [bytes(self.mm[offset + 4:offset + 4 + length]).decode('utf-8', errors='replace')]
+            offset += 4 + length
+        return np.array(values, dtype=str)
+
+
+
+##################################################################
+# unpack count bits starting at bit first of a byte buffer (casacore stores Bools as bits, least significant first)
+def unpack_bits(buffer, first, count):
+    raw = np.frombuffer(buffer, dtype=np.uint8, count=(first + count + 7) // 8 - first // 8, offset=first // 8)
+    return np.unpackbits(raw, bitorder='little')[first % 8:first % 8 + count].astype(bool)
+
+
+
+##################################################################
+# StandardStMan: rows are stored in fixed size buckets, each column in its own section of the bucket
+# an index per group of columns gives the last row and bucket number of every bucket
+# variable length strings are kept in separate string buckets, indirect arrays in the table.f<n>i array file
+class StandardStMan:
+    def __init__(self, tablename, dm, columns, endian):
+        blob = AipsIO(dm['blob'], '>')
+        blob.getmagic()
+        blob.getstart('SSM')
+        blob.getstring()
+        self.coloffsets, self.colindex = blob.getblock(), blob.getblock()
+        self.columns = dict([(cd['name'], ii) for ii, cd in enumerate(columns)])
+
+        self.filename = os.path.join(tablename, 'table.f%i' % dm['seqnr'])
+        self.mm = np.memmap(self.filename, dtype=np.uint8, mode='r')
+        aio = AipsIO(bytes(self.mm[:512]), endian)
+        aio.getmagic()
+        version, end = aio.getstart('StandardStMan')
+        if version >= 3: endian = '>' if aio.getbool() else '<'
+        self.endian = aio.endian = endian
+        self.bucketsize, self.nbuckets, self.perscache, self.nfree, self.firstfree = [aio.get('i') for ii in range(5)]
+        nidxbuckets, firstidx, idxoffset, self.laststring, idxlength, nindices = [aio.get('i') for ii in range(6)]
+
+        # the index is stored in one bucket (at idxoffset) or split over a chain of buckets after an 8 byte link header
+        if idxoffset > 0:
+            start = 512 + firstidx * self.bucketsize + idxoffset
+            idxbytes = bytes(self.mm[start:start + idxlength])
+        else:
+            idxbytes, bucket = b'', firstidx
+            for ii in range(nidxbuckets):
+                start = 512 + bucket * self.bucketsize
+                idxbytes += bytes(self.mm[start + 8:start + self.bucketsize])
+                bucket = struct.unpack('>i', bytes(self.mm[start:start + 4]))[0]
+            idxbytes = idxbytes[:idxlength]
+        aio = AipsIO(idxbytes, endian)
+        self.indices = []
+        for ii in range(nindices):
+            if aio.data[aio.pos:aio.pos + 4] == magic_number: aio.getmagic()
+            iversion, end = aio.getstart('SSMIndex')
+            nused = aio.get('i')
+            aio.pos += 8  # rows per bucket and number of columns
+            aio.skipobject()  # free space map
+            lastrows = aio.getblock('q' if iversion > 1 else 'i')[:nused]
+            buckets = aio.getblock()[:nused]
+            self.indices += [(np.concatenate([[0], lastrows[:-1] + 1]), lastrows + 1, buckets)]
+            aio.pos = end
+        self.arrayfile = None
+
+    # read a variable length string (or string array) of length bytes from the chain of string buckets
+    def stringbytes(self, bucket, offset, length):
+        data = b''
+        while len(data) < length:
+            start = 512 + bucket * self.bucketsize
+            avail = self.bucketsize - 16 - offset
+            data += bytes(self.mm[start + 16 + offset:start + 16 + offset + min(avail, length - len(data))])
+            bucket, offset = struct.unpack('>i', bytes(self.mm[start + 12:start + 16]))[0], 0
+        return data
+
+    def decodestrings(self, data, count, fixed):
+        if not fixed: count, data = struct.unpack_from('>i', data, 4)[0], data[12:]
+        values, pos = [], 0
+        for ii in range(count):
+            length = struct.unpack_from('>i', data, pos)[0]
+            values += [data[pos + 4:pos + 4 + length].decode('utf-8', errors='replace')]
+            pos += 4 + length
+        return np.array(values, dtype=str)
+
+    # values of rows start to stop of column cd, a (row, ...) array or a list of cells
+    def getcol(self, cd, start, stop):
+        ci = self.columns[cd['name']]
+        firstrows, endrows, buckets = self.indices[self.colindex[ci]]
+        dtype, isdirect = casacore_types[cd['dtype']], (not cd['isarray']) or (cd['option'] & option_direct)
+        nelem = int(np.prod(cd['shape'])) if cd['isarray'] and isdirect else 1
+        blocks = []
+        for kk in range(np.searchsorted(endrows, start, side='right'), np.searchsorted(endrows, stop - 1, side='right') + 1):
+            r0, r1 = max(start, firstrows[kk]), min(stop, endrows[kk])
+            base = 512 + buckets[kk] * self.bucketsize + self.coloffsets[ci]
+            rel, nr = r0 - firstrows[kk], r1 - r0
+            if dtype == 'str':
+                if cd['maxlen'] > 0 and not cd['isarray']:
+                    raw = self.mm[base + rel * cd['maxlen']:base + (rel + nr) * cd['maxlen']]
+                    blocks += [np.array([bytes(raw[ii * cd['maxlen']:(ii + 1) * cd['maxlen']]).split(b'\x00')[0].decode() for ii in range(nr)])]
+                    continue
+                raw = np.ascontiguousarray(self.mm[base + rel * 12:base + (rel + nr) * 12]).reshape(nr, 3, 4)
+                refs = raw.view(self.endian + 'i4').reshape(nr, 3)
+                cells = []
+                for ii in range(nr):
+                    if (not cd['isarray']) and (refs[ii, 2] <= 8):
+                        cells += [bytes(raw[ii, :2].ravel()[:refs[ii, 2]]).decode('utf-8', errors='replace')]
+                    elif not cd['isarray']:
+                        cells += [self.stringbytes(refs[ii, 0], refs[ii, 1], refs[ii, 2]).decode('utf-8', errors='replace')]
+                    elif refs[ii, 2] == 0:
+                        cells += [None]
+                    else:
+                        data = self.stringbytes(refs[ii, 0], refs[ii, 1], refs[ii, 2])
+                        fixed = bool(cd['option'] & option_fixedshape)
+                        values = self.decodestrings(data, int(np.prod(cd['shape'])), fixed)
+                        cells += [values.reshape(cd['shape'][::-1]) if fixed else values]
+                blocks += [np.array(cells) if not cd['isarray'] else cells]
+            elif not isdirect:
+                offsets = np.ascontiguousarray(self.mm[base + rel * 8:base + (rel + nr) * 8]).view(self.endian + 'i8')
+                if self.arrayfile is None: self.arrayfile = ArrayFile(self.filename + 'i', self.endian)
+                blocks += [self.arrayfile.cells(offsets, dtype)]
+            elif dtype == 'bool':
+                bits = unpack_bits(self.mm, base * 8 + rel * nelem, nr * nelem)
+                blocks += [bits.reshape((nr,) + tuple(cd['shape'][::-1]))]
+            else:
+                itemsize = np.dtype(dtype).itemsize
+                raw = self.mm[base + rel * nelem * itemsize:base + (rel + nr) * nelem * itemsize]
+                blocks += [np.frombuffer(raw, dtype=self.endian + dtype).astype(dtype).reshape((nr,) + tuple(cd['shape'][::-1]))]
+        if (not isdirect) or (cd['isarray'] and dtype == 'str'):
+            return [cell for block in blocks for cell in block]
+        return np.concatenate(blocks) if len(blocks) > 0 else np.zeros((0,) + tuple(cd['shape'][::-1]), dtype=dtype if dtype != 'str' else str)
+
+    # cell shapes (casacore order) of rows start to stop of a numeric array column, () for undefined cells
+    # indirect arrays are located through the bucket offsets and only their shape headers are read from the array file
+    def getshapes(self, cd, start, stop):
+        if cd['option'] & option_direct: return [tuple(cd['shape'])] * (stop - start)
+        ci = self.columns[cd['name']]
+        firstrows, endrows, buckets = self.indices[self.colindex[ci]]
+        offsets = []
+        for kk in range(np.searchsorted(endrows, start, side='right'), np.searchsorted(endrows, stop - 1, side='right') + 1):
+            r0, r1 = max(start, firstrows[kk]), min(stop, endrows[kk])
+            base = 512 + buckets[kk] * self.bucketsize + self.coloffsets[ci]
+            offsets += [np.ascontiguousarray(self.mm[base + (r0 - firstrows[kk]) * 8:base + (r1 - firstrows[kk]) * 8]).view(self.endian + 'i8')]
+        if self.arrayfile is None: self.arrayfile = ArrayFile(self.filename + 'i', self.endian)
+        return self.arrayfile.cellshapes(np.concatenate(offsets) if len(offsets) > 0 else [])
+
+
+
+##################################################################
+# IncrementalStMan: a value is only stored when it changes, each bucket holds the values and an index per column of
+# the rows (relative to the first row of the bucket) where a new value starts and the offset of that value in the bucket
+class IncrementalStMan:
+    def __init__(self, tablename, dm, columns, endian):
+        self.columns = dict([(cd['name'], ii) for ii, cd in enumerate(columns)])
+        self.filename = os.path.join(tablename, 'table.f%i' % dm['seqnr'])
+        self.mm = np.memmap(self.filename, dtype=np.uint8, mode='r')
+        aio = AipsIO(bytes(self.mm[:512]), endian)
+        aio.getmagic()
+        version, end = aio.getstart('IncrementalStMan')
+        if version >= 5: endian = '>' if aio.getbool() else '<'
+        self.endian = aio.endian = endian
+        self.bucketsize, self.nbuckets = aio.get('i'), aio.get('i')
+
+        aio = AipsIO(bytes(self.mm[512 + self.nbuckets * self.bucketsize:]), endian)
+        aio.getmagic()
+        iversion, end = aio.getstart('ISMIndex')
+        nused = aio.get('i')
+        rows = aio.getblock('q' if iversion > 1 else 'I')
+        self.firstrows, self.endrows, self.buckets = rows[:nused], rows[1:nused + 1], aio.getblock()[:nused]
+        self.arrayfile, self.bucketindex = None, {}
+
+    # per column (row starts, value offsets) of one bucket, offsets relative to the bucket start
+    def getindex(self, bucket):
+        if bucket not in self.bucketindex:
+            base = 512 + bucket * self.bucketsize
+            pos = base + int(self.mm[base:base + 4].view(self.endian + 'u4')[0])
+            index = []
+            for ii in range(len(self.columns)):
+                nused = int(self.mm[pos:pos + 4].view(self.endian + 'u4')[0])
+                values = np.ascontiguousarray(self.mm[pos + 4:pos + 4 + 8 * nused]).view(self.endian + 'u4').astype(np.int64)
+                index += [(values[:nused], base + 4 + values[nused:])]
+                pos += 4 + 8 * nused
+            self.bucketindex[bucket] = index
+        return self.bucketindex[bucket]
+
+    def getcol(self, cd, start, stop):
+        ci = self.columns[cd['name']]
+        dtype, isdirect = casacore_types[cd['dtype']], (not cd['isarray']) or (cd['option'] & option_direct)
+        nelem = int(np.prod(cd['shape'])) if cd['isarray'] and isdirect else 1
+        blocks = []
+        for kk in range(np.searchsorted(self.endrows, start, side='right'), np.searchsorted(self.endrows, stop - 1, side='right') + 1):
+            r0, r1 = max(start, self.firstrows[kk]), min(stop, self.endrows[kk])
+            changes, offsets = self.getindex(self.buckets[kk])[ci]
+            which = np.searchsorted(changes, np.arange(r0, r1) - self.firstrows[kk], side='right') - 1
+            offsets = offsets[which]
+            if dtype == 'str' and not cd['isarray']:
+                values = []
+                for off in offsets:
+                    length = int(self.mm[off:off + 4].view(self.endian + 'u4')[0])
+                    values += [bytes(self.mm[off + 4:off + length]).decode('utf-8', errors='replace')]
+                blocks += [np.array(values, dtype=str)]
+            elif not isdirect or dtype == 'str':
+                offsets = np.ascontiguousarray(self.mm[offsets[:, None] + np.arange(8)]).view(self.endian + 'i8')[:, 0]
+                if self.arrayfile is None: self.arrayfile = ArrayFile(self.filename + 'i', self.endian)
+                blocks += [self.arrayfile.cells(offsets, dtype)]
+            elif dtype == 'bool':
+                raw = self.mm[offsets[:, None] + np.arange((nelem + 7) // 8)]
+                bits = np.unpackbits(raw, axis=1, bitorder='little')[:, :nelem].astype(bool)
+                blocks += [bits.reshape((len(offsets),) + tuple(cd['shape'][::-1]))]
+            else:
+                itemsize = np.dtype(dtype).itemsize
+                raw = np.ascontiguousarray(self.mm[offsets[:, None] + np.arange(nelem * itemsize)])
+                blocks += [raw.view(self.endian + dtype).astype(dtype).reshape((len(offsets),) + tuple(cd['shape'][::-1]))]
+        if (not isdirect) or (cd['isarray'] and dtype == 'str'):
+            return [cell for block in blocks for cell in block]
+        return np.concatenate(blocks) if len(blocks) > 0 else np.zeros((0,) + tuple(cd['shape'][::-1]), dtype=dtype if dtype != 'str' else str)
+
+    # cell shapes (casacore order) of rows start to stop of a numeric array column, () for undefined cells
+    # only the offsets of the indirect arrays and their shape headers are read
+    def getshapes(self, cd, start, stop):
+        if cd['option'] & option_direct: return [tuple(cd['shape'])] * (stop - start)
+        ci = self.columns[cd['name']]
+        offsets = []
+        for kk in range(np.searchsorted(self.endrows, start, side='right'), np.searchsorted(self.endrows, stop - 1, side='right') + 1):
+            r0, r1 = max(start, self.firstrows[kk]), min(stop, self.endrows[kk])
+            changes, values = self.getindex(self.buckets[kk])[ci]
+            values = values[np.searchsorted(changes, np.arange(r0, r1) - self.firstrows[kk], side='right') - 1]
+            offsets += [np.ascontiguousarray(self.mm[values[:, None] + np.arange(8)]).view(self.endian + 'i8')[:, 0]]
+        if self.arrayfile is None: self.arrayfile = ArrayFile(self.filename + 'i', self.endian)
+        return self.arrayfile.cellshapes(np.concatenate(offsets) if len(offsets) > 0 else [])
+
+
+
+##################################################################
+# TiledColumnStMan, TiledShapeStMan and TiledCellStMan: arrays are stored in hypercubes (cell shape plus a row axis)
+# split in to tiles, each tile is one bucket of the table.f<n>_TSM<m> file holding the tile of every column in turn
+# TiledShapeStMan keeps one hypercube per cell shape and a map of row ranges to cubes, TiledCellStMan one cube per row
+class TiledStMan:
+    def __init__(self, tablename, dm, columns, endian):
+        self.columns = dict([(cd['name'], ii) for ii, cd in enumerate(columns)])
+        self.filename = os.path.join(tablename, 'table.f%i' % dm['seqnr'])
+        with open(self.filename, 'rb') as fid:
+            aio = AipsIO(fid.read(), '>')
+        aio.getmagic()
+        version, end = aio.getstart(dm['type'])
+        if dm['type'] in ['TiledColumnStMan', 'TiledCellStMan']: aio.getiposition()  # default tile shape
+        tversion, tend = aio.getstart('TiledStMan')
+        self.endian = ('>' if aio.getbool() else '<') if tversion >= 2 else '>'
+        aio.get('I')
+        aio.get('Q' if tversion > 2 else 'I')
+        self.dtypes = [casacore_types[aio.get('i')] for ii in range(aio.get('I'))]
+        aio.getstring()  # hypercolumn name
+        aio.get('I')
+        aio.get('I')  # ndim
+        for ii in range(aio.get('I')):  # data files
+            if aio.getbool():
+                fversion = aio.get('I')
+                aio.get('I')
+                aio.get('Q' if fversion > 1 else 'I')
+        self.cubes = []
+        for ii in range(aio.get('I')):
+            cversion = aio.get('i')
+            aio.skipobject()  # cube id values
+            aio.getbool()
+            aio.get('I')
+            shape, tile = aio.getiposition(), aio.getiposition()
+            fileseqnr = aio.get('i')
+            offset = aio.get('q' if cversion > 1 else 'I')
+            self.cubes += [{'shape': shape, 'tile': tile, 'file': fileseqnr, 'offset': offset}]
+        aio.pos = tend
+
+        # row map from rows to (cube, row in cube)
+        nrow = max([cc['shape'][-1] for cc in self.cubes if len(cc['shape']) > 0] + [0])
+        if dm['type'] == 'TiledShapeStMan':
+            aio.getiposition()
+            nused = aio.get('I')
+            lastabs, cubeidx, lastsub = aio.getblock()[:nused], aio.getblock()[:nused], aio.getblock()[:nused]
+            self.rowstarts = np.concatenate([[0], lastabs[:-1] + 1])
+            self.rowmap = [(cubeidx[kk], lastsub[kk] - (lastabs[kk] - self.rowstarts[kk])) for kk in range(nused)]
+        elif dm['type'] == 'TiledCellStMan':
+            self.rowstarts = np.arange(len(self.cubes))
+            self.rowmap = [(kk, None) for kk in range(len(self.cubes))]
+        else:
+            cube = [ii for ii, cc in enumerate(self.cubes) if len(cc['shape']) > 0]
+            self.rowstarts = np.array([0] if len(cube) > 0 else [], dtype=np.int64)
+            self.rowmap = [(cube[0], 0)] if len(cube) > 0 else []
+        self.rowends = np.concatenate([self.rowstarts[1:], [nrow if dm['type'] == 'TiledColumnStMan' else len(self.cubes)]]) if dm['type'] != 'TiledShapeStMan' else lastabs + 1
+        self.mms = {}
+
+    # the bytes of one column in a tile, and the offset of the column within each tile bucket
+    def tilebytes(self, dtype, tile):
+        nelem = int(np.prod(tile))
+        return (nelem + 7) // 8 if dtype == 'bool' else nelem * np.dtype(dtype).itemsize
+
+    # C ordered (row, ...) values of rows c0 to c1 of a cube, TiledCellStMan cubes (c0 is None) are a single cell
+    def readcube(self, ci, cube, c0, c1):
+        shape, tile = list(cube['shape']), list(cube['tile'])
+        if c0 is None: shape, tile, c0, c1 = shape + [1], tile + [1], 0, 1
+        dtype = self.dtypes[ci]
+        ntiles = [-(-ss // tt) for ss, tt in zip(shape, tile)]
+        sizes = [self.tilebytes(dt, tile) for dt in self.dtypes]
+        bucket, coloff = sum(sizes), sum(sizes[:ci])
+        slab = int(np.prod(ntiles[:-1]))
+        t0, t1 = c0 // tile[-1], (c1 - 1) // tile[-1] + 1
+
+        if cube['file'] not in self.mms:
+            self.mms[cube['file']] = np.memmap(self.filename + '_TSM%i' % cube['file'], dtype=np.uint8, mode='r')
+        mm = self.mms[cube['file']]
+        raw = mm[cube['offset'] + t0 * slab * bucket:cube['offset'] + t1 * slab * bucket].reshape(t1 - t0, slab, bucket)[:, :, coloff:coloff + sizes[ci]]
+        tshape = (t1 - t0,) + tuple(ntiles[:-1][::-1]) + tuple(tile[::-1])
+        if dtype == 'bool':
+            data = np.unpackbits(raw, axis=-1, bitorder='little')[..., :int(np.prod(tile))].astype(bool).reshape(tshape)
+        else:
+            data = np.ascontiguousarray(raw).view(self.endian + dtype).astype(dtype).reshape(tshape)
+
+        # interleave the tile and within tile axes of each dimension, then trim the padding of partial tiles
+        ndim = len(shape)
+        data = data.transpose([ax for pair in zip(range(ndim), range(ndim, 2 * ndim)) for ax in pair])
+        data = data.reshape([nt * tt for nt, tt in zip([t1 - t0] + ntiles[:-1][::-1], tile[::-1])])
+        return data[(slice(c0 - t0 * tile[-1], c1 - t0 * tile[-1]),) + tuple([slice(0, ss) for ss in shape[:-1][::-1]])]
+
+    def getcol(self, cd, start, stop):
+        ci = self.columns[cd['name']]
+        cells = [None] * (stop - start)
+        for kk in range(np.searchsorted(self.rowends, start, side='right'), np.searchsorted(self.rowends, stop - 1, side='right') + 1):
+            if kk >= len(self.rowmap): break
+            r0, r1 = max(start, self.rowstarts[kk]), min(stop, self.rowends[kk])
+            if r1 <= r0: continue
+            cube, first = self.rowmap[kk]
+            if first is None:
+                data = self.readcube(ci, self.cubes[cube], None, None)
+            else:
+                data = self.readcube(ci, self.cubes[cube], first + r0 - self.rowstarts[kk], first + r1 - self.rowstarts[kk])
+            cells[r0 - start:r1 - start] = list(data)
+        if (cd['option'] & option_fixedshape) and all([cc is not None for cc in cells]):
+            return np.array(cells).reshape((stop - start,) + tuple(cd['shape'][::-1]))
+        return cells
+
+    # cell shapes (casacore order) of rows start to stop, () for undefined cells, taken from the shapes of the hypercubes
+    def getshapes(self, cd, start, stop):
+        shapes = [()] * (stop - start)
+        for kk in range(np.searchsorted(self.rowends, start, side='right'), np.searchsorted(self.rowends, stop - 1, side='right') + 1):
+            if kk >= len(self.rowmap): break
+            r0, r1 = max(start, self.rowstarts[kk]), min(stop, self.rowends[kk])
+            if r1 <= r0: continue
+            cube, first = self.rowmap[kk]
+            shape = self.cubes[cube]['shape'] if first is None else self.cubes[cube]['shape'][:-1]
+            shapes[r0 - start:r1 - start] = [tuple([int(ss) for ss in shape])] * (r1 - r0)
+        return shapes
+
+
+
+storage_managers = {'StandardStMan': StandardStMan, 'IncrementalStMan': IncrementalStMan, 'TiledColumnStMan': TiledStMan,
+                    'TiledShapeStMan': TiledStMan, 'TiledCellStMan': TiledStMan}
+
+
+
+##################################################################
+# read-only stand in for the casatools table tool, implementing the subset of its interface used by cngi
+# values are returned in the casatools layout: getcol puts the row axis last with the cell axes in casacore order,
+# getvarcol returns a dict of 'r<row+1>' : cell + (1,) shaped arrays (False for undefined cells)
+# taql supports the queries cngi builds: select [distinct] cols from table [where conditions] [orderby cols], with
+# conditions of COL op value or COL IN [values] joined by AND
+class table:
+    def __init__(self, tablename=None, **kwargs):
+        self._name, self._rows, self._columns = None, None, None
+        if tablename is not None: self.open(tablename)
+
+    def open(self, tablename, nomodify=True, lockoptions=None, **kwargs):
+        if not os.path.isfile(os.path.join(tablename, 'table.dat')):
+            raise IOError('%s is not a casacore table' % tablename)
+        self._name, self._rows = tablename, None
+        self._nrow, endian, columns, dms = read_table_dat(tablename)
+        self._desc = dict([(cd['name'], cd) for cd in columns])
+        self._columns = [cd['name'] for cd in columns]
+        self._dms = {}
+        for dm in dms:
+            dmcols = [cd for cd in columns if cd['seqnr'] == dm['seqnr']]
+            if dm['type'] not in storage_managers:
+                print('WARNING : data manager %s of %s is not supported, skipping columns %s' % (dm['type'], tablename, str([cd['name'] for cd in dmcols])))
+                self._columns = [cc for cc in self._columns if cc not in [cd['name'] for cd in dmcols]]
+                continue
+            self._dms[dm['seqnr']] = storage_managers[dm['type']](tablename, dm, dmcols, endian)
+        return True
+
+    # a reference table of selected rows (in the given order) and columns of this one
+    def _reference(self, rows, columns):
+        ref = table()
+        ref._name, ref._nrow, ref._desc, ref._dms = self._name, self._nrow, self._desc, self._dms
+        ref._columns, ref._rows = columns, np.asarray(rows, dtype=np.int64)
+        return ref
+
+    def close(self):
+        self._dms, self._rows = {}, None
+        return True
+
+    def done(self):
+        return self.close()
+
+    def name(self):
+        return self._name
+
+    def nrows(self):
+        return int(self._nrow) if self._rows is None else len(self._rows)
+
+    def colnames(self):
+        return list(self._columns)
+
+    def isvarcol(self, columnname):
+        cd = self._desc[columnname]
+        return bool(cd['isarray'] and not (cd['option'] & option_fixedshape))
+
+    # cells of the given rows (of the underlying table), read in runs of nearby rows
+    # shapes=True returns the cell shapes from the storage manager metadata instead of the cells
+    def _cells(self, columnname, rows, shapes=False):
+        cd = self._desc[columnname]
+        dm = self._dms[cd['seqnr']]
+        getcol = dm.getshapes if shapes else dm.getcol
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0: return []
+        if np.all(np.diff(rows) == 1):
+            return getcol(cd, int(rows[0]), int(rows[-1]) + 1)
+        urows, inverse = np.unique(rows, return_inverse=True)
+        breaks = np.where(np.diff(urows) > 1024)[0] + 1
+        values, islist = [], False
+        for run in np.split(urows, breaks):
+            data = getcol(cd, int(run[0]), int(run[-1]) + 1)
+            islist = isinstance(data, list)
+            values += [[data[ii] for ii in run - run[0]] if islist else data[run - run[0]]]
+        if islist:
+            values = [cell for block in values for cell in block]
+            return [values[ii] for ii in inverse]
+        return np.concatenate(values)[inverse]
+
+    # rows of the underlying table for a casatools startrow, nrow (number of rows returned), rowincr range
+    def _rowrange(self, startrow, nrow, rowincr, local=False):
+        stop = self.nrows() if (nrow is None) or (nrow < 0) else min(self.nrows(), startrow + nrow * rowincr)
+        rows = np.arange(startrow, stop, rowincr)
+        return rows if (self._rows is None) or local else self._rows[rows]
+
+    def iscelldefined(self, columnname, rownr):
+        if not self._desc[columnname]['isarray']: return True
+        if casacore_types.get(self._desc[columnname]['dtype']) != 'str':
+            return len(self.getcolshapes(columnname, rownr, 1)[0]) > 0
+        cell = self._cells(columnname, self._rowrange(rownr, 1, 1))
+        return not (isinstance(cell, list) and cell[0] is None)
+
+    def getcol(self, columnname, startrow=0, nrow=-1, rowincr=1):
+        data = self._cells(columnname, self._rowrange(startrow, nrow, rowincr))
+        if isinstance(data, list):
+            if any([cell is None for cell in data]) or len(set([cell.shape for cell in data])) > 1:
+                raise RuntimeError('column %s of %s does not have a fixed shape in the selected rows, use getvarcol' % (columnname, self._name))
+            data = np.array(data)
+        return data.transpose()
+
+    def getvarcol(self, columnname, startrow=0, nrow=-1, rowincr=1):
+        rows = self._rowrange(startrow, nrow, rowincr, local=True)
+        data = self._cells(columnname, self._rowrange(startrow, nrow, rowincr))
+        return dict([('r%i' % (row + 1), cell.transpose()[..., None] if cell is not None else False) for row, cell in zip(rows, data)])
+
+    def getcell(self, columnname, rownr):
+        data = self._cells(columnname, self._rowrange(rownr, 1, 1))
+        return data[0].transpose() if data[0] is not None else False
+
+    # cell shapes as tuples in casacore axis order, () for undefined cells
+    # numeric array columns are not read, their shapes come from the storage manager metadata
+    def getcolshapes(self, columnname, startrow=0, nrow=-1, rowincr=1):
+        cd = self._desc[columnname]
+        if cd['isarray'] and (casacore_types.get(cd['dtype']) != 'str'):
+            return self._cells(columnname, self._rowrange(startrow, nrow, rowincr), shapes=True)
+        data = self._cells(columnname, self._rowrange(startrow, nrow, rowincr))
+        if not isinstance(data, list):
+            return [tuple(data.shape[1:][::-1])] * len(data)
+        return [tuple(cell.shape[::-1]) if cell is not None else () for cell in data]
+
+    def getcolshapestring(self, columnname, startrow=0, nrow=-1, rowincr=1):
+        return ['[' + ', '.join([str(ss) for ss in shape]) + ']' for shape in self.getcolshapes(columnname, startrow, nrow, rowincr)]
+
+    def taql(self, query):
+        mm = re.match(r'\s*select\s+(distinct\s+)?(.+?)\s+from\s+(\S+)(?:\s+where\s+(.+?))?(?:\s+order\s*by\s+(.+?))?\s*$', query, re.IGNORECASE | re.DOTALL)
+        if mm is None: raise ValueError('unsupported TaQL query : %s' % query)
+        distinct, columns, tablename, where, orderby = mm.groups()
+        base = table(tablename)
+        columns = base.colnames() if columns.strip() == '*' else [cc.strip() for cc in columns.split(',')]
+        rows = np.arange(base.nrows())
+
+        for term in (re.split(r'\s+and\s+|\s*&&\s*', where, flags=re.IGNORECASE) if where is not None else []):
+            tm = re.match(r'\s*(\w+)\s*(==|=|!=|<>|<=|>=|<|>|\s+in\s+)\s*(.+?)\s*$', term, re.IGNORECASE)
+            if tm is None: raise ValueError('unsupported TaQL condition : %s' % term)
+            col, op, value = tm.group(1), tm.group(2).strip().lower(), tm.group(3)
+            values = np.array([vv.strip().strip('\'"') for vv in value.strip('[]').split(',') if len(vv.strip()) > 0])
+            data = base._cells(col, rows)
+            if data.dtype.kind != 'U': values = values.astype(float)
+            if op == 'in':
+                keep = np.isin(data, values)
+            else:
+                keep = {'=': np.equal, '==': np.equal, '!=': np.not_equal, '<>': np.not_equal, '<': np.less, '<=': np.less_equal,
+                        '>': np.greater, '>=': np.greater_equal}[op](data, values[0])
+            rows = rows[keep]
+
+        if distinct:
+            keys = np.stack([np.unique(base._cells(cc, rows), return_inverse=True)[1] for cc in columns], axis=1)
+            rows = rows[np.sort(np.unique(keys, axis=0, return_index=True)[1])]
+        if orderby is not None:
+            keys = [base._cells(cc.strip(), rows) for cc in orderby.split(',')]
+            rows = rows[np.lexsort(keys[::-1])]
+        return base._reference(rows, columns)
@@ -0,0 +1,71 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#################################
+# Helper File
+#
+# Not exposed in API
+#
+#################################
+import numpy as np
+from numcodecs import register_codec, PackBits
+from numcodecs.abc import Codec
+from numcodecs.compat import ensure_ndarray, ndarray_copy
+
+
+
+##################################################################
+# zarr filter storing the real parts of a complex chunk followed by the imaginary parts
+# interleaved real/imag values defeat the shuffle of the compressor, split planes shuffle like any float array
+# the filter is registered with numcodecs on import so zarr can rebuild it from the .zarray metadata
+class ComplexSplit(Codec):
+    codec_id = 'cngi_complex_split'
+
+    def __init__(self, dtype='<c8'):
+        self.dtype = np.dtype(dtype).str
+
+    def encode(self, buf):
+        values = ensure_ndarray(buf).view(self.dtype).reshape(-1)
+        parts = values.view(values.real.dtype).reshape(-1, 2)
+        return np.ascontiguousarray(parts.T)
+
+    def decode(self, buf, out=None):
+        dtype = np.dtype(self.dtype)
+        parts = ensure_ndarray(buf).view(np.empty(0, dtype).real.dtype).reshape(2, -1)
+        values = np.empty(parts.shape[1], dtype=dtype)
+        values.real, values.imag = parts[0], parts[1]
+        return ndarray_copy(values, out)
+
+
+register_codec(ComplexSplit)
+
+
+
+##################################################################
+# zarr encoding of each data variable in xds
+# variables named in encoding use their own entry, the compressor fills in any entry without one
+def variable_encoding(xds, compressor, encoding=None):
+    encoding = {} if encoding is None else encoding
+    return dict([(vv, dict({'compressor': compressor}, **encoding.get(vv, {}))) for vv in xds.data_vars])
+
+
+
+##################################################################
+# encoding with the visibility flags bit packed ahead of the compressor, eight flags to a byte
+# entries already in encoding are kept, the flags are unpacked chunk by chunk when they are read
+def flag_encoding(compressor, encoding=None):
+    encoding = {} if encoding is None else dict(encoding)
+    for vv in ['FLAG', 'FLAG_ROW']:
+        encoding.setdefault(vv, {'compressor': compressor, 'filters': [PackBits()]})
+    return encoding
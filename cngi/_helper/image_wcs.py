@@ -0,0 +1,115 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#################################
+# Helper File
+#
+# Not exposed in API
+#
+#################################
+import numpy as np
+import dask.array as da
+
+
+# FITS axis type prefixes of the casacore direction reference frames
+frame_ctypes = {'GALACTIC': ('GLON', 'GLAT'), 'SUPERGAL': ('SLON', 'SLAT'), 'ECLIPTIC': ('ELON', 'ELAT'), 'AZEL': ('ALON', 'ALAT')}
+
+
+
+##################################################################
+# compact FITS style description of the spherical (direction) axes of an image
+# stored in the image attributes as 'direction_wcs' in place of dense per pixel coordinate grids
+# direction is the 'direction0' record of a casatools coordsys torecord(), angles are in degrees and crpix is 1-based
+# names and dims are the coordinate names and image dimensions of the longitude and latitude axes
+def direction_wcs(direction, names, dims, to_degrees):
+    lon, lat = frame_ctypes.get(str(direction['system']).upper(), ('RA', 'DEC'))
+    proj = str(direction['projection'])
+    wcs = {'names': list(names), 'dims': list(dims),
+           'ctype': [lon + '-' * (5 - len(lon)) + proj, lat + '-' * (5 - len(lat)) + proj],
+           'crval': [to_degrees(vv, uu) for vv, uu in zip(direction['crval'], direction['units'])],
+           'cdelt': [to_degrees(vv, uu) for vv, uu in zip(direction['cdelt'], direction['units'])],
+           'crpix': [float(vv) + 1 for vv in direction['crpix']],
+           'pc': np.array(direction['pc'], dtype=float).reshape(2, 2).tolist(),
+           'pv': [float(vv) for vv in np.array(direction.get('projection_parameters', [])).ravel()],
+           'lonpole': float(direction.get('longpole', 180.0)), 'latpole': float(direction.get('latpole', 0.0)),
+           'radesys': str(direction['system'])}
+    return wcs
+
+
+
+##################################################################
+# astropy WCS of a direction_wcs description
+def astropy_wcs(wcs):
+    from astropy.wcs import WCS
+    ww = WCS(naxis=2)
+    ww.wcs.ctype, ww.wcs.crval, ww.wcs.cdelt, ww.wcs.crpix = wcs['ctype'], wcs['crval'], wcs['cdelt'], wcs['crpix']
+    ww.wcs.pc = np.array(wcs['pc'])
+    ww.wcs.lonpole, ww.wcs.latpole = wcs['lonpole'], wcs['latpole']
+    if len(wcs['pv']) > 0: ww.wcs.set_pv([(2, ii + 1, vv) for ii, vv in enumerate(wcs['pv'])])
+    return ww
+
+
+
+##################################################################
+# world coordinates in radians of one spatial tile, x and y are the pixel indices along the two direction axes
+# returns a (2, len(x), len(y)) block of longitude and latitude
+def tile_world(x, y, wcs=None):
+    xx, yy = np.meshgrid(x, y, indexing='ij')
+    lon, lat = astropy_wcs(wcs).wcs_pix2world(xx, yy, 0)
+    return np.deg2rad(np.stack([lon, lat]))
+
+
+
+##################################################################
+# dict of lazy longitude / latitude coordinates for an image of the given spatial shape
+# each spatial tile of the chunks is computed on demand, nothing scales with the image area until values are used
+def world_coords(wcs, shape, chunks=(-1, -1)):
+    chunks = [cc if (cc is not None) and (cc > 0) else ss for cc, ss in zip(chunks, shape)]
+    x, y = da.arange(shape[0], chunks=chunks[0]), da.arange(shape[1], chunks=chunks[1])
+    world = da.blockwise(tile_world, 'kij', x, 'i', y, 'j', new_axes={'k': 2}, dtype=float, wcs=wcs)
+    return dict([(name, (tuple(wcs['dims']), world[ii])) for ii, name in enumerate(wcs['names'])])
+
+
+
+##################################################################
+# add the lazy world coordinates described by the 'direction_wcs' attribute to an image dataset that lacks them
+def assign_world_coords(xds):
+    wcs = xds.attrs.get('direction_wcs')
+    if (wcs is None) or all([name in xds.coords for name in wcs['names']]):
+        return xds
+    chunks = [xds.chunks[dd][0] if (xds.chunks is not None) and (dd in xds.chunks) else xds.sizes[dd] for dd in wcs['dims']]
+    return xds.assign_coords(world_coords(wcs, [xds.sizes[dd] for dd in wcs['dims']], chunks))
+
+
+
+##################################################################
+# direction_wcs description of the celestial axes of an astropy WCS (ie from a FITS header)
+# lng and lat are the (0-based) WCS axis numbers of the longitude and latitude axes
+# FK5 and FK4 at their standard equinoxes are stored as the casacore J2000 and B1950 frames, any other equinox is kept as 'equinox'
+def fits_direction_wcs(ww, lng, lat, names, dims):
+    pc, cdelt = ww.wcs.get_pc(), ww.wcs.get_cdelt()
+    pv = dict([(mm, vv) for ii, mm, vv in ww.wcs.get_pv() if ii == lat + 1])
+    wcs = {'names': list(names), 'dims': list(dims),
+           'ctype': [ww.wcs.ctype[lng], ww.wcs.ctype[lat]],
+           'crval': [float(ww.wcs.crval[lng]), float(ww.wcs.crval[lat])],
+           'cdelt': [float(cdelt[lng]), float(cdelt[lat])],
+           'crpix': [float(ww.wcs.crpix[lng]), float(ww.wcs.crpix[lat])],
+           'pc': [[float(pc[lng, lng]), float(pc[lng, lat])], [float(pc[lat, lng]), float(pc[lat, lat])]],
+           'pv': [float(pv.get(mm, 0.0)) for mm in range(1, max(list(pv.keys()) + [0]) + 1)],
+           'lonpole': float(ww.wcs.lonpole), 'latpole': float(ww.wcs.latpole),
+           'radesys': str(ww.wcs.radesys) if len(ww.wcs.radesys) > 0 else 'ICRS'}
+    equinox = float(ww.wcs.equinox) if np.isfinite(ww.wcs.equinox) else None
+    wcs['radesys'] = {('FK5', 2000.0): 'J2000', ('FK4', 1950.0): 'B1950'}.get((wcs['radesys'], equinox), wcs['radesys'])
+    if (equinox is not None) and (wcs['radesys'] not in ['J2000', 'B1950', 'ICRS']): wcs['equinox'] = equinox
+    return wcs
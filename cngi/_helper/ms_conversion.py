@@ -0,0 +1,622 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#################################
+# Helper File
+#
+# Not exposed in API
+#
+#################################
+import os
+import json
+try:
+    from casatools import table as tb
+except ImportError:  # read the tables natively when CASA is not installed
+    from cngi._helper.casacore_tables import table as tb
+from numcodecs import Blosc
+import xarray
+import numpy as np
+import time
+import queue
+import threading
+from numba import jit
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from cngi._helper.table_conversion import convert_time, compute_dimensions, read_columns, fill_value
+from cngi._helper.zarr_regions import write_zarr_template, write_zarr_region, consolidate_metadata
+from cngi._helper.codecs import variable_encoding
+from cngi._helper.vis_index import write_chunk_stats
+
+warnings.filterwarnings('ignore', category=FutureWarning)
+
+
+
+##################################################################
+# run a list of processing stages over a sequence of items with each stage in its own thread
+# stages are connected by queues holding at most depth items, so a fast stage can only run depth items ahead
+# the output of each stage is the input of the next, the output of the last stage is discarded
+# stages run their items in order, so the last stage sees the items in the same order as they were given
+# the first exception raised by any stage stops further work and is re-raised here once all threads have exited
+_end_of_pipeline = object()
+
+def run_pipeline(items, stages, depth=2):
+    queues = [queue.Queue(maxsize=depth) for _ in stages]
+    errors = []
+
+    def feed():
+        for item in items:
+            if len(errors) > 0: break
+            queues[0].put(item)
+        queues[0].put(_end_of_pipeline)
+
+    def work(stage, qin, qout):
+        while True:
+            item = qin.get()
+            if item is _end_of_pipeline:
+                if qout is not None: qout.put(_end_of_pipeline)
+                return
+            if len(errors) > 0: continue  # keep draining the queue so upstream stages never block after a failure
+            try:
+                result = stage(item)
+                if qout is not None: qout.put(result)
+            except Exception as ee:
+                errors.append(ee)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=work, args=(stage, queues[ii], queues[ii + 1] if ii + 1 < len(stages) else None), daemon=True)
+                for ii, stage in enumerate(stages)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    if len(errors) > 0:
+        raise errors[0]
+
+
+
+##################################################################
+# layout of each support table in the global partition
+# prefix : prefix of the data variable names made from the table columns
+# rowdim/names : dimension for the table rows, with the unique-ified values of the names column as its coordinate (or row numbers)
+# keys : alternatively, columns whose values index the data variables (dict of column : dimension) in place of the row
+# skip : columns not converted, varcols=False skips all variable shaped columns
+# cell_order : keep variable shaped cells in their stored axis order instead of transposing them like getcol
+# vardims : explicit dimension names for the cell axes of some columns, None for the default d<size> name
+support_tables = {
+    'ANTENNA': {'prefix': 'ANT_', 'rowdim': 'antenna'},
+    'FEED': {'prefix': 'FEED_', 'keys': {'SPECTRAL_WINDOW_ID': 'spw', 'ANTENNA_ID': 'antenna', 'FEED_ID': 'feed'}, 'cell_order': True,
+             'vardims': {'BEAM_OFFSET': ['d2', 'receptors'], 'POL_RESPONSE': ['receptors', None], 'POLARIZATION_TYPE': ['receptors'],
+                         'RECEPTOR_ANGLE': ['receptors']}},
+    'FIELD': {'prefix': 'FIELD_', 'rowdim': 'field', 'names': 'NAME', 'cell_order': True},
+    'FLAG_CMD': {'prefix': 'FCMD_', 'keys': {'TIME': 'time_fcmd'}},
+    'HISTORY': {'prefix': 'FCMD_', 'keys': {'TIME': 'time_hist'}, 'skip': ['CLI_COMMAND', 'APP_PARAMS']},
+    'OBSERVATION': {'prefix': 'OBS_', 'rowdim': 'observation', 'names': 'PROJECT', 'skip': ['LOG', 'SCHEDULE']},
+    'PROCESSOR': {'prefix': 'PROC_', 'rowdim': 'processor', 'names': 'TYPE', 'varcols': False},
+    'SOURCE': {'prefix': 'SRC_', 'keys': {'SPECTRAL_WINDOW_ID': 'spw', 'SOURCE_ID': 'source'}, 'cell_order': True},
+    'STATE': {'prefix': 'STATE_', 'rowdim': 'state', 'names': 'OBS_MODE', 'varcols': False},
+}
+
+
+
+##################################################################
+# replace duplicate names with "name (row)" so they can serve as a coordinate index
+def unique_names(names):
+    funique, fidx, fcount = np.unique(names, return_inverse=True, return_counts=True)
+    return [funique[ii] if fcount[ii] == 1 else funique[ii] + ' (%s)' % str(nn) for nn, ii in enumerate(fidx)]
+
+
+
+##################################################################
+# convert one support table of an MS to data variables and coordinates of the global partition, using a layout from support_tables
+# all columns are read by the chunked and vectorized table_conversion.read_columns, then placed by their key columns in one
+# fancy-index assignment per column.  Ids of dimensions in sizes (shared by several tables, ie antenna) index directly in to
+# at least that many elements, other key values are replaced by their index in the sorted unique values
+def convert_support_table(infile, table, sizes={}, prefix='', rowdim=None, names=None, keys={}, skip=[], varcols=True, cell_order=False, vardims={}):
+    mvars, mcoords = {}, {}
+    if not os.path.isdir(os.path.join(infile, table)): return mvars, mcoords
+    tb_tool = tb()
+    tb_tool.open(os.path.join(infile, table), nomodify=True, lockoptions={'option': 'usernoread'})
+    nrows = tb_tool.nrows()
+    if nrows == 0:
+        tb_tool.close()
+        return mvars, mcoords
+    columns = read_columns(tb_tool, skip=skip, timecols=['TIME', 'TIME_RANGE'], varcols=varcols, cell_order=cell_order)
+    tb_tool.close()
+
+    if len(keys) == 0:
+        mcoords[rowdim] = unique_names(columns.pop(names)) if names is not None else np.arange(nrows)
+        dims, shape, idxs = [rowdim], (nrows,), None
+    else:
+        dims, shape, idxs = list(keys.values()), [], []
+        for col, dim in keys.items():
+            if dim in sizes:
+                idx = columns.pop(col)
+                mcoords[dim] = np.arange(max(sizes[dim], np.max(idx) + 1))
+            else:
+                mcoords[dim], idx = np.unique(columns.pop(col), return_inverse=True)
+            shape, idxs = shape + [len(mcoords[dim])], idxs + [idx]
+        if len(np.unique(np.stack(idxs, axis=1), axis=0)) != nrows:
+            print('WARNING: index mismatch in %s table' % table)
+
+    for col, data in columns.items():
+        try:
+            if idxs is not None:
+                fulldata = np.full(tuple(shape) + data.shape[1:], fill_value(data.dtype), dtype=data.dtype)
+                fulldata[tuple(idxs)] = data
+                data = fulldata
+            cdims = vardims.get(col, [None] * (data.ndim - len(dims)))
+            cdims = [cd if cd is not None else 'd' + str(data.shape[len(dims) + ii]) for ii, cd in enumerate(cdims)]
+            mvars[prefix + col] = xarray.DataArray(data, dims=dims + cdims)
+        except Exception:
+            print('WARNING : unable to process col %s of table %s' % (col, table))
+
+    return mvars, mcoords
+
+
+
+##################################################################
+# build the data variables, coordinates and attributes of the global partition from the support tables of an MS
+# the tables in support_tables are converted concurrently (table reads release the GIL), remaining tables go to attributes
+def convert_support_tables(infile, workers=1):
+    mvars, mcoords, mattrs = {}, {}, {}
+
+    # sizes of the dimensions shared between tables, ids in the tables index directly in to these
+    sizes = {}
+    for table, dim in [('ANTENNA', 'antenna'), ('SPECTRAL_WINDOW', 'spw')]:
+        if not os.path.isdir(os.path.join(infile, table)): continue
+        tb_tool = tb()
+        tb_tool.open(os.path.join(infile, table), nomodify=True, lockoptions={'option': 'usernoread'})
+        sizes[dim] = tb_tool.nrows()
+        tb_tool.close()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = dict([(executor.submit(convert_support_table, infile, table, sizes, **support_tables[table]), table) for table in support_tables])
+        for future in as_completed(futures):
+            print('processed support table %s' % futures[future])
+            tvars, tcoords = future.result()
+            mvars.update(tvars)
+            mcoords.update(tcoords)
+
+    # cell axes given explicit names need a coordinate
+    for dim in ['receptors']:
+        dsizes = [mvars[vv].sizes[dim] for vv in mvars if dim in mvars[vv].dims]
+        if len(dsizes) > 0: mcoords[dim] = np.arange(max(dsizes))
+
+    # remaining junk for the attributes section, POINTING is streamed to its own group by convert_pointing
+    tables = list(support_tables.keys()) + ['DATA_DESCRIPTION', 'SPECTRAL_WINDOW', 'POLARIZATION', 'SORTED_TABLE', 'POINTING']
+    other_tables = [tt for tt in os.listdir(infile) if os.path.isdir(os.path.join(infile, tt)) and tt not in tables]
+    other_tables = dict([(tt, tt[:4] + '_') for tt in other_tables])
+    ms_meta = tb()
+    for ii, tt in enumerate(other_tables.keys()):
+        print('processing support table %s of %s : %s' % (str(ii), str(len(other_tables.keys())), tt), end='\r')
+        ms_meta.open(os.path.join(infile, tt), nomodify=True, lockoptions={'option': 'usernoread'})
+        if ms_meta.nrows() == 0:
+            ms_meta.close()
+            continue
+        for col in ms_meta.colnames():
+            if not ms_meta.iscelldefined(col, 0): continue
+            if ms_meta.isvarcol(col):
+                data = ms_meta.getvarcol(col)
+                data = [data['r' + str(kk)].tolist() if not isinstance(data['r' + str(kk)], bool) else [] for kk in np.arange(len(data)) + 1]
+                mattrs[(other_tables[tt] + col).lower()] = data
+            else:
+                data = ms_meta.getcol(col).transpose()
+                mattrs[(other_tables[tt] + col).lower()] = data.tolist()
+        ms_meta.close()
+
+    return mvars, mcoords, mattrs
+
+
+##################################################################
+# convert the POINTING table of an MS to a (time_point, antenna, ...) zarr group, streamed in batches of time steps
+# POINTING can be far larger than the rest of the support tables, so it is never held in memory whole: rows are read by
+# row range (ordered by time, so each batch of times is a contiguous range), scattered in to their batch and written
+# directly in to their region of arrays created up front, like the main table DDIs
+# n_antenna is the size of the antenna dimension of the global partition (antenna ids index directly in to it)
+# batches are time_chunk time steps, or sized from max_memory GB when given
+# returns the lazy (dask backed) dataset reopened from outfile, or the dask chunked batches when nofile is True
+def convert_pointing(infile, outfile, n_antenna=0, compressor=None, time_chunk=10000, nofile=False, max_memory=None):
+    if compressor is None:
+        compressor = Blosc(cname='zstd', clevel=2, shuffle=0)
+
+    if not os.path.isdir(os.path.join(infile, 'POINTING')): return None
+    tb_tool = tb()
+    tb_tool.open(os.path.join(infile, 'POINTING'), nomodify=True, lockoptions={'option': 'usernoread'})
+    if tb_tool.nrows() == 0:
+        tb_tool.close()
+        return None
+    pt = tb_tool.taql('select * from %s ORDERBY TIME,ANTENNA_ID' % os.path.join(infile, 'POINTING'))
+
+    times, ants = pt.getcol('TIME'), pt.getcol('ANTENNA_ID')
+    utimes, tidxs = np.unique(times, return_inverse=True)
+    n_time, n_antenna = len(utimes), max(n_antenna, np.max(ants) + 1)
+    dimensions = compute_dimensions(pt)
+    batchsize = min(time_chunk, n_time)
+    if max_memory is not None:
+        batchsize = compute_batchsize(pt, n_time, n_antenna, batchsize, max_memory, exclude=['TIME', 'ANTENNA_ID'] + dimensions[1])
+
+    full_coords = {'time_point': convert_time(utimes), 'antenna': np.arange(n_antenna)}
+    rowstarts = np.searchsorted(tidxs, np.arange(0, n_time + batchsize, batchsize))
+    xds_list = []
+    for bb, tt in enumerate(range(0, n_time, batchsize)):
+        print('processing pointing times %s of %s' % (str(tt), str(n_time)), end='\r')
+        rows = slice(rowstarts[bb], rowstarts[bb + 1])
+        columns = read_columns(pt, skip=['TIME', 'ANTENNA_ID'], startrow=rows.start, nrow=rows.stop - rows.start, dimensions=dimensions)
+        nt = min(batchsize, n_time - tt)
+
+        mvars = {}
+        for col, data in columns.items():
+            fulldata = np.full((nt, n_antenna) + data.shape[1:], fill_value(data.dtype), dtype=data.dtype)
+            fulldata[tidxs[rows] - tt, ants[rows]] = data
+            mvars['POINT_' + col] = xarray.DataArray(fulldata, dims=['time_point', 'antenna'] + ['d' + str(ii) for ii in data.shape[1:]])
+        xds = xarray.Dataset(mvars, coords={'time_point': full_coords['time_point'][tt:tt + nt], 'antenna': full_coords['antenna']})
+
+        if nofile:
+            xds_list += [xds.chunk({'time_point': batchsize})]
+            continue
+        if tt == 0:
+            encoding = variable_encoding(xds, compressor)
+            write_zarr_template(xds, outfile, 'time_point', n_time, chunks={'time_point': batchsize}, coords=full_coords, encoding=encoding)
+        write_zarr_region(xds, outfile, 'time_point', tt)
+
+    pt.close()
+    tb_tool.close()
+    if nofile:
+        return xarray.concat(xds_list, dim='time_point')
+    consolidate_metadata(outfile)
+    return xarray.open_zarr(outfile)
+
+
+
+
+##################################################################
+# build the TaQL where clause selecting main table rows by field, scan and time range, empty string if no selection
+# fields may be ids or names (all rows of the FIELD table with a matching name are selected), None if no field matches
+# time_range is a (start, end) pair of anything numpy.datetime64 accepts, converted back to the MS seconds since 1858-11-17
+def selection_taql(infile, fields=None, scans=None, time_range=None):
+    clauses = []
+    if fields is not None:
+        fields = list(np.atleast_1d(fields))
+        field_ids = [int(ff) for ff in fields if not isinstance(ff, str)]
+        if any([isinstance(ff, str) for ff in fields]):
+            field_tb = tb()
+            field_tb.open(os.path.join(infile, 'FIELD'), nomodify=True, lockoptions={'option': 'usernoread'})
+            names = np.array(field_tb.getcol('NAME'))
+            field_tb.close()
+            field_ids += [int(ff) for ff in np.where(np.isin(names, [ff for ff in fields if isinstance(ff, str)]))[0]]
+        if len(field_ids) == 0:
+            print('######### ERROR : no field of %s matches %s' % (infile, ', '.join([str(ff) for ff in fields])))
+            return None
+        clauses += ['FIELD_ID IN [%s]' % ','.join([str(ff) for ff in sorted(set(field_ids))])]
+    if scans is not None:
+        clauses += ['SCAN_NUMBER IN [%s]' % ','.join([str(int(ss)) for ss in np.atleast_1d(scans)])]
+    if time_range is not None:
+        correction = 3506716800.0
+        tr = [(np.datetime64(tt, 'ns') - np.datetime64(0, 'ns')) / np.timedelta64(1, 's') + correction for tt in time_range]
+        clauses += ['TIME >= %.6f AND TIME <= %.6f' % (tr[0], tr[1])]
+    return ' AND '.join(clauses)
+
+
+##################################################################
+# conversion manifests record the progress of a partition so that an interrupted conversion can be resumed
+# each partition (ddi or global) keeps its own json file next to its zarr metadata, so concurrent DDIs never share one
+# the file is replaced atomically so a crash leaves either the old or the new manifest, never a partial one
+manifest_name = 'conversion_manifest.json'
+
+def read_manifest(partition):
+    manifest_file = os.path.join(partition, manifest_name)
+    if not os.path.exists(manifest_file): return {}
+    try:
+        with open(manifest_file, 'r') as fid:
+            return json.load(fid)
+    except ValueError:
+        print('WARNING : unreadable conversion manifest %s, partition will be converted again' % manifest_file)
+        return {}
+
+
+def write_manifest(partition, manifest):
+    manifest_file = os.path.join(partition, manifest_name)
+    with open(manifest_file + '.tmp', 'w') as fid:
+        json.dump(manifest, fid)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+##################################################################
+# number of batches that may be held in memory at once by the read/scatter/write pipeline of convert_ddi
+# one in each of the three stages plus pipeline_depth waiting in each of the two queues between them
+pipeline_depth = 1
+batches_in_flight = 3 + 2 * pipeline_depth
+
+
+##################################################################
+# compute the number of time steps per batch that keeps the conversion of a DDI within max_memory GB
+# the size of one time step is measured from the first row of every column to be converted (times the number of baselines),
+# counted twice for the column as read from the table and its scattered (time, baseline, ...) copy
+# batches are whole multiples of the time chunk size when at least one chunk fits, so each batch covers complete zarr chunks
+def compute_batchsize(ms_ddi, n_time, n_baseline, time_chunk, max_memory, exclude=[]):
+    row_bytes = 0
+    for col in ms_ddi.colnames():
+        if col in exclude: continue
+        if not ms_ddi.iscelldefined(col, 0): continue
+        row_bytes += np.asarray(ms_ddi.getcol(col, 0, 1)).nbytes
+    time_bytes = 2 * n_baseline * max(row_bytes, 1)
+
+    batchsize = int(max_memory * 1024 ** 3 // (time_bytes * batches_in_flight))
+    if batchsize >= time_chunk:
+        batchsize = (batchsize // time_chunk) * time_chunk
+    if batchsize < 1:
+        print('WARNING : a single time step needs %.3f GB, more than the memory budget allows' % (time_bytes * batches_in_flight / 1024 ** 3))
+    return int(min(max(batchsize, 1), n_time))
+
+
+##################################################################
+# scatter the rows of one main table column in to a preallocated (time, baseline, ...) buffer in a single pass
+# rows must be sorted by time then baseline index (the ORDERBY TIME,ANTENNA1,ANTENNA2 of the ddi selection guarantees this)
+# so the output cells and the input rows are walked together, holes with no matching row are set to the fill value
+# data and out are viewed as (row, d1, d2) and (time, baseline, d1, d2) so one kernel handles every column shape
+# returns the number of rows consumed, which is less than the number of rows if they were not sorted
+@jit(nopython=True, cache=True, nogil=True)
+def _scatter_rows(data, time_idxs, baseline_idxs, fill, out):
+    n_row = data.shape[0]
+    rr = 0
+    for tt in range(out.shape[0]):
+        for bb in range(out.shape[1]):
+            if (rr < n_row) and (time_idxs[rr] == tt) and (baseline_idxs[rr] == bb):
+                while (rr < n_row) and (time_idxs[rr] == tt) and (baseline_idxs[rr] == bb):  # duplicate rows, last one wins
+                    for ii in range(out.shape[2]):
+                        for jj in range(out.shape[3]):
+                            out[tt, bb, ii, jj] = data[rr, ii, jj]
+                    rr += 1
+            else:
+                for ii in range(out.shape[2]):
+                    for jj in range(out.shape[3]):
+                        out[tt, bb, ii, jj] = fill[0]
+    return rr
+
+
+def scatter_column(data, time_idxs, baseline_idxs, fill, out):
+    data3 = data.reshape(data.shape + (1,) * (3 - data.ndim)) if data.ndim < 3 else data
+    out4 = out.reshape(out.shape + (1,) * (4 - out.ndim)) if out.ndim < 4 else out
+    if _scatter_rows(data3, time_idxs, baseline_idxs, fill, out4) != data.shape[0]:
+        # rows out of order, fall back to fancy indexing
+        out[...] = fill[0]
+        out[time_idxs, baseline_idxs] = data
+    return out
+
+
+##################################################################
+# convert the main table rows of a single DDI of an MS to a CNGI xarray/zarr partition
+# this is self contained (opens its own table tools) so that it can be shipped to a separate process or dask worker
+# global_coords is a dict of the field/processor/observation/state coordinate values of the global partition
+# verbose=False suppresses the per-chunk progress line, used when several DDIs are being converted concurrently
+# max_memory is the memory budget in GB for this DDI, used to size the time batches instead of the time chunk size
+# resume=True continues from the conversion manifest of a previous run, skipping the DDI if it completed or the batches already written
+# columns limits the main table columns converted to data variables, selection is a TaQL where clause from selection_taql
+# returns None if no rows of this DDI are selected
+def convert_ddi(infile, outfile, ddi, global_coords={}, compressor=None, chunk_shape=(100, 400, 20, 1), nofile=False, verbose=True, max_memory=None,
+                resume=False, columns=None, selection='', encoding=None, chunk_stats=False):
+    if compressor is None:
+        compressor = Blosc(cname='zstd', clevel=2, shuffle=0)
+
+    ddi_outfile = outfile + '/' + str(ddi)
+    manifest = read_manifest(ddi_outfile) if (resume and not nofile) else {}
+    if manifest.get('complete', False):
+        print('ddi %s already converted, skipping' % str(ddi))
+        return xarray.open_zarr(ddi_outfile)
+
+    print('Processing ddi', ddi)
+    start_ddi = time.time()
+
+    # Open measurement set (ms) select ddi and sort main table by TIME,ANTENNA1,ANTENNA2
+    # column and row selections are part of the query so unselected data is never read
+    tb_tool = tb()
+    tb_tool.open(infile, nomodify=True, lockoptions={'option': 'usernoread'})  # allow concurrent reads
+    select_cols = '*'
+    if columns is not None:
+        keep = ['TIME', 'ANTENNA1', 'ANTENNA2', 'FIELD_ID', 'SCAN_NUMBER', 'INTERVAL', 'PROCESSOR_ID', 'OBSERVATION_ID', 'STATE_ID']
+        missing = [cc for cc in columns if cc.upper() not in tb_tool.colnames()]
+        if len(missing) > 0: print('WARNING : columns %s not found in %s' % (str(missing), infile))
+        select_cols = ','.join([cc for cc in tb_tool.colnames() if cc in keep + [col.upper() for col in columns]])
+    where = 'DATA_DESC_ID = %s' % str(ddi) + (' AND ' + selection if len(selection) > 0 else '')
+    ms_ddi = tb_tool.taql('select %s from %s where %s ORDERBY TIME,ANTENNA1,ANTENNA2' % (select_cols, infile, where))
+    print('ddi %s selecting and sorting time ' % str(ddi), time.time() - start_ddi)
+    start_ddi = time.time()
+
+    if ms_ddi.nrows() == 0:
+        print('ddi %s has no rows in the selection, skipping' % str(ddi))
+        ms_ddi.close()
+        tb_tool.close()
+        return None
+
+    tdata = ms_ddi.getcol('TIME')
+    times = convert_time(tdata)
+    unique_times, time_changes, time_idxs = np.unique(times, return_index=True, return_inverse=True)
+    n_time = unique_times.shape[0]
+
+    ant1_col = np.array(ms_ddi.getcol('ANTENNA1'))
+    ant2_col = np.array(ms_ddi.getcol('ANTENNA2'))
+    ant1_ant2 = np.hstack((ant1_col[:, np.newaxis], ant2_col[:, np.newaxis]))
+    unique_baselines, baseline_idxs = np.unique(ant1_ant2, axis=0, return_inverse=True)
+    n_baseline = unique_baselines.shape[0]
+
+    # look up spw and pol ids as starting point
+    tb_tool_meta = tb()
+    tb_tool_meta.open(infile + "/DATA_DESCRIPTION", nomodify=True, lockoptions={'option': 'usernoread'})
+    spw_id = tb_tool_meta.getcol("SPECTRAL_WINDOW_ID")[ddi]
+    pol_id = tb_tool_meta.getcol("POLARIZATION_ID")[ddi]
+    tb_tool_meta.close()
+
+    ###################
+    # build metadata structure from remaining spw-specific table fields
+    aux_coords = {'time': unique_times, 'spw': np.array([spw_id]), 'antennas': (['baseline', 'pair'], unique_baselines)}
+    meta_attrs = {'ddi': ddi, 'auto_correlations': int(np.any(ant1_col == ant2_col))}
+    tb_tool_meta.open(os.path.join(infile, 'SPECTRAL_WINDOW'), nomodify=True, lockoptions={'option': 'usernoread'})
+    for col in tb_tool_meta.colnames():
+        try:
+            if not tb_tool_meta.iscelldefined(col, spw_id): continue
+            if col in ['FLAG_ROW']: continue
+            if col in ['CHAN_FREQ', 'CHAN_WIDTH', 'EFFECTIVE_BW', 'RESOLUTION']:
+                aux_coords[col.lower()] = ('chan', tb_tool_meta.getcol(col, spw_id, 1)[:, 0])
+            else:
+                meta_attrs[col.lower()] = tb_tool_meta.getcol(col, spw_id, 1).transpose()[0]
+        except Exception:
+            print('WARNING : unable to process col %s of table %s' % (col, 'SPECTRAL_WINDOW'))
+    tb_tool_meta.close()
+
+    tb_tool_meta.open(os.path.join(infile, 'POLARIZATION'), nomodify=True, lockoptions={'option': 'usernoread'})
+    for col in tb_tool_meta.colnames():
+        if col == 'CORR_TYPE':
+            aux_coords[col.lower()] = ('pol', tb_tool_meta.getcol(col, pol_id, 1)[:, 0])
+        elif col == 'CORR_PRODUCT':
+            aux_coords[col.lower()] = (['receptor', 'pol'], tb_tool_meta.getcol(col, pol_id, 1)[:, :, 0])
+    tb_tool_meta.close()
+
+    n_chan = len(aux_coords['chan_freq'][1])
+    n_pol = len(aux_coords['corr_type'][1])
+
+    # overwrite chunk shape axis with -1 values
+    ddi_chunk_shape = [cs if cs > 0 else [n_time, n_baseline, n_chan, n_pol][ci] for ci, cs in enumerate(chunk_shape)]
+
+    coords = {'time': unique_times, 'baseline': np.arange(n_baseline), 'chan': aux_coords.pop('chan_freq')[1],
+              'pol': aux_coords.pop('corr_type')[1], 'uvw_index': np.array(['uu', 'vv', 'ww'])}
+
+    # per-time coordinates are read once for the whole DDI so that the complete coordinates are known before the first batch
+    # id columns without a matching coordinate in the global partition are left as regular data variables
+    time_coords, coord_cols = {}, []
+    for col, name in [('FIELD_ID', 'field'), ('SCAN_NUMBER', 'scan'), ('INTERVAL', 'interval'), ('PROCESSOR_ID', 'processor'),
+                      ('OBSERVATION_ID', 'observation'), ('STATE_ID', 'state')]:
+        if (col not in ms_ddi.colnames()) or (not ms_ddi.iscelldefined(col, 0)): continue
+        if (name not in ['scan', 'interval']) and (name not in global_coords): continue
+        data = ms_ddi.getcol(col)[time_changes]
+        time_coords[name] = data if name in ['scan', 'interval'] else global_coords[name][data]
+        if col == 'FIELD_ID': time_coords['field_id'] = data  # need this for numba code in ngcasa imagin code
+        coord_cols += [col]
+
+    # if not writing to file, entire main table will be read in to memory at once
+    # otherwise batch by the time chunk size, or by as many time steps as fit in the memory budget when one is given
+    batchsize = n_time if nofile else ddi_chunk_shape[0]
+    if (max_memory is not None) and (not nofile):
+        batchsize = compute_batchsize(ms_ddi, n_time, n_baseline, ddi_chunk_shape[0], max_memory, exclude=['DATA_DESC_ID', 'TIME', 'ANTENNA1', 'ANTENNA2'] + coord_cols)
+
+    # an interrupted run can only be continued if the partition layout is unchanged, its batching is then reused
+    layout = {'n_time': int(n_time), 'n_baseline': int(n_baseline), 'n_chan': int(n_chan), 'n_pol': int(n_pol), 'chunk_shape': [int(cs) for cs in ddi_chunk_shape],
+              'columns': select_cols, 'selection': selection}
+    if manifest.get('layout') == layout:
+        batchsize = manifest['batchsize']
+        print('ddi %s resuming with %s batches already written' % (str(ddi), str(len(manifest['completed_batches']))))
+    elif len(manifest) > 0:
+        print('ddi %s layout changed since the previous run, converting again' % str(ddi))
+        manifest = {}
+
+    print('ddi %s n_time:' % str(ddi), n_time, '  n_baseline:', n_baseline, '  n_chan:', n_chan, '  n_pol:', n_pol, ' chunking: ', ddi_chunk_shape, ' batchsize: ', batchsize)
+
+    ddi_chunks = {'time': ddi_chunk_shape[0], 'baseline': ddi_chunk_shape[1], 'chan': ddi_chunk_shape[2], 'pol': ddi_chunk_shape[3], 'uvw_index': None}
+
+    ###################
+    # main table loop over each batch
+    # the table reads, the scatter in to (time, baseline, ...) arrays and the compression/write of each batch run in
+    # their own threads connected by bounded queues, so the reads of batch N+1 overlap the write of batch N
+    def read_batch(cc):
+        start_row_indx = cc * batchsize
+        chunk = np.arange(min(batchsize, n_time - start_row_indx)) + start_row_indx
+        end_idx = time_changes[chunk[-1] + 1] if chunk[-1] + 1 < len(time_changes) else len(time_idxs)
+        idx_range = np.arange(time_changes[chunk[0]], end_idx)  # indices (rows) in main table to be read
+        coldata = {}
+        for col in ms_ddi.colnames():
+            if col in ['DATA_DESC_ID', 'TIME', 'ANTENNA1', 'ANTENNA2'] + coord_cols: continue
+            if not ms_ddi.iscelldefined(col, idx_range[0]): continue
+            coldata[col] = ms_ddi.getcol(col, idx_range[0], len(idx_range)).transpose()
+        return cc, chunk, idx_range, coldata
+
+    # scatter buffers are recycled by the writer once a batch is on disk, so there are only as many buffer sets as batches in flight
+    buffer_pool = queue.Queue()
+
+    def scatter_batch(batch):
+        cc, chunk, idx_range, coldata = batch
+        bcoords = dict(coords, time=unique_times[chunk])
+        bcoords.update(dict([(name, ('time', vals[chunk])) for name, vals in time_coords.items()]))
+        try:
+            buffers = buffer_pool.get_nowait()
+        except queue.Empty:
+            buffers = {}
+
+        chunkdata = {}
+        tidxs, bidxs = time_idxs[idx_range] - chunk[0], baseline_idxs[idx_range]
+        for col, data in coldata.items():
+            if col in 'UVW':  # n_row x 3 -> n_time x n_baseline x 3
+                dims = ['time', 'baseline', 'uvw_index']
+            elif data.ndim == 1:  # n_row -> n_time x n_baseline
+                dims = ['time', 'baseline']
+            elif (data.ndim == 2) and (data.shape[1] == n_pol):
+                dims = ['time', 'baseline', 'pol']
+            elif (data.ndim == 2) and (data.shape[1] == n_chan):
+                dims = ['time', 'baseline', 'chan']
+            elif data.ndim == 3:
+                assert (data.shape[1] == n_chan) & (data.shape[2] == n_pol), 'Column dimensions not correct'
+                dims = ['time', 'baseline', 'chan', 'pol']
+            else:
+                continue
+
+            # missing baselines are flagged in FLAG and FLAG_ROW and NaN (or its cast to the column type) everywhere else
+            fill = np.ones(1, dtype=data.dtype) if col in ['FLAG', 'FLAG_ROW'] else np.array([fill_value(data.dtype)], dtype=data.dtype)
+            bshape = (batchsize, n_baseline) + data.shape[1:]
+            if (col not in buffers) or (buffers[col].shape != bshape) or (buffers[col].dtype != data.dtype):
+                buffers[col] = np.empty(bshape, dtype=data.dtype)
+            fulldata = buffers[col][:len(chunk)]
+            scatter_column(data, tidxs, bidxs, fill, fulldata)
+            chunkdata[col] = xarray.DataArray(fulldata, dims=dims)
+
+        return cc, chunk, xarray.Dataset(chunkdata, coords=bcoords), buffers
+
+    # the final shape of every array is known after the first batch, so the zarr arrays are created once at full size
+    # and each batch is written directly in to its time region, metadata is consolidated once at the end
+    written = {}
+    def write_batch(batch):
+        cc, chunk, x_dataset, buffers = batch
+        if verbose:
+            rtestimate = ', remaining time est %s s' % str(int(((time.time() - start_ddi) / cc) * (n_time / batchsize - cc))) if cc > 0 else ''
+            print('processing chunk %s of %s' % (str(cc), str(n_time // batchsize)) + rtestimate, end='\r')
+        if nofile:
+            written['x_dataset'] = x_dataset.chunk(ddi_chunks)
+            return
+        if len(manifest) == 0:  # first batch written by this run of a new partition
+            full_coords = dict(coords, **dict([(name, ('time', vals)) for name, vals in time_coords.items()]))
+            write_zarr_template(x_dataset, ddi_outfile, 'time', n_time, chunks=ddi_chunks, coords=full_coords,
+                                encoding=variable_encoding(x_dataset, compressor, encoding))
+            manifest.update({'layout': layout, 'batchsize': int(batchsize), 'completed_batches': [], 'complete': False})
+        write_zarr_region(x_dataset, ddi_outfile, 'time', chunk[0])
+        buffer_pool.put(buffers)
+        manifest['completed_batches'] += [int(cc)]
+        write_manifest(ddi_outfile, manifest)
+
+    n_batches = len(range(0, n_time, batchsize))
+    batches = [cc for cc in range(n_batches) if cc not in manifest.get('completed_batches', [])]
+    run_pipeline(batches, [read_batch, scatter_batch, write_batch], depth=pipeline_depth)
+
+    # Add non dimensional auxiliary coordinates and attributes
+    aux_coords.update({'time': unique_times})
+    aux_dataset = xarray.Dataset(coords=aux_coords, attrs=meta_attrs).chunk({'time': chunk_shape[0], 'baseline': chunk_shape[1],
+                                                                             'chan': chunk_shape[2], 'pol': chunk_shape[3]})
+    if nofile:
+        x_dataset = xarray.merge([written['x_dataset'], aux_dataset]).assign_attrs(meta_attrs)  # merge seems to drop attrs
+    else:
+        aux_dataset.to_zarr(ddi_outfile, mode='a', compute=True, consolidated=False)
+        consolidate_metadata(ddi_outfile)
+        if chunk_stats: write_chunk_stats(ddi_outfile)
+        write_manifest(ddi_outfile, dict(manifest, complete=True))
+        x_dataset = xarray.open_zarr(ddi_outfile)
+
+    tb_tool.close()
+    ms_ddi.close()
+    print('Completed ddi', ddi, ' process time ', time.time() - start_ddi)
+
+    return x_dataset
@@ -0,0 +1,155 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#################################
+# Helper File
+#
+# Not exposed in API
+#
+#################################
+import os
+import shutil
+import tempfile
+import numpy as np
+import zarr
+from concurrent.futures import ThreadPoolExecutor
+from cngi._helper.zarr_regions import consolidate_metadata
+import cngi._helper.codecs  # registers the cngi zarr filters
+
+
+
+##################################################################
+# chunk shape of an array with dimension names dims, chunks is a dict of dim name : chunk size (-1 or None for the whole axis)
+# dimensions not in chunks keep their source chunk size, every chunk size is limited to the size of its axis
+def target_chunks(shape, dims, source_chunks, chunks):
+    target = [chunks.get(dd, cc) for dd, cc in zip(dims, source_chunks)]
+    return tuple([max(1, ss) if (cc is None) or (cc < 0) or (cc > ss) else int(cc) for cc, ss in zip(target, shape)])
+
+
+
+##################################################################
+# grow a block of unit shape by whole multiples of the unit along each axis, last axis first, while it fits in max_bytes
+# returns None if a single unit does not fit
+def consolidate_chunks(shape, unit, itemsize, max_bytes):
+    block = [min(max(1, ss), uu) for ss, uu in zip(shape, unit)]
+    if np.prod(block, dtype=float) * itemsize > max_bytes: return None
+    for ax in reversed(range(len(block))):
+        others = np.prod([bb for ii, bb in enumerate(block) if ii != ax], dtype=float) * itemsize
+        factor = int(max_bytes // (others * block[ax]))
+        block[ax] = min(max(1, shape[ax]), block[ax] * max(1, factor))
+    return tuple(block)
+
+
+
+##################################################################
+# copy src to dst one block at a time, every block is read and written whole so memory use is one block per worker
+# blocks that do not line up with the dst chunks share chunks with their neighbors, those copies are done serially
+def copy_blocks(src, dst, block, workers=1):
+    nblocks = [int(np.ceil(ss / bb)) if ss > 0 else 0 for ss, bb in zip(src.shape, block)]
+    regions = [tuple([slice(ii * bb, min((ii + 1) * bb, ss)) for ii, bb, ss in zip(idx, block, src.shape)]) for idx in np.ndindex(*nblocks)]
+
+    def copy(region):
+        dst[region] = src[region]
+
+    aligned = all([(bb % cc == 0) or (bb >= ss) for bb, cc, ss in zip(block, dst.chunks, dst.shape)])
+    if (workers is None) or (workers <= 1) or (not aligned):
+        for region in regions: copy(region)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(copy, regions))
+
+
+
+##################################################################
+# rechunk one zarr array in to dst, which already exists with the target chunking
+# when a block that is a whole number of both the source and the target chunks fits in max_bytes the copy is done in one pass
+# otherwise source chunks are consolidated in to read blocks and copied to an intermediate array in tmp_group, whose chunks are
+# the smaller of the read and write blocks along each axis, then the intermediate is copied to dst in write blocks (two passes)
+# returns the number of passes over the data
+def rechunk_array(src, dst, max_bytes, tmp_group, workers=1):
+    shape, itemsize = src.shape, src.dtype.itemsize
+    src_chunks = [min(max(1, ss), cc) for ss, cc in zip(shape, src.chunks)]
+    dst_chunks = [min(max(1, ss), cc) for ss, cc in zip(shape, dst.chunks)]
+    block = consolidate_chunks(shape, [int(np.lcm(sc, dc)) for sc, dc in zip(src_chunks, dst_chunks)], itemsize, max_bytes)
+    if block is not None:
+        copy_blocks(src, dst, block, workers)
+        return 1
+
+    read = consolidate_chunks(shape, src_chunks, itemsize, max_bytes)
+    write = consolidate_chunks(shape, dst_chunks, itemsize, max_bytes)
+    name = src.path.replace('/', '_')
+    tmp = tmp_group.create(name, shape=shape, chunks=tuple([min(rr, ww) for rr, ww in zip(read, write)]), dtype=src.dtype,
+                           compressor=dst.compressor, filters=dst.filters, fill_value=src.fill_value, overwrite=True)
+    copy_blocks(src, tmp, read, workers)
+    copy_blocks(tmp, dst, write, workers)
+    del tmp_group[name]
+    return 2
+
+
+
+##################################################################
+# check that every array of a zarr group can be rechunked in max_bytes, returns the arrays whose source or target chunks are too large
+def oversized_arrays(src_group, chunks, max_bytes):
+    oversized = []
+    for name, src in src_group.arrays():
+        dims = src.attrs.get('_ARRAY_DIMENSIONS', [])
+        tchunks = target_chunks(src.shape, dims, src.chunks, chunks)
+        if max(np.prod(np.minimum(src.chunks, np.maximum(src.shape, 1)), dtype=float), np.prod(tchunks, dtype=float)) * src.dtype.itemsize > max_bytes:
+            oversized += [src.path]
+    for name, group in src_group.groups():
+        oversized += oversized_arrays(group, chunks, max_bytes)
+    return oversized
+
+
+
+##################################################################
+# rechunk every array of the zarr group infile in to a new group outfile, arrays keep their dtype, compressor, filters and attributes
+# arrays are found by their dimension names, chunks is a dict of dim name : chunk size, subgroups are rechunked the same way
+# the intermediate arrays of two pass copies go in a temporary group under tmp_dir, it is removed when done
+# the chunk layout is recorded in the chunk_layout attribute of outfile and its metadata is consolidated
+# max_bytes is shared by the workers, returns False without writing anything if a source or target chunk does not fit in its share
+def rechunk_group(infile, outfile, chunks, max_bytes, tmp_dir=None, workers=1):
+    src_group = zarr.open_group(infile, mode='r')
+    budget = max_bytes / max(1, workers if workers is not None else 1)
+    oversized = oversized_arrays(src_group, chunks, budget)
+    if len(oversized) > 0:
+        print('######### ERROR : chunks of %s do not fit in %.3g GB per worker' % (', '.join(oversized), budget / 1024 ** 3))
+        return False
+
+    dst_group = zarr.open_group(outfile, mode='w')
+    tmp_path = tempfile.mkdtemp(prefix='rechunk_', dir=tmp_dir if tmp_dir is not None else os.path.dirname(os.path.abspath(outfile)))
+    tmp_group = zarr.open_group(tmp_path, mode='w')
+
+    passes = []
+
+    def rechunk_members(src_grp, dst_grp):
+        dst_grp.attrs.update(src_grp.attrs.asdict())
+        for name, src in src_grp.arrays():
+            dims = src.attrs.get('_ARRAY_DIMENSIONS', [])
+            dst = dst_grp.create(name, shape=src.shape, chunks=target_chunks(src.shape, dims, src.chunks, chunks), dtype=src.dtype,
+                                 compressor=src.compressor, filters=src.filters, fill_value=src.fill_value, order=src.order, overwrite=True)
+            dst.attrs.update(src.attrs.asdict())
+            passes.append(rechunk_array(src, dst, budget, tmp_group, workers))
+        for name, src in src_grp.groups():
+            rechunk_members(src, dst_grp.create_group(name))
+
+    try:
+        rechunk_members(src_group, dst_group)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    dst_group.attrs['chunk_layout'] = dict([(dd, -1 if cc is None else int(cc)) for dd, cc in chunks.items()])
+    consolidate_metadata(outfile)
+    print('rechunked %d arrays of %s, %d in two passes' % (len(passes), infile, passes.count(2)))
+    return True
@@ -19,13 +19,19 @@
 #
 #################################
 import os
-from casatools import table as tb
+try:
+    from casatools import table as tb
+except ImportError:  # read the tables natively when CASA is not installed
+    from cngi._helper.casacore_tables import table as tb
 from numcodecs import Blosc
 import pandas as pd
 import xarray
 import numpy as np
+import threading
 from itertools import cycle
+from concurrent.futures import ThreadPoolExecutor
 import warnings
+from cngi._helper.zarr_regions import write_zarr_template, write_zarr_region, consolidate_metadata
 
 warnings.filterwarnings('ignore', category=FutureWarning)
 
@@ -42,6 +48,42 @@ def convert_time(rawtimes):
 
 
 
+########################################################
+# inverse of convert_time, datetimes back to CASA MJD seconds
+def revert_time(datetimes):
+    correction = 3506716800.0
+    return np.array(datetimes).astype('datetime64[ns]').astype(np.int64) / 1e9 + correction
+
+
+
+######################################
+# range of the cell shapes of the defined cells of a variable shaped column, without formatting and parsing a shape string per row
+# returns the min and max number of dimensions and, when they are equal, the element-wise min and max shape in casacore axis order
+# with casatools the shapes are reduced by TaQL aggregates evaluated inside casacore, the native reader takes the cell shapes
+# from the storage manager metadata (hypercube shapes and array file headers) in chunks of rows, without reading the cells
+def shape_range(tb_tool, col, chunk_rows=100000):
+    if hasattr(tb_tool, 'getcolshapes'):
+        shapes = set()
+        for start_idx in range(0, tb_tool.nrows(), chunk_rows):
+            shapes.update(tb_tool.getcolshapes(col, start_idx, chunk_rows))
+        shapes.discard(())
+        if len(shapes) == 0: return None
+        ndims = [len(ss) for ss in shapes]
+        if min(ndims) != max(ndims): return min(ndims), max(ndims), None, None
+        shapes = np.array(list(shapes))
+        return ndims[0], ndims[0], shapes.min(axis=0), shapes.max(axis=0)
+
+    sel = tb_tool.query('isdefined(%s)' % col, columns='gmin(ndim(%s)) as NMIN, gmax(ndim(%s)) as NMAX' % (col, col))
+    nmin, nmax = int(sel.getcell('NMIN', 0)), int(sel.getcell('NMAX', 0))
+    sel.close()
+    if nmin != nmax: return nmin, nmax, None, None
+    sel = tb_tool.query('isdefined(%s)' % col, columns='gmins(shape(%s)) as SMIN, gmaxs(shape(%s)) as SMAX' % (col, col))
+    smin, smax = np.array(sel.getcell('SMIN', 0)).ravel(), np.array(sel.getcell('SMAX', 0)).ravel()
+    sel.close()
+    return nmin, nmax, smin, smax
+
+
+
 ######################################
 # compute dimensions of variable shaped columns
 # this will be used to standardize the shape to the largest value of each dimension
@@ -55,25 +97,122 @@ def compute_dimensions(tb_tool):
             bad_cols += [col]
             continue
         if tb_tool.isvarcol(col):
-            tshape = list(np.unique(tb_tool.getcolshapestring(col)))  # list of string shapes
-            if len(tshape) == 1: continue  # this column does not actually vary in shape
-            tshape = [list(np.fromstring(nn[1:-1], dtype=int, sep=',')) for nn in tshape]  # list of int shapes
-            if len(np.unique([len(nn) for nn in tshape])) > 1:
+            srange = shape_range(tb_tool, col)
+            if srange is None: continue
+            nmin, nmax, smin, smax = srange
+            if nmin != nmax:
                 print('##### ERROR processing column %s, shape has variable dimensionality, skipping...' % col)
                 bad_cols += [col]
                 continue
-            cshape[col] = np.max([nn for nn in tshape], axis=0)  # store the max dimensionality of this col
+            if np.array_equal(smin, smax): continue  # this column does not actually vary in shape
+            cshape[col] = smax  # store the max dimensionality of this col
     return cshape, bad_cols
 
 
 
+########################################################
+# value used for holes when padding or expanding a column of the given type
+# NaN (or its cast to the type, as np.full would do) for numbers, empty strings for strings
+def fill_value(dtype):
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'USO': return ''
+    with np.errstate(invalid='ignore'):
+        return np.array(np.nan).astype(dtype)[()]
+
+
+
+########################################################
+# pad the cells of a getvarcol chunk to the shape tshape and stack them in to a single (row, ...) block
+# the block is allocated once, then all rows sharing a cell shape are copied in with one assignment,
+# so the work in python scales with the number of distinct cell shapes rather than the number of rows
+# cells are kept in their getvarcol axis order, undefined cells are left as the fill value
+def pad_varcol(data, tshape):
+    keys = sorted(data.keys(), key=lambda kk: int(kk[1:]))
+    cells = [data[kk][..., 0] if isinstance(data[kk], np.ndarray) else None for kk in keys]
+    dtype = np.result_type(*[cc.dtype for cc in cells if cc is not None])
+    block = np.full((len(cells),) + tuple(tshape), fill_value(dtype), dtype=dtype)
+    shapes = [cc.shape if cc is not None else None for cc in cells]
+    for shape in set(shapes) - {None}:
+        rows = np.array([ii for ii, ss in enumerate(shapes) if ss == shape])
+        block[(rows,) + tuple([slice(0, ss) for ss in shape])] = np.stack([cells[ii] for ii in rows])
+    return block
+
+
+
+########################################################
+# table tools are not shared between threads, each thread opens its own on first use
+# opener returns the list of tools it opened, the last one is the one read from
+# returns the function giving the tool of the calling thread and the list of every tool opened, to be closed at the end
+def thread_tools(opener):
+    local, tools, lock = threading.local(), [], threading.Lock()
+    def get_tool():
+        if not hasattr(local, 'tools'):
+            local.tools = opener()
+            with lock: tools.extend(local.tools)
+        return local.tools[-1]
+    return get_tool, tools
+
+
+
+########################################################
+# read rows [start, start + nrows) of the given columns, one column per thread of the executor when one is given
+# table reads release the GIL, so the columns of a chunk are read concurrently
+# variable shaped columns in cshape are padded to their max shape by pad_varcol, all columns are returned row first
+def read_chunk(get_tool, columns, start, nrows, cshape, executor=None):
+    def read_column(col):
+        if col in cshape:
+            data = pad_varcol(get_tool().getvarcol(col, start, nrows), cshape[col])
+            return data.transpose([0] + list(range(data.ndim - 1, 0, -1)))
+        return np.asarray(get_tool().getcol(col, start, nrows)).transpose()
+    values = executor.map(read_column, columns) if executor is not None else map(read_column, columns)
+    return dict(zip(columns, values))
+
+
+
+########################################################
+# read the columns of an open table in chunks of rows, returning one row-first numpy array per column
+# fixed shape columns are transposed to (row, ...) as getcol().transpose() does
+# variable shaped columns are padded to the max size of each dimension, cell_order=True keeps their cells in the
+# getvarcol axis order instead of transposing them
+# skip lists columns to leave out, varcols=False leaves out all variable shaped columns, timecols are converted to datetimes
+# startrow and nrow read a range of rows instead of the whole table, dimensions is the output of compute_dimensions
+# when it is already known (ie when reading a large table one range at a time)
+def read_columns(tb_tool, skip=[], timecols=[], varcols=True, cell_order=False, chunk_rows=100000, startrow=0, nrow=None, dimensions=None):
+    endrow = tb_tool.nrows() if nrow is None else min(startrow + nrow, tb_tool.nrows())
+    cshape, bad_cols = compute_dimensions(tb_tool) if dimensions is None else dimensions
+    columns = {}
+    for col in tb_tool.colnames():
+        if (col in skip) or (col in bad_cols): continue
+        isvar = tb_tool.isvarcol(col)
+        if isvar and (not varcols): continue
+        try:
+            blocks = []
+            for start_idx in range(startrow, endrow, chunk_rows):
+                nrows = min(chunk_rows, endrow - start_idx)
+                if col in cshape:
+                    data = pad_varcol(tb_tool.getvarcol(col, start_idx, nrows), cshape[col])
+                    if not cell_order: data = data.transpose([0] + list(range(data.ndim - 1, 0, -1)))
+                else:
+                    data = np.asarray(tb_tool.getcol(col, start_idx, nrows))
+                    data = np.moveaxis(data, -1, 0) if (isvar and cell_order) else data.transpose()
+                blocks += [data]
+            data = blocks[0] if len(blocks) == 1 else np.concatenate(blocks, axis=0)
+            if col in timecols:
+                data = convert_time(data.ravel()).reshape(data.shape)
+            columns[col] = data
+        except Exception:
+            print('WARNING : unable to process col %s of table %s' % (col, tb_tool.name()))
+    return columns
+
+
 ##################################################################
 # convert a legacy casacore table format to CNGI xarray/zarr
 # infile/outfile can be the main table or specific subtable
 # if infile/outfile are the main table, subtable can also be specified
 # rowdim is used to rename the row axis dimension to the specified value
 # timecols is a list of column names to convert to datetimes
-def convert_simple_table(infile, outfile, subtable='', rowdim='d0', timecols=[], compressor=None, chunk_shape=(40000, 20, 1), nofile=False):
+# workers is the number of columns of each chunk read concurrently
+def convert_simple_table(infile, outfile, subtable='', rowdim='d0', timecols=[], compressor=None, chunk_shape=(40000, 20, 1), nofile=False, workers=1):
     
     if not infile.endswith('/'): infile = infile + '/'
     if not outfile.endswith('/'): outfile = outfile + '/'
@@ -96,22 +235,24 @@ def convert_simple_table(infile, outfile, subtable='', rowdim='d0', timecols=[],
     mvars = {}
     mdims = {rowdim: tb_tool.nrows()}  # keys are dimension names, values are dimension sizes
     cshape, bad_cols = compute_dimensions(tb_tool)
-    
+    columns = [col for col in tb_tool.colnames() if col not in bad_cols]
+
+    # the main thread reads with tb_tool, other threads of the pool open their own tool
+    main_thread = threading.get_ident()
+    def opener():
+        if threading.get_ident() == main_thread: return [tb_tool]
+        tool = tb()
+        tool.open(infile+subtable, nomodify=True, lockoptions={'option': 'usernoread'})
+        return [tool]
+    get_tool, tools = thread_tools(opener)
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
     for start_idx in range(0, tb_tool.nrows(), chunk_shape[0]):
-        for col in tb_tool.colnames():
-            if col in bad_cols: continue
-            print('reading chunk %s of %s, col %s...' % (str(start_idx // chunk_shape[0]), str(tb_tool.nrows() // chunk_shape[0]), col), end='\r')
-
-            if col in cshape:   # if this column has a varying shape, it needs to be normalized
-                data = tb_tool.getvarcol(col, start_idx, chunk_shape[0])
-                tshape = cshape[col]  # grab the max dimensionality of this col
-                # expand the variable shaped column to the maximum size of each dimension
-                # blame the person who devised the tb.getvarcol return structure
-                data = np.array([np.pad(data['r' + str(kk)][..., 0], np.stack((tshape * 0, tshape - data['r' + str(kk)].shape[:-1]), -1)).transpose()
-                                 for kk in np.arange(start_idx + 1, start_idx + len(data) + 1)])
-            else:
-                data = tb_tool.getcol(col, start_idx, chunk_shape[0]).transpose()
-                
+        print('reading chunk %s of %s...' % (str(start_idx // chunk_shape[0]), str(tb_tool.nrows() // chunk_shape[0])), end='\r')
+        chunkdata = read_chunk(get_tool, columns, start_idx, min(chunk_shape[0], tb_tool.nrows() - start_idx), cshape, executor)
+        for col in columns:
+            data = chunkdata[col]
+
             # convert col values to datetime if desired
             if col in timecols:
                 data = convert_time(data)
@@ -129,16 +270,21 @@ def convert_simple_table(infile, outfile, subtable='', rowdim='d0', timecols=[],
             # store as a list of data variables
             mvars[col.upper()] = xarray.DataArray(data, dims=dims).chunk(dict(zip(dims, chunking)))
             
+        # the number of rows is known up front, so create the full size arrays once and write each chunk in to its region
         xds = xarray.Dataset(mvars)
         if (not nofile) and (start_idx == 0):
             encoding = dict(zip(list(xds.data_vars), cycle([{'compressor': compressor}])))
             xds = xds.assign_attrs({'name': infile[infile[:-1].rindex('/') + 1:-1]})
-            xds.to_zarr(outfile+subtable, mode='w', encoding=encoding, consolidated=True)
-        elif not nofile:
-            xds.to_zarr(outfile+subtable, mode='a', append_dim=rowdim, compute=True, consolidated=True)
-    
+            write_zarr_template(xds, outfile+subtable, rowdim, tb_tool.nrows(), encoding=encoding)
+        if not nofile:
+            write_zarr_region(xds, outfile+subtable, rowdim, start_idx)
+
+    if executor is not None: executor.shutdown()
+    for tool in tools:
+        if tool is not tb_tool: tool.close()
     tb_tool.close()
     if not nofile:
+        consolidate_metadata(outfile+subtable)
         #xarray.Dataset(attrs={'name': infile[infile[:-1].rindex('/') + 1:-1]}).to_zarr(outfile+subtable, mode='a', compute=True, consolidated=True)
         xds = xarray.open_zarr(outfile+subtable)
     #else:
@@ -158,7 +304,9 @@ def convert_simple_table(infile, outfile, subtable='', rowdim='d0', timecols=[],
 # subsel is a dict of col name : col val to subselect in the table (ie {'DATA_DESC_ID' : 0}
 # timecols is a list of column names to convert to datetimes
 # dimnames is a dictionary mapping old to new dimension names for remaining dims (not in keys)
-def convert_expanded_table(infile, outfile, keys, subtable='', subsel=None, timecols=[], dimnames={}, compressor=None, chunk_shape=(100, 20, 1), nofile=False):
+# workers is the number of columns of each chunk read concurrently
+def convert_expanded_table(infile, outfile, keys, subtable='', subsel=None, timecols=[], dimnames={}, compressor=None, chunk_shape=(100, 20, 1), nofile=False,
+                           workers=1):
     
     if not infile.endswith('/'): infile = infile + '/'
     if not outfile.endswith('/'): outfile = outfile + '/'
@@ -190,10 +338,21 @@ def convert_expanded_table(infile, outfile, keys, subtable='', subsel=None, time
     # then compute 1 and 3 for each additional key/dimension and store in midxs dictionary
     ordering = ','.join([np.atleast_1d(key)[ii] for key in keys.keys() for ii in range(len(np.atleast_1d(key)))])
     if subsel is None:
-        sorted_table = tb_tool.taql('select * from %s ORDERBY %s' % (infile+subtable, ordering))
+        query = 'select * from %s ORDERBY %s' % (infile+subtable, ordering)
     else:
         tsel = [list(subsel.keys())[0], list(subsel.values())[0]]
-        sorted_table = tb_tool.taql('select * from %s where %s = %s ORDERBY %s' % (infile+subtable, tsel[0], tsel[1], ordering))
+        query = 'select * from %s where %s = %s ORDERBY %s' % (infile+subtable, tsel[0], tsel[1], ordering)
+    sorted_table = tb_tool.taql(query)
+
+    # the main thread reads with sorted_table, other threads of the pool run the same sorting query on their own tool
+    main_thread = threading.get_ident()
+    def opener():
+        if threading.get_ident() == main_thread: return [sorted_table]
+        tool = tb()
+        tool.open(infile+subtable, nomodify=True, lockoptions={'option': 'usernoread'})
+        return [tool, tool.taql(query)]
+    get_tool, tools = thread_tools(opener)
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
     
     row_key, exp_keys = list(keys.keys())[0], list(keys.keys())[1:] if len(keys) > 1 else []
     target_row_key, target_exp_keys = list(keys.values())[0], list(keys.values())[1:] if len(keys) > 1 else []
@@ -223,21 +382,13 @@ def convert_expanded_table(infile, outfile, keys, subtable='', subsel=None, time
         end_idx = row_changes[chunk[-1] + 1] if chunk[-1] + 1 < len(row_changes) else len(row_idxs)
         idx_range = np.arange(row_changes[chunk[0]], end_idx)  # indices of table to be read, they are contiguous because table is sorted
         mcoords.update({row_key.lower(): xarray.DataArray(unique_row_keys[chunk], dims=target_row_key)})
-        
-        for col in sorted_table.colnames():
-            if col in bad_cols: continue
-            if col in keys.keys(): continue  # skip dim columns (unless they are tuples)
-            print('reading chunk %s of %s, col %s...' % (str(start_idx // chunk_shape[0]), str(len(unique_row_keys) // chunk_shape[0]), col), end='\r')
-
-            if col in cshape:   # if this column has a varying shape, it needs to be normalized
-                data = sorted_table.getvarcol(col, idx_range[0], len(idx_range))
-                tshape = cshape[col]  # grab the max dimensionality of this col
-                # expand the variable shaped column to the maximum size of each dimension
-                # blame the person who devised the tb.getvarcol return structure
-                data = np.array([np.pad(data['r' + str(kk)][..., 0], np.stack((tshape * 0, tshape - data['r' + str(kk)].shape[:-1]), -1)).transpose()
-                                 for kk in np.arange(start_idx + 1, start_idx + len(data) + 1)])
-            else:
-                data = sorted_table.getcol(col, idx_range[0], len(idx_range)).transpose()
+
+        # skip dim columns (unless they are tuples)
+        columns = [col for col in sorted_table.colnames() if (col not in bad_cols) and (col not in keys.keys())]
+        print('reading chunk %s of %s...' % (str(start_idx // chunk_shape[0]), str(len(unique_row_keys) // chunk_shape[0])), end='\r')
+        chunkdata = read_chunk(get_tool, columns, idx_range[0], len(idx_range), cshape, executor)
+        for col in columns:
+            data = chunkdata[col]
 
             # compute the full shape of this chunk with the expanded dimensions and initialize to NANs
             fullshape = (len(chunk),) + tuple([midxs[mm][0].shape[0] for mm in list(midxs.keys())]) + data.shape[1:]
@@ -261,16 +412,23 @@ def convert_expanded_table(infile, outfile, keys, subtable='', subsel=None, time
             # store as a dict of data variables
             mvars[col.upper()] = xarray.DataArray(fulldata, dims=dims).chunk(dict(zip(dims, chunking)))
         
+        # the number of unique row keys is known up front, so create the full size arrays once and write each chunk in to its region
         xds = xarray.Dataset(mvars, coords=mcoords).rename(dimnames)
         if (not nofile) and (start_idx == 0):
             encoding = dict(zip(list(xds.data_vars), cycle([{'compressor': compressor}])))
-            xds.to_zarr(outfile+subtable, mode='w', encoding=encoding, consolidated=True)
-        elif not nofile:
-            xds.to_zarr(outfile+subtable, mode='a', append_dim=row_key.lower(), compute=True, consolidated=True)
+            full_coords = dict(mcoords, **{row_key.lower(): xarray.DataArray(unique_row_keys, dims=target_row_key)})
+            full_coords = xarray.Dataset(coords=full_coords).rename(dimnames).coords
+            write_zarr_template(xds, outfile+subtable, dimnames.get(target_row_key, target_row_key), len(unique_row_keys), coords=full_coords, encoding=encoding)
+        if not nofile:
+            write_zarr_region(xds, outfile+subtable, dimnames.get(target_row_key, target_row_key), start_idx)
 
+    if executor is not None: executor.shutdown()
+    for tool in tools:
+        if tool is not sorted_table: tool.close()
     sorted_table.close()
     tb_tool.close()
     if not nofile:
+        consolidate_metadata(outfile+subtable)
         xds = xarray.open_zarr(outfile + subtable)
 
     return xds
\ No newline at end of file
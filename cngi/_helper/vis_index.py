@@ -0,0 +1,306 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#################################
+# Helper File
+#
+# Not exposed in API
+#
+#################################
+import os
+import json
+import numpy as np
+import pandas as pd
+import zarr
+import dask
+import warnings
+from collections.abc import Mapping
+from xarray import open_zarr
+import cngi._helper.codecs  # registers the cngi zarr filters
+
+summary_file = 'vis_summary.json'
+stats_file = 'chunk_stats.json'
+
+
+
+##################################################################
+# open one partition (ddi or 'global') of a vis.zarr directory, using its consolidated metadata when it has some
+# the POINTING group of the global partition is merged in lazily
+def open_partition(infile, ddi):
+    ppath = os.path.join(infile, str(ddi))
+    consolidated = os.path.exists(os.path.join(ppath, '.zmetadata'))
+    xds = open_zarr(ppath, consolidated=consolidated)
+    if os.path.isdir(os.path.join(ppath, 'POINTING')):
+        xds = xds.merge(open_zarr(os.path.join(ppath, 'POINTING'), consolidated=os.path.exists(os.path.join(ppath, 'POINTING', '.zmetadata'))))
+    return xds
+
+
+
+##################################################################
+# isel indexer for the true elements of a mask, a slice when they are contiguous so dask indexes the chunks directly
+def mask_indexer(mask):
+    idx = np.flatnonzero(mask)
+    if len(idx) == 0: return slice(0, 0)
+    if idx[-1] - idx[0] + 1 == len(idx): return slice(int(idx[0]), int(idx[-1]) + 1)
+    return idx
+
+
+
+##################################################################
+# select a ddi partition by coordinate values, the small coordinate arrays are read once to resolve the selection
+# in to isel indexers along time, baseline, chan and pol, so only the chunks of the data variables that are touched are read
+# fields may be ids (matched to field_id) or names (matched to field), time_range and chan_range are inclusive (start, end) pairs
+# antennas keeps the baselines between the listed antennas, baselines is a list of (antenna1, antenna2) pairs
+def select_partition(xds, time_range=None, scans=None, fields=None, antennas=None, baselines=None, chan_range=None, pols=None):
+    indexers = {}
+    if any([sel is not None for sel in [time_range, scans, fields]]):
+        tmask = np.ones(xds.sizes['time'], dtype=bool)
+        if time_range is not None:
+            times = xds.time.values
+            tmask &= (times >= np.datetime64(time_range[0], 'ns')) & (times <= np.datetime64(time_range[1], 'ns'))
+        if scans is not None:
+            tmask &= np.isin(xds.scan.values, np.atleast_1d(scans))
+        if fields is not None:
+            fields = list(np.atleast_1d(fields))
+            fmask = np.zeros(xds.sizes['time'], dtype=bool)
+            if any([isinstance(ff, str) for ff in fields]):
+                fmask |= np.isin(xds.field.values, [ff for ff in fields if isinstance(ff, str)])
+            if any([not isinstance(ff, str) for ff in fields]) and ('field_id' in xds.coords):
+                fmask |= np.isin(xds.field_id.values, [int(ff) for ff in fields if not isinstance(ff, str)])
+            tmask &= fmask
+        indexers['time'] = mask_indexer(tmask)
+    if (antennas is not None) or (baselines is not None):
+        ants = xds.antennas.values
+        bmask = np.ones(xds.sizes['baseline'], dtype=bool)
+        if antennas is not None:
+            bmask &= np.all(np.isin(ants, np.atleast_1d(antennas)), axis=1)
+        if baselines is not None:
+            pairs = np.atleast_2d(baselines)
+            bmask &= np.any(np.all(ants[:, None, :] == pairs[None, :, :], axis=2), axis=1)
+        indexers['baseline'] = mask_indexer(bmask)
+    if chan_range is not None:
+        chans = xds.chan.values
+        indexers['chan'] = mask_indexer((chans >= min(chan_range)) & (chans <= max(chan_range)))
+    if pols is not None:
+        indexers['pol'] = mask_indexer(np.isin(xds.pol.values, np.atleast_1d(pols)))
+    return xds.isel(indexers) if len(indexers) > 0 else xds
+
+
+
+##################################################################
+# reduce each (time chunk, baseline chunk) block of a dask array with func, the chan and pol chunks of a block are combined first
+# func maps a numpy block to a scalar, or to a vector of length nout along the last axis when nout is given
+def block_reduce(arr, tchunks, bchunks, func, nout=None):
+    arr = arr.rechunk((tchunks, bchunks) + tuple([-1] * (arr.ndim - 2)))
+    if nout is None:
+        return arr.map_blocks(lambda blk: np.array(func(blk), dtype=float).reshape(1, 1), chunks=((1,) * len(tchunks), (1,) * len(bchunks)),
+                              drop_axis=list(range(2, arr.ndim)), dtype=float)
+    return arr.map_blocks(lambda blk: np.array(func(blk), dtype=float).reshape(1, 1, nout), chunks=((1,) * len(tchunks), (1,) * len(bchunks), (nout,)),
+                          drop_axis=list(range(3, arr.ndim)), dtype=float)
+
+
+
+##################################################################
+# write the chunk statistics sidecar of a ddi partition, a zone map of each (time chunk, baseline chunk) block of its data
+# time range, scans and fields are kept per time chunk, uvw min/max, flagged fraction and visibility amplitude min/max/mean per block
+# the partition is read once, the chunking along time and baseline is that of DATA (or the first complex variable) on disk
+def write_chunk_stats(ppath):
+    xds = open_zarr(ppath, consolidated=os.path.exists(os.path.join(ppath, '.zmetadata')))
+    complex_vars = [vv for vv in xds.data_vars if (xds[vv].dtype.kind == 'c') and (xds[vv].dims[:2] == ('time', 'baseline'))]
+    vis_name = 'DATA' if 'DATA' in complex_vars else (complex_vars[0] if len(complex_vars) > 0 else None)
+    ref = xds[vis_name] if vis_name is not None else [xds[vv] for vv in xds.data_vars if xds[vv].dims[:2] == ('time', 'baseline')][0]
+    tchunks, bchunks = ref.data.chunks[:2]
+    tbounds, bbounds = np.cumsum((0,) + tchunks), np.cumsum((0,) + bchunks)
+
+    reductions = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        if vis_name is not None:
+            amp = abs(xds[vis_name].data)
+            reductions.update({'amp_min': block_reduce(amp, tchunks, bchunks, np.nanmin), 'amp_max': block_reduce(amp, tchunks, bchunks, np.nanmax),
+                               'amp_mean': block_reduce(amp, tchunks, bchunks, np.nanmean)})
+        if 'FLAG' in xds.data_vars:
+            reductions['flag_fraction'] = block_reduce(xds.FLAG.data, tchunks, bchunks, np.mean)
+        if 'UVW' in xds.data_vars:
+            uvw = xds.UVW.data
+            reductions['uvw_min'] = block_reduce(uvw, tchunks, bchunks, lambda blk: np.nanmin(blk, axis=(0, 1)), nout=uvw.shape[-1])
+            reductions['uvw_max'] = block_reduce(uvw, tchunks, bchunks, lambda blk: np.nanmax(blk, axis=(0, 1)), nout=uvw.shape[-1])
+        values = dict(zip(reductions.keys(), dask.compute(*reductions.values())))
+
+    times = xds.time.values.astype('datetime64[ns]').astype('int64')
+    per_time = lambda coord: [sorted(set(xds[coord].values[t0:t1].tolist())) for t0, t1 in zip(tbounds[:-1], tbounds[1:])] if coord in xds.coords else None
+    stats = {'vis_name': vis_name, 'time_chunks': tbounds.tolist(), 'baseline_chunks': bbounds.tolist(),
+             'time_min': [int(times[t0:t1].min()) for t0, t1 in zip(tbounds[:-1], tbounds[1:])],
+             'time_max': [int(times[t0:t1].max()) for t0, t1 in zip(tbounds[:-1], tbounds[1:])],
+             'scans': per_time('scan'), 'fields': per_time('field'), 'field_ids': per_time('field_id')}
+    stats.update(dict([(name, vals.tolist()) for name, vals in values.items()]))
+    with open(os.path.join(ppath, stats_file), 'w') as fid:
+        json.dump(stats, fid)
+    return stats
+
+
+
+##################################################################
+# isel indexers along time and baseline keeping only the chunks whose statistics may satisfy the predicates
+# a block is kept when its flagged fraction is at most max_flag_fraction and its amplitude range overlaps amp_range
+# time chunks with no kept block are skipped, then baseline chunks with no kept block in the remaining time chunks
+# returns no indexers if the partition has no chunk statistics sidecar
+def stats_indexers(ppath, max_flag_fraction=None, amp_range=None):
+    if (max_flag_fraction is None) and (amp_range is None): return {}
+    if not os.path.exists(os.path.join(ppath, stats_file)):
+        print('WARNING : no chunk statistics in %s, chunks are not skipped' % ppath)
+        return {}
+    with open(os.path.join(ppath, stats_file)) as fid:
+        stats = json.load(fid)
+
+    tbounds, bbounds = np.array(stats['time_chunks']), np.array(stats['baseline_chunks'])
+    keep = np.ones((len(tbounds) - 1, len(bbounds) - 1), dtype=bool)
+    if (max_flag_fraction is not None) and ('flag_fraction' in stats):
+        keep &= np.array(stats['flag_fraction']) <= max_flag_fraction
+    if (amp_range is not None) and ('amp_min' in stats):
+        keep &= (np.array(stats['amp_max']) >= min(amp_range)) & (np.array(stats['amp_min']) <= max(amp_range))
+
+    tkeep = np.any(keep, axis=1)
+    bkeep = np.any(keep[tkeep], axis=0) if np.any(tkeep) else np.zeros(keep.shape[1], dtype=bool)
+    return {'time': mask_indexer(np.repeat(tkeep, np.diff(tbounds))), 'baseline': mask_indexer(np.repeat(bkeep, np.diff(bbounds)))}
+
+
+
+##################################################################
+# open a partition with the selection arguments of read_vis, the global partition is never selected
+# chunks ruled out by the chunk statistics are skipped first, then the coordinate selection is applied to the chunks that remain
+def read_partition(infile, ddi, selection={}):
+    xds = open_partition(infile, ddi)
+    if str(ddi) == 'global': return xds
+    selection = dict(selection)
+    skips = dict([(kk, selection.pop(kk, None)) for kk in ['max_flag_fraction', 'amp_range']])
+    xds = xds.isel(stats_indexers(os.path.join(infile, str(ddi)), **skips))
+    return select_partition(xds, **selection)
+
+
+
+##################################################################
+# ddi partitions of a vis.zarr directory in numerical order, ddis are ints
+def list_partitions(infile):
+    ddis = [dd for dd in os.listdir(infile) if dd.isdigit() and os.path.isdir(os.path.join(infile, dd))]
+    return sorted([int(dd) for dd in ddis])
+
+
+
+##################################################################
+# summary of one ddi partition computed from its consolidated metadata, only the small spw array is read
+# partitions written without consolidated metadata are opened instead
+def partition_summary(infile, ddi):
+    ppath = os.path.join(infile, str(ddi))
+    if not os.path.exists(os.path.join(ppath, '.zmetadata')):
+        xds = open_zarr(ppath, consolidated=False)
+        return {'ddi': ddi, 'spw_id': int(xds.spw.values[0]), 'size_GB': xds.nbytes / 1024 ** 3, 'channels': len(xds.chan), 'times': len(xds.time),
+                'baselines': len(xds.baseline), 'fields': len(xds.field)}
+
+    with open(os.path.join(ppath, '.zmetadata')) as fid:
+        metadata = json.load(fid)['metadata']
+    arrays = dict([(key[:-len('/.zarray')], meta) for key, meta in metadata.items() if key.endswith('/.zarray')])
+    size = lambda name: arrays[name]['shape'][0] if name in arrays else 0
+    nbytes = np.sum([np.prod(meta['shape']) * np.dtype(meta['dtype']).itemsize for meta in arrays.values()])
+    spw = zarr.open_array(os.path.join(ppath, 'spw'), mode='r')[0] if 'spw' in arrays else -1
+    return {'ddi': ddi, 'spw_id': int(spw), 'size_GB': float(nbytes) / 1024 ** 3, 'channels': size('chan'), 'times': size('time'),
+            'baselines': size('baseline'), 'fields': size('field')}
+
+
+
+##################################################################
+# summary index of every ddi partition of a vis.zarr directory as a dataframe indexed by ddi
+# entries are cached in vis_summary.json at the top of the directory along with the modification time of the partition metadata
+# only partitions that changed since they were summarized are read again, the cache is skipped if the directory is read only
+def read_summary(infile):
+    cache = {}
+    if os.path.exists(os.path.join(infile, summary_file)):
+        try:
+            with open(os.path.join(infile, summary_file)) as fid:
+                cache = json.load(fid)
+        except ValueError:
+            cache = {}
+
+    ddis = list_partitions(infile)
+    summary, updated = [], False
+    for ddi in ddis:
+        ppath = os.path.join(infile, str(ddi))
+        meta_file = os.path.join(ppath, '.zmetadata') if os.path.exists(os.path.join(ppath, '.zmetadata')) else ppath
+        mtime = os.path.getmtime(meta_file)
+        if cache.get(str(ddi), {}).get('mtime') != mtime:
+            cache[str(ddi)] = {'mtime': mtime, 'summary': partition_summary(infile, ddi)}
+            updated = True
+        summary += [cache[str(ddi)]['summary']]
+    for ddi in [dd for dd in cache if not (dd.isdigit() and int(dd) in ddis)]:
+        del cache[ddi]
+        updated = True
+
+    if updated:
+        try:
+            with open(os.path.join(infile, summary_file), 'w') as fid:
+                json.dump(cache, fid)
+        except OSError:
+            pass
+
+    columns = ['ddi', 'spw_id', 'size_GB', 'channels', 'times', 'baselines', 'fields']
+    return pd.DataFrame(summary, columns=columns).set_index('ddi')
+
+
+
+##################################################################
+# read only mapping of ddi (and 'global') to the datasets of a vis.zarr directory
+# nothing is opened until a partition is first accessed, then the dataset is kept for later accesses
+# selection is a dict of read_vis selection arguments applied to each ddi as it is opened, the global partition is never selected
+# the summary index is built from the consolidated metadata on first use and describes the unselected partitions
+class VisCollection(Mapping):
+    def __init__(self, infile, selection={}):
+        self.infile = infile
+        self.selection = selection
+        self._ddis = list_partitions(infile)
+        self._global = os.path.isdir(os.path.join(infile, 'global'))
+        self._datasets = {}
+        self._summary = None
+
+    def _key(self, ddi):
+        if (ddi == 'global') and self._global: return 'global'
+        if str(ddi).isdigit() and (int(ddi) in self._ddis): return int(ddi)
+        raise KeyError(ddi)
+
+    def __getitem__(self, ddi):
+        key = self._key(ddi)
+        if key not in self._datasets:
+            self._datasets[key] = read_partition(self.infile, key, self.selection)
+        return self._datasets[key]
+
+    def __iter__(self):
+        return iter((['global'] if self._global else []) + self._ddis)
+
+    def __len__(self):
+        return len(self._ddis) + int(self._global)
+
+    def __contains__(self, ddi):
+        try:
+            self._key(ddi)
+        except KeyError:
+            return False
+        return True
+
+    @property
+    def summary(self):
+        if self._summary is None:
+            self._summary = read_summary(self.infile)
+        return self._summary
+
+    def __repr__(self):
+        return 'VisCollection(%s)\n%s' % (self.infile, repr(self.summary))
@@ -0,0 +1,109 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#################################
+# Helper File
+#
+# Not exposed in API
+#
+#################################
+import xarray
+from xarray.conventions import encode_cf_variable
+import zarr
+from zarr.util import json_dumps, json_loads
+import dask.array as da
+
+
+
+##################################################################
+# create every data variable of a zarr dataset at its final size before any of the data is known
+# xds is the first batch of the dataset, its data variables supply the dtypes, dims and attributes
+# dim is the batch dimension and size is its final length, all other dimensions keep their size in xds
+# chunks is a dict of dim name : chunk size, dask backed variables in xds use their own chunking instead
+# coords are the full coordinates of the final dataset, they are written now along with the array metadata
+# no chunks of the data variables are written, the arrays are filled in later by write_zarr_region
+def write_zarr_template(xds, outfile, dim, size, chunks={}, coords=None, encoding=None):
+    tvars = {}
+    for name, var in xds.data_vars.items():
+        shape = tuple([size if dd == dim else var.sizes[dd] for dd in var.dims])
+        if isinstance(var.data, da.Array):
+            chunksize = var.data.chunksize
+        else:
+            chunksize = tuple([chunks[dd] if (chunks.get(dd) is not None) and (chunks[dd] > 0) else var.sizes[dd] for dd in var.dims])
+        chunksize = tuple([min(cs, ss) if ss > 0 else 1 for cs, ss in zip(chunksize, shape)])
+        tvars[name] = xarray.DataArray(da.empty(shape, chunks=chunksize, dtype=var.dtype), dims=var.dims, attrs=var.attrs)
+
+    if coords is None:
+        coords = dict([(cc, xds.coords[cc]) for cc in xds.coords if dim not in xds.coords[cc].dims])
+    template = xarray.Dataset(tvars, coords=coords, attrs=xds.attrs)
+
+    # non index coordinates are stored in chunks of the data variables along their dims, so the dataset read back has consistent chunks
+    # they stay numpy backed so their values are written now, compute=False would leave dask backed coordinates empty
+    dim_chunks = dict([(dd, cs) for var in tvars.values() for dd, cs in zip(var.dims, var.data.chunksize)])
+    encoding = {} if encoding is None else dict(encoding)
+    for cc in template.coords:
+        if (cc in template.dims) or (cc in encoding) or (template.coords[cc].ndim == 0): continue
+        encoding[cc] = {'chunks': tuple([dim_chunks.get(dd, max(1, ss)) for dd, ss in zip(template.coords[cc].dims, template.coords[cc].shape)])}
+
+    # compute=False stores the coordinates and the metadata of the data variables without computing their placeholder values
+    template.to_zarr(outfile, mode='w', encoding=encoding, compute=False, consolidated=False)
+
+
+
+##################################################################
+# write the data variables of one batch directly in to their region of arrays created by write_zarr_template
+# start is the index along dim of the first element of this batch
+# values are passed through the xarray CF encoders with the units stored on disk, so datetimes and bools match the template
+# the batch is loaded first, xarray will not encode chunked datetimes with units alone
+# metadata is not touched, consolidate it once after the last batch
+def write_zarr_region(xds, outfile, dim, start):
+    group = zarr.open_group(outfile, mode='r+')
+    for name, var in xds.data_vars.items():
+        if name not in group:
+            print('WARNING : variable %s is not present in the first batch of %s, skipping' % (name, outfile))
+            continue
+        zattrs = group[name].attrs.asdict()
+        variable = var.variable.copy(deep=False).load()
+        variable.encoding = dict([(kk, zattrs[kk]) for kk in ['units', 'calendar'] if kk in zattrs])
+        data = encode_cf_variable(variable, name=name).values
+        region = tuple([slice(start, start + var.sizes[dd]) if dd == dim else slice(None) for dd in var.dims])
+        group[name][region] = data
+
+
+
+##################################################################
+# write the consolidated metadata of a zarr group without listing its chunks, unlike zarr.consolidate_metadata
+# only the .zgroup, .zarray and .zattrs keys are read, group directories are listed to find their members but arrays never are
+# names are the members added or replaced since the last consolidation, only their metadata is merged in to the existing .zmetadata
+# the root group metadata is always refreshed, names=None rebuilds the whole .zmetadata
+def consolidate_metadata(outfile, names=None):
+    store = zarr.storage.normalize_store_arg(outfile, mode='a')
+    full = (names is None) or ('.zmetadata' not in store)
+    metadata = {}
+    if not full:
+        metadata = json_loads(store['.zmetadata'])['metadata']
+        metadata = dict([(key, meta) for key, meta in metadata.items() if key.split('/')[0] not in names])
+
+    def walk(prefix):
+        for meta_key in ['.zgroup', '.zarray', '.zattrs']:
+            if prefix + meta_key in store:
+                metadata[prefix + meta_key] = json_loads(store[prefix + meta_key])
+        if (prefix + '.zgroup' in store) and (full or (prefix != '')):
+            for member in zarr.storage.listdir(store, prefix.rstrip('/')):
+                if not member.startswith('.'): walk(prefix + member + '/')
+
+    walk('')
+    if not full:
+        for name in names: walk(name + '/')
+    store['.zmetadata'] = json_dumps({'zarr_consolidated_format': 1, 'metadata': metadata})
@@ -14,6 +14,7 @@ To access these functions, use your favorite variation of:
 """
 from .convert_ms import *
 from .convert_image import *
+from .convert_fits import *
 from .convert_asdm import *
 from .convert_table import *
 from .save_ms import *
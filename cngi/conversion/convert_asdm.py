@@ -17,24 +17,211 @@ this module will be included in the api
 
 
 ###########################################
-def convert_asdm(infile, outfile=None):
+def convert_asdm(infile, outfile=None, compressor=None, chunk_shape=(100, 400, 20, 1), workers=1, encoding=None):
     """
-    .. todo::
-        This function is not yet implemented
+    Convert ASDM format to xarray Visibility Dataset and zarr storage format
 
-    Convert ASDM format to xarray Visibility Dataset zarr format (future)
+    The ASDM tables (in XML format) are parsed for the correlator configurations, data descriptions and integration
+    times, then the binary data format (BDF) files of the Main table rows are decoded one integration at a time directly
+    in to the (time, baseline, chan, pol) layout of each DDI, without filling an MS first.  Integrations are collected in to
+    batches of the time chunk size and each batch is written in to its region of pre-created zarr arrays.  This function
+    does not require casatools.
+
+    Only correlator data is converted, the first bin and atmospheric phase correction of each integration is kept.  UVW
+    coordinates are not stored in the ASDM and are not computed.
 
     Parameters
     ----------
     infile : str
         Input ASDM filename
     outfile : str
-        Output zarr filename. If None, will use infile name with .zarr extension
+        Output zarr filename. If None, will use infile name with .vis.zarr extension
+    compressor : numcodecs.blosc.Blosc
+        The blosc compressor to use when saving the converted data to disk using zarr.
+        If None the zstd compression algorithm used with compression level 2.
+    chunk_shape: 4-D tuple of ints
+        Shape of desired chunking in the form of (time, baseline, channel, polarization), use -1 for entire axis in one chunk. Default is (100, 400, 20, 1)
+    workers : int
+        Number of BDF files decoded concurrently ahead of the writer, memory use is about workers+1 BDF files.  Default is 1
+    encoding : dict
+        zarr encoding of individual data variables, such as returned by cngi.dio.select_codecs. Variables not in encoding use the compressor,
+        FLAG and FLAG_ROW are also bit packed unless they are given in encoding. Default None
 
     Returns
     -------
-    bool
-        Success status
+    list of xarray.core.dataset.Dataset
+      List of new xarray Datasets of Visibility data contents. One element in list per DDI plus the metadata global.
     """
-    return True
+    import os
+    import numpy as np
+    import xarray
+    import time
+    from collections import deque
+    from numcodecs import Blosc
+    from concurrent.futures import ThreadPoolExecutor
+    from cngi._helper.table_conversion import convert_time
+    from cngi._helper.zarr_regions import write_zarr_template, write_zarr_region, consolidate_metadata
+    from cngi._helper.codecs import variable_encoding, flag_encoding
+    from cngi._helper.asdm_conversion import read_asdm_table, parse_array, asdm_id, bdf_filename, bdf_baselines, read_bdf
+    from cngi._helper.asdm_conversion import spw_values, spw_frequencies, convert_asdm_global, stokes_codes, receptor_codes
+
+    if compressor is None:
+        compressor = Blosc(cname='zstd', clevel=2, shuffle=0)
+    encoding = flag_encoding(compressor, encoding)
+
+    infile = os.path.expanduser(infile.rstrip('/'))
+    if outfile is None:
+        outfile = (infile[:infile.rindex('.')] if '.' in os.path.basename(infile) else infile) + '.vis.zarr'
+    else:
+        outfile = os.path.expanduser(outfile)
+
+    print('processing %s ' % infile)
+    os.system("rm -fr " + outfile)
+    os.system("mkdir " + outfile)
+    start = time.time()
+
+    tables = dict([(name, read_asdm_table(infile, name)) for name in ['Main', 'ConfigDescription', 'DataDescription', 'SpectralWindow',
+                                                                        'Polarization', 'Antenna', 'Station', 'Field']])
+    if len(tables['Main']) == 0:
+        print('######### ERROR : no Main table rows found in %s' % infile)
+        return None
+
+    # global partition from the antenna and field tables
+    mvars, mcoords = convert_asdm_global(tables)
+    mxds = xarray.Dataset(mvars, coords=mcoords)
+    mxds.to_zarr(outfile + '/global', mode='w', consolidated=False)
+    consolidate_metadata(outfile + '/global')
+    field_names = mcoords.get('field', np.array([]))
+
+    ###################
+    # integrations of the correlator Main table rows, in time order
+    configs = dict([(row['configDescriptionId'], row) for row in tables['ConfigDescription']])
+    ddescs = dict([(asdm_id(row['dataDescriptionId']), row) for row in tables['DataDescription']])
+    spws = dict([(row['spectralWindowId'], row) for row in tables['SpectralWindow']])
+    polarizations = dict([(row['polarizationId'], row) for row in tables['Polarization']])
+
+    rows = []
+    for row in sorted(tables['Main'], key=lambda rr: int(rr['time'])):
+        config = configs[row['configDescriptionId']]
+        if config.get('processorType', 'CORRELATOR') != 'CORRELATOR': continue
+        if row.get('timeSampling', 'INTEGRATION') != 'INTEGRATION':
+            print('WARNING : skipping %s row of scan %s' % (row['timeSampling'], row['scanNumber']))
+            continue
+        nint, interval = int(row['numIntegration']), int(row['interval'])
+        times = int(row['time']) - interval // 2 + ((np.arange(nint) + 0.5) * interval / nint).astype(np.int64)  # MJD ns
+        rows += [{'filename': bdf_filename(infile, row['dataUID']), 'antennas': [asdm_id(aa) for aa in parse_array(config['antennaId'], str)],
+                  'ddis': [asdm_id(dd) for dd in parse_array(config['dataDescriptionId'], str)], 'mode': config['correlationMode'],
+                  'nint': nint, 'times': times, 'interval': interval / nint / 1e9, 'scan': int(row['scanNumber']), 'field': asdm_id(row['fieldId'])}]
+
+    ###################
+    # time, baseline, channel and polarization axes of each DDI
+    ddis = sorted(set([dd for row in rows for dd in row['ddis']]))
+    layouts = {}
+    for ddi in ddis:
+        ddi_rows = [row for row in rows if ddi in row['ddis']]
+        spw, pol = spws[ddescs[ddi]['spectralWindowId']], polarizations[ddescs[ddi]['polOrHoloId']]
+        times = np.unique(np.concatenate([row['times'] for row in ddi_rows]))
+        baselines = np.unique(np.concatenate([bdf_baselines(row['antennas'], row['mode']) for row in ddi_rows]), axis=0)
+        corr_names = list(parse_array(pol['corrType'], str).ravel())
+        corr_product = np.vectorize(receptor_codes.get)(parse_array(pol['corrProduct'], str)).reshape(len(corr_names), -1).T
+        nchan = int(spw['numChan'])
+        tcoords = {'time': np.zeros(len(times)), 'scan': np.zeros(len(times), dtype=np.int32), 'field_id': np.zeros(len(times), dtype=np.int32),
+                   'interval': np.zeros(len(times))}
+        for row in ddi_rows:
+            tidx = np.searchsorted(times, row['times'])
+            tcoords['scan'][tidx], tcoords['field_id'][tidx], tcoords['interval'][tidx] = row['scan'], row['field'], row['interval']
+
+        ddi_chunk_shape = [cs if cs > 0 else [len(times), len(baselines), nchan, len(corr_names)][ci] for ci, cs in enumerate(chunk_shape)]
+        coords = {'time': convert_time(times / 1e9), 'baseline': np.arange(len(baselines)), 'chan': spw_frequencies(spw),
+                  'pol': np.array([stokes_codes.get(cc, 0) for cc in corr_names])}
+        time_coords = {'scan': ('time', tcoords['scan']), 'field_id': ('time', tcoords['field_id']), 'interval': ('time', tcoords['interval'])}
+        if len(field_names) > 0: time_coords['field'] = ('time', field_names[tcoords['field_id']])
+        aux_coords = {'spw': np.array([asdm_id(spw['spectralWindowId'])]), 'antennas': (['baseline', 'pair'], baselines),
+                      'chan_width': ('chan', spw_values(spw, 'chanWidth', nchan)), 'effective_bw': ('chan', spw_values(spw, 'effectiveBw', nchan)),
+                      'resolution': ('chan', spw_values(spw, 'resolution', nchan)), 'corr_product': (['receptor', 'pol'], corr_product)}
+        attrs = {'ddi': ddi, 'auto_correlations': int(np.any(baselines[:, 0] == baselines[:, 1])), 'num_chan': nchan,
+                 'ref_frequency': float(spw.get('refFreq', 'nan')), 'total_bandwidth': float(spw.get('totalBandwidth', 'nan')),
+                 'net_sideband': spw.get('netSideband', ''), 'name': spw.get('name', '')}
+        layouts[ddi] = {'times': times, 'corr_names': corr_names, 'shape': (len(baselines), nchan, len(corr_names)), 'batch': ddi_chunk_shape[0],
+                        'bl_index': dict([(tuple(bl), ii) for ii, bl in enumerate(baselines)]), 'coords': coords, 'time_coords': time_coords,
+                        'aux_coords': aux_coords, 'attrs': attrs, 'current': 0, 'buffers': None,
+                        'chunks': {'time': ddi_chunk_shape[0], 'baseline': ddi_chunk_shape[1], 'chan': ddi_chunk_shape[2], 'pol': ddi_chunk_shape[3]}}
+        print('ddi %s n_time:' % str(ddi), len(times), '  n_baseline:', len(baselines), '  n_chan:', nchan, '  n_pol:', len(corr_names), ' chunking: ', ddi_chunk_shape)
+
+    ###################
+    # integrations are gathered in to time batches of the chunk size, each batch is written once complete
+    # missing baselines are NaN in DATA and EXPOSURE and flagged in FLAG, as in convert_ms
+    def reset_buffers(layout):
+        bshape = (layout['batch'],) + layout['shape']
+        layout['buffers'] = {'DATA': np.full(bshape, np.nan, dtype=np.complex64), 'FLAG': np.ones(bshape, dtype=bool),
+                             'EXPOSURE': np.full(bshape[:2], np.nan)}
+
+    def flush_batch(ddi):
+        layout = layouts[ddi]
+        t0 = layout['current'] * layout['batch']
+        t1 = min(t0 + layout['batch'], len(layout['times']))
+        if layout['buffers'] is None: reset_buffers(layout)
+        dims = ['time', 'baseline', 'chan', 'pol']
+        x_dataset = xarray.Dataset(dict([(name, xarray.DataArray(values[:t1 - t0], dims=dims[:values.ndim])) for name, values in layout['buffers'].items()]),
+                                   coords=dict(layout['coords'], time=layout['coords']['time'][t0:t1]))
+        ddi_outfile = outfile + '/' + str(ddi)
+        if layout['current'] == 0:
+            write_zarr_template(x_dataset, ddi_outfile, 'time', len(layout['times']), chunks=layout['chunks'],
+                                coords=dict(layout['coords'], **layout['time_coords']), encoding=variable_encoding(x_dataset, compressor, encoding))
+        write_zarr_region(x_dataset, ddi_outfile, 'time', t0)
+        layout['current'] += 1
+        reset_buffers(layout)
+
+    def add_integrations(row, data, flag):
+        baselines = bdf_baselines(row['antennas'], row['mode'])
+        for ii, ddi in enumerate(row['ddis'][:len(data)]):
+            layout = layouts[ddi]
+            if data[ii].shape[2:] != layout['shape'][1:]:
+                print('WARNING : %s has shape %s for ddi %s, expected %s, skipping' % (row['filename'], str(data[ii].shape[2:]), str(ddi), str(layout['shape'][1:])))
+                continue
+            bidx = np.array([layout['bl_index'][tuple(bl)] for bl in baselines])
+            for kk, tt in enumerate(np.searchsorted(layout['times'], row['times'])):
+                while tt >= (layout['current'] + 1) * layout['batch']:
+                    flush_batch(ddi)
+                if tt < layout['current'] * layout['batch']:
+                    print('WARNING : integration of %s is out of time order, skipping' % row['filename'])
+                    continue
+                if layout['buffers'] is None: reset_buffers(layout)
+                bt = tt - layout['current'] * layout['batch']
+                layout['buffers']['DATA'][bt, bidx] = data[ii][kk]
+                layout['buffers']['FLAG'][bt, bidx] = flag[ii][kk]
+                layout['buffers']['EXPOSURE'][bt, bidx] = row['interval']
+
+    def decode_row(row):
+        if not os.path.exists(row['filename']):
+            print('WARNING : BDF file %s not found, skipping' % row['filename'])
+            return [], []
+        pols = [layouts[ddi]['corr_names'] for ddi in row['ddis']]
+        return read_bdf(row['filename'], row['antennas'], row['mode'], pols, row['nint'])
+
+    # BDF files are decoded in parallel ahead of the writer and added in time order
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = deque()
+        for rr, row in enumerate(rows):
+            futures.append((row, executor.submit(decode_row, row)))
+            if len(futures) > max(1, workers):
+                frow, future = futures.popleft()
+                add_integrations(frow, *future.result())
+            print('processing BDF %s of %s' % (str(rr + 1), str(len(rows))), end='\r')
+        while len(futures) > 0:
+            frow, future = futures.popleft()
+            add_integrations(frow, *future.result())
+
+    # write the remaining batches of every DDI followed by its non dimensional coordinates and attributes
+    xds_list = [mxds]
+    for ddi in ddis:
+        layout = layouts[ddi]
+        while layout['current'] * layout['batch'] < len(layout['times']):
+            flush_batch(ddi)
+        aux_dataset = xarray.Dataset(coords=layout['aux_coords'], attrs=layout['attrs'])
+        aux_dataset.to_zarr(outfile + '/' + str(ddi), mode='a', compute=True, consolidated=False)
+        consolidate_metadata(outfile + '/' + str(ddi))
+        xds_list += [xarray.open_zarr(outfile + '/' + str(ddi))]
 
+    print('total conversion time ', time.time() - start)
+    return xds_list
@@ -0,0 +1,174 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+this module will be included in the api
+"""
+
+
+##########################################
+def convert_fits(infile, outfile=None, compressor=None, chunk_shape=(-1, -1, 1, 1), nofile=False, workers=1, encoding=None):
+    """
+    Convert FITS format Image to xarray Image Dataset and zarr storage format
+
+    This function does not require casatools. The FITS data unit is memory mapped with astropy and read one channel batch
+    at a time, producing the same (d0, d1, chan, pol) layout and direction_wcs attribute as convert_image.
+
+    Parameters
+    ----------
+    infile : str
+        Input image filename (.fits format)
+    outfile : str
+        Output zarr filename. If None, will use infile name with .img.zarr extension
+    compressor : numcodecs.blosc.Blosc
+        The blosc compressor to use when saving the converted data to disk using zarr.
+        If None the zstd compression algorithm used with compression level 2.
+    chunk_shape: 4-D tuple of ints
+        Shape of desired chunking in the form of (x, y, channels, polarization), use -1 for entire axis in one chunk. Default is (-1, -1, 1, 1)
+        Note: chunk size is the product of the four numbers (up to the actual size of the dimension)
+    nofile : bool
+        Allows FITS Image to be directly read without file conversion. If set to true, no output file will be written and entire Image will be held in memory.
+        Requires ~4x the memory of the Image size.  Default is False
+    workers : int
+        Number of channel batches to read and write concurrently in to the pre-created zarr arrays.  Default is 1 (serial)
+    encoding : dict
+        zarr encoding of individual data variables, such as returned by cngi.dio.select_codecs. Variables not in encoding use the compressor.
+        Default None uses the compressor for every data variable
+
+    Returns
+    -------
+    xarray.core.dataset.Dataset
+        new xarray Datasets of Image data contents
+    """
+    import numpy as np
+    import xarray
+    from xarray import Dataset as xd
+    from xarray import DataArray as xa
+    from numcodecs import Blosc
+    from astropy.io import fits
+    from astropy.wcs import WCS
+    from concurrent.futures import ThreadPoolExecutor
+    from cngi._helper.zarr_regions import write_zarr_template, write_zarr_region, consolidate_metadata
+    from cngi._helper.codecs import variable_encoding
+    from cngi._helper.image_wcs import fits_direction_wcs, assign_world_coords
+    import time, os, warnings
+    warnings.simplefilter("ignore", category=FutureWarning)  # suppress noisy warnings about bool types
+
+    print("converting FITS Image...")
+
+    infile = os.path.expanduser(infile)
+    prefix = infile[:infile.rindex('.')]
+    if outfile == None:
+        outfile = prefix + '.img.zarr'
+    else:
+        outfile = os.path.expanduser(outfile)
+
+    if not nofile:
+        tmp = os.system("rm -fr " + outfile)
+
+    begin = time.time()
+
+    if compressor is None:
+        compressor = Blosc(cname='zstd', clevel=2, shuffle=0)
+
+    # scaling is applied per batch, letting astropy scale would read the whole data unit in to memory
+    hdul = fits.open(infile, memmap=True, do_not_scale_image_data=True)
+    hdu = [hh for hh in hdul if (hh.is_image) and (hh.header.get('NAXIS', 0) >= 2)][0]
+    header, raw = hdu.header, hdu.data
+    ww = WCS(header)
+    naxis = ww.naxis
+
+    # FITS axis numbers (0-based, NAXIS1 first) of the longitude, latitude, spectral and stokes axes
+    ctypes = [ct.upper() for ct in ww.wcs.ctype]
+    lng, lat = ww.wcs.lng, ww.wcs.lat
+    if (lng < 0) or (lat < 0):
+        print('######### ERROR : %s does not have two celestial axes' % infile)
+        return None
+    spec = ww.wcs.spec if ww.wcs.spec >= 0 else None
+    stokes = ctypes.index('STOKES') if 'STOKES' in ctypes else None
+    order = [lng, lat, spec, stokes]
+    extra = [ii for ii in range(naxis) if (ii not in order) and (header['NAXIS%i' % (ii + 1)] > 1)]
+    if len(extra) > 0:
+        print('######### ERROR : unsupported non-degenerate axes %s in %s' % (str([ctypes[ii] for ii in extra]), infile))
+        return None
+    dsize = [header['NAXIS%i' % (ax + 1)] if ax is not None else 1 for ax in order]
+
+    # world coordinates of the cartesian axes, frequencies in Hz and stokes values as casa Stokes codes
+    # the spatial world coordinates are described by the direction_wcs attribute and computed lazily
+    fits_stokes = {1: 1, 2: 2, 3: 3, 4: 4, -1: 5, -2: 8, -3: 6, -4: 7, -5: 9, -6: 12, -7: 10, -8: 11}
+    chan_coords = ww.sub([spec + 1]).wcs_pix2world(np.arange(dsize[2]), 0)[0] if spec is not None else np.array([0.0])
+    pol_coords = ww.sub([stokes + 1]).wcs_pix2world(np.arange(dsize[3]), 0)[0] if stokes is not None else np.array([1.0])
+    pol_coords = np.array([fits_stokes.get(int(np.round(pp)), int(np.round(pp))) for pp in pol_coords])
+    names = ['longitude', 'latitude'] if ctypes[lng].startswith('GLON') else ['right_ascension', 'declination']
+
+    attrs = {'direction_wcs': fits_direction_wcs(ww, lng, lat, names, ['d0', 'd1']), 'axisunits': ['rad', 'rad', 'Hz', ''],
+             'unit': header.get('BUNIT', ''), 'object': header.get('OBJECT', ''), 'telescope': header.get('TELESCOP', '')}
+    if ('BMAJ' in header) and ('BMIN' in header):
+        beam = [header['BMAJ'] * 3600.0, header['BMIN'] * 3600.0, header.get('BPA', 0.0)]
+        attrs.update({'commonbeam': beam, 'commonbeam_units': ['arcsec', 'arcsec', 'deg'], 'restoringbeam': beam})
+
+    bscale, bzero, blank = header.get('BSCALE', 1.0), header.get('BZERO', 0.0), header.get('BLANK')
+    chunk_shape = list(chunk_shape)
+    if chunk_shape[2] <= 0: chunk_shape[2] = dsize[2]
+    chan_batch = dsize[2] if nofile else chunk_shape[2]
+    chunking = dict([(dd, chunk_shape[ii]) for ii, dd in enumerate(['d0', 'd1', 'chan', 'pol']) if chunk_shape[ii] > 0])
+
+    # read the channel range starting at chan from the memory map and reorder it to (d0, d1, chan, pol)
+    def read_batch(chan):
+        cslice = slice(chan, min(chan + chan_batch, dsize[2]))
+        region = tuple([cslice if ii == spec else (slice(None) if ii in order else 0) for ii in reversed(range(naxis))])
+        data = np.asarray(raw[region])
+        present = [ii for ii in reversed(range(naxis)) if ii in order]
+        data = data.transpose([present.index(ax) for ax in order if ax is not None])
+        for kk, ax in enumerate(order):
+            if ax is None: data = np.expand_dims(data, kk)
+        data = data.astype(data.dtype.newbyteorder('='))
+
+        # apply the integer blanking and scaling of the data unit
+        if (data.dtype.kind in 'iu') and ((bscale != 1.0) or (bzero != 0.0) or (blank is not None)):
+            fdata = data.astype(np.float32) * np.float32(bscale) + np.float32(bzero)
+            if blank is not None: fdata[data == blank] = np.nan
+            data = fdata
+        elif (bscale != 1.0) or (bzero != 0.0):
+            data = data * data.dtype.type(bscale) + data.dtype.type(bzero)
+
+        xdas = {'IMAGE': xa(data, dims=['d0', 'd1', 'chan', 'pol']), 'MASK': xa(np.isfinite(data), dims=['d0', 'd1', 'chan', 'pol'])}
+        coords = {'chan': chan_coords[cslice], 'pol': pol_coords}
+        return xd(xdas, coords=coords, attrs=attrs).chunk(chunking)
+
+    def convert_batch(chan):
+        print('processing channel ' + str(chan + 1) + ' of ' + str(dsize[2]), end='\r')
+        write_zarr_region(read_batch(chan), outfile, 'chan', chan)
+
+    # the full size arrays are created from the first batch, then each batch is written in to its own channel region
+    xds = read_batch(0)
+    if not nofile:
+        encoding = variable_encoding(xds, compressor, encoding)
+        write_zarr_template(xds, outfile, 'chan', dsize[2], coords={'chan': chan_coords, 'pol': pol_coords}, encoding=encoding)
+        write_zarr_region(xds, outfile, 'chan', 0)
+        batches = list(range(chan_batch, dsize[2], chan_batch))
+        if (workers is None) or (workers <= 1):
+            for chan in batches:
+                convert_batch(chan)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(convert_batch, batches))
+
+    hdul.close()
+    print("processed image size " + str(dsize) + " in " + str(np.float32(time.time() - begin)) + " seconds")
+
+    if not nofile:
+        consolidate_metadata(outfile)
+        xds = xarray.open_zarr(outfile)
+
+    return assign_world_coords(xds)
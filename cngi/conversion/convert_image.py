@@ -17,11 +17,11 @@ this module will be included in the api
 
 
 ##########################################
-def convert_image(infile, outfile=None, artifacts=None, compressor=None, chunk_shape=(-1, -1, 1, 1), nofile=False):
+def convert_image(infile, outfile=None, artifacts=None, compressor=None, chunk_shape=(-1, -1, 1, 1), nofile=False, workers=1, encoding=None):
     """
     Convert legacy CASA or FITS format Image to xarray Image Dataset and zarr storage format
 
-    This function requires CASA6 casatools module.
+    This function requires CASA6 casatools module. Without it, .fits images are converted by convert_fits instead.
 
     Parameters
     ----------
@@ -40,21 +40,38 @@ def convert_image(infile, outfile=None, artifacts=None, compressor=None, chunk_s
     nofile : bool
         Allows legacy Image to be directly read without file conversion. If set to true, no output file will be written and entire Image will be held in memory.
         Requires ~4x the memory of the Image size.  Default is False
+    workers : int
+        Number of channel batches to read and write concurrently. The zarr arrays are created up front so each batch is written
+        independently in to its own channel range, each worker keeps its own open image tools.  Default is 1 (serial)
+    encoding : dict
+        zarr encoding of individual data variables, such as returned by cngi.dio.select_codecs. Variables not in encoding use the compressor.
+        Default None uses the compressor for every data variable
 
     Returns
     -------
     xarray.core.dataset.Dataset
         new xarray Datasets of Image data contents
     """
-    from casatools import image as ia
-    from casatools import quanta as qa
+    import os
+    try:
+        from casatools import image as ia
+        from casatools import quanta as qa
+    except ImportError:
+        if os.path.expanduser(infile).rstrip('/').lower().endswith('.fits'):
+            from cngi.conversion.convert_fits import convert_fits
+            return convert_fits(infile, outfile, compressor=compressor, chunk_shape=chunk_shape, nofile=nofile, workers=workers, encoding=encoding)
+        raise
     import numpy as np
-    from itertools import cycle
     from pandas.io.json._normalize import nested_to_record
     import xarray
     from xarray import Dataset as xd
     from xarray import DataArray as xa
     from numcodecs import Blosc
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from cngi._helper.zarr_regions import write_zarr_template, write_zarr_region, consolidate_metadata
+    from cngi._helper.codecs import variable_encoding
+    from cngi._helper.image_wcs import direction_wcs, world_coords, assign_world_coords
     import time, os, warnings
     warnings.simplefilter("ignore", category=FutureWarning)  # suppress noisy warnings about bool types
 
@@ -91,7 +108,7 @@ def convert_image(infile, outfile=None, artifacts=None, compressor=None, chunk_s
     if artifacts is None:
         imtypes = ['pb', 'psf', 'residual', 'mask', 'model', 'sumwt', 'weight', 'image.pbcor']
     if suffix not in imtypes: imtypes = [suffix] + imtypes
-    meta, tm, diftypes, difmeta, xds = {}, {}, [], [], []
+    meta, tm, diftypes, difmeta, xds, masks = {}, {}, [], [], [], {}
     
     # must start with the main image to convert
     # main image must have two spatial coordinates
@@ -104,15 +121,22 @@ def convert_image(infile, outfile=None, artifacts=None, compressor=None, chunk_s
             coord_names = [ss.replace(' ', '_').lower().replace('stokes', 'pol').replace('frequency', 'chan') for ss in summary['axisnames']]
             missing_coords = [ss for ss in ['chan','pol'] if ss not in coord_names]
             
-            # compute world coordinates for spherical dimensions
+            # world coordinates for spherical dimensions
             # the only way to know is to check the units for angular types (i.e. radians)
+            # the direction axes are kept as a compact WCS description and their coordinates are computed lazily per spatial tile
             sphr_dims = [dd for dd in range(len(ims)) if QA.isangle(summary['axisunits'][dd])]
-            coord_idxs = np.mgrid[[range(ims[dd]) if dd in sphr_dims else range(1) for dd in range(len(ims))]]
-            coord_idxs = coord_idxs.reshape(len(ims), -1)
-            coord_world = csys.toworldmany(coord_idxs.astype(float))['numeric']
-            coord_world = coord_world[sphr_dims].reshape((len(sphr_dims),) + tuple(np.array(ims)[sphr_dims]))
             spi = ['d' + str(dd) for dd in sphr_dims]
-            coords = dict([(coord_names[dd], (spi, coord_world[di])) for di, dd in enumerate(sphr_dims)])
+            direction, wcs = csys.torecord().get('direction0'), None
+            if (direction is not None) and (len(sphr_dims) == 2):
+                wcs = direction_wcs(direction, [coord_names[dd] for dd in sphr_dims], spi,
+                                    lambda vv, uu: QA.convert({'value': float(vv), 'unit': str(uu)}, 'deg')['value'])
+                coords = world_coords(wcs, [ims[dd] for dd in sphr_dims], [chunk_shape[dd] for dd in sphr_dims])
+            else:
+                coord_idxs = np.mgrid[[range(ims[dd]) if dd in sphr_dims else range(1) for dd in range(len(ims))]]
+                coord_idxs = coord_idxs.reshape(len(ims), -1)
+                coord_world = csys.toworldmany(coord_idxs.astype(float))['numeric']
+                coord_world = coord_world[sphr_dims].reshape((len(sphr_dims),) + tuple(np.array(ims)[sphr_dims]))
+                coords = dict([(coord_names[dd], (spi, coord_world[di])) for di, dd in enumerate(sphr_dims)])
 
             # compute world coordinates for cartesian dimensions
             cart_dims = [dd for dd in range(len(ims)) if dd not in sphr_dims]
@@ -124,7 +148,8 @@ def convert_image(infile, outfile=None, artifacts=None, compressor=None, chunk_s
                 spi = tuple([slice(None) if di == dd else slice(1) for di in range(cs.ndim)])
                 coords.update(dict([(coord_names[cart_dims[dd]], cs[spi].reshape(-1))]))
                 
-            # store metadata for later
+            # store metadata for later, including whether this artifact carries a pixel mask
+            masks[imtype] = len(summary['masks']) > 0
             tm['coords'] = coords
             tm['dsize'] = np.array(summary['shape'])
             tm['dims'] = [coord_names[di] if di in cart_dims else 'd' + str(di) for di in range(len(ims))]
@@ -136,6 +161,7 @@ def convert_image(infile, outfile=None, artifacts=None, compressor=None, chunk_s
 
             tm['attrs'] = dict([(kk.lower(), summary[kk]) for kk in summary.keys() if kk not in omits + nested])
             tm['attrs'].update(dict([(kk, list(nested_to_record(summary[kk], sep='.').items())) for kk in nested if kk not in omits]))
+            if wcs is not None: tm['attrs']['direction_wcs'] = wcs
             
             # check for common and restoring beams
             rb = IA.restoringbeam()
@@ -183,56 +209,86 @@ def convert_image(infile, outfile=None, artifacts=None, compressor=None, chunk_s
     print('separate components: ', diftypes)
 
     # process all image artifacts with compatible metadata to same zarr file
-    # partition by channel, read each image artifact for each channel
+    # partition by channel, read each image artifact for each channel batch
+    # the MASK variable comes from the last compatible artifact that has a pixel mask
     dsize, chan_dim = meta['dsize'], meta['dims'].index('chan')
-    pt1, pt2 = [-1 for _ in range(len(dsize))], [-1 for _ in range(len(dsize))]
+    chunk_shape = list(chunk_shape)
     if chunk_shape[2] <= 0: chunk_shape[2] = dsize[chan_dim]
     chan_batch = dsize[chan_dim] if nofile else chunk_shape[2]
-    for chan in range(0, dsize[chan_dim], chan_batch):
-        print('processing channel ' + str(chan + 1) + ' of ' + str(dsize[chan_dim]), end='\r')
-        pt1[chan_dim], pt2[chan_dim] = chan, chan + chan_batch-1
-        chunk_coords = dict(meta['coords'])  # only want one freq channel coord
-        chunk_coords['chan'] = coords['chan'][np.arange(chan, min(chan+chan_batch, dsize[chan_dim]))]
-        xdas = {}
-        for imtype in imtypes:
-            rc = IA.open(prefix + '.' + imtype)
+    mask_type = ([None] + [imtype for imtype in imtypes if masks[imtype]])[-1]
+    chunking = dict([(dd, chunk_shape[ii]) for ii, dd in enumerate(['d0', 'd1', 'chan', 'pol']) if chunk_shape[ii] > 0])
+
+    # image tools are opened once per worker thread and reused for every batch that thread converts
+    local, tools, tools_lock = threading.local(), [], threading.Lock()
+    def open_tools():
+        if not hasattr(local, 'tools'):
+            local.tools = {}
+            for imtype in imtypes:
+                local.tools[imtype] = ia()
+                local.tools[imtype].open(prefix + '.' + imtype)
+            with tools_lock:
+                tools.extend(local.tools.values())
+        return local.tools
 
+    # read every artifact over the channel range starting at chan in to an xarray dataset
+    def read_batch(chan):
+        pt1, pt2 = [-1 for _ in range(len(dsize))], [-1 for _ in range(len(dsize))]
+        pt1[chan_dim], pt2[chan_dim] = chan, chan + chan_batch - 1
+        chunk_coords = dict(meta['coords'])  # only want the channel coords of this batch
+        chunk_coords['chan'] = meta['coords']['chan'][np.arange(chan, min(chan + chan_batch, dsize[chan_dim]))]
+        xdas = {}
+        for imtype, tool in open_tools().items():
             # extract pixel data
-            imchunk = IA.getchunk(pt1, pt2)
-            if imtype == suffix: imtype = 'image'
-            if imtype == 'mask':
+            imchunk = tool.getchunk(pt1, pt2)
+            name = 'image' if imtype == suffix else imtype
+            if name == 'mask':
                 xdas['AUTOMASK'] = xa(imchunk.astype(bool), dims=meta['dims']).expand_dims(missing_coords)
-            elif imtype == 'sumwt':
-                xdas[imtype.upper()] = xa(imchunk.reshape(imchunk.shape[2], 1), dims=['pol', 'chan'])
+            elif name == 'sumwt':
+                xdas[name.upper()] = xa(imchunk.reshape(imchunk.shape[2], 1), dims=['pol', 'chan'])
             else:
-                xdas[imtype.upper()] = xa(imchunk, dims=meta['dims']).expand_dims(missing_coords)
+                xdas[name.upper()] = xa(imchunk, dims=meta['dims']).expand_dims(missing_coords)
 
             # extract mask
-            summary = IA.summary(list=False)
-            if len(summary['masks']) > 0:
-                imchunk = IA.getchunk(pt1, pt2, getmask=True)
+            if imtype == mask_type:
+                imchunk = tool.getchunk(pt1, pt2, getmask=True)
                 xdas['MASK'] = xa(imchunk.astype(bool), dims=meta['dims'])
 
-            rc = IA.close()
-
-
-        chunking = dict([(dd, chunk_shape[ii]) for ii,dd in enumerate(['d0','d1','chan','pol']) if chunk_shape[ii] > 0])
         xds = xd(xdas, coords=chunk_coords, attrs=meta['attrs']).chunk(chunking)
-        
+
         # for everyone's sanity, lets make sure the dimensions are ordered the same way as visibility data
-        xds = xds.transpose('d0','d1','chan','pol')
+        xds = xds.transpose('d0', 'd1', 'chan', 'pol')
         xds.attrs['axisunits'] = ['rad', 'rad', 'Hz', '']
+        return xds
+
+    def convert_batch(chan):
+        print('processing channel ' + str(chan + 1) + ' of ' + str(dsize[chan_dim]), end='\r')
+        write_zarr_region(read_batch(chan), outfile, 'chan', chan)
+
+    # the number of channels is known up front, so the full size arrays are created from the first batch
+    # then every batch is written in to its own channel region, so the batches can be converted concurrently
+    xds = read_batch(0)
+    if not nofile:
+        encoding = variable_encoding(xds, compressor, encoding)
+        # lazy world coordinates are not stored, they are rebuilt from the direction_wcs attribute when the image is read
+        lazy = meta['attrs'].get('direction_wcs', {}).get('names', [])
+        full_coords = dict([(cc, xds.coords[cc]) for cc in xds.coords if cc not in lazy], chan=meta['coords']['chan'])
+        write_zarr_template(xds, outfile, 'chan', dsize[chan_dim], coords=full_coords, encoding=encoding)
+        write_zarr_region(xds, outfile, 'chan', 0)
+        batches = list(range(chan_batch, dsize[chan_dim], chan_batch))
+        if (workers is None) or (workers <= 1):
+            for chan in batches:
+                convert_batch(chan)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(convert_batch, batches))
 
-        if (chan == 0) and (not nofile):
-            # xds = xd(xdas, coords=chunk_coords, attrs=nested_to_record(meta['attrs'], sep='_'))
-            encoding = dict(zip(list(xds.data_vars), cycle([{'compressor': compressor}])))
-            xds.to_zarr(outfile, mode='w', encoding=encoding)
-        elif not nofile:
-            xds.to_zarr(outfile, mode='a', append_dim='chan')
+    for tool in tools:
+        rc = tool.close()
 
     print("processed image size " + str(dsize) + " in " + str(np.float32(time.time() - begin)) + " seconds")
 
     if not nofile:
-        xds = xarray.open_zarr(outfile)
+        consolidate_metadata(outfile)
+        xds = assign_world_coords(xarray.open_zarr(outfile))
 
     return xds
@@ -17,11 +17,12 @@ this module will be included in the api
 
 
 
-def convert_table(infile, outfile=None, subtable=None, keys=None, timecols=None, compressor=None, chunk_shape=(40000, 20, 1), append=False, nofile=False):
+def convert_table(infile, outfile=None, subtable=None, keys=None, timecols=None, compressor=None, chunk_shape=(40000, 20, 1), append=False, nofile=False, workers=1):
     """
     Convert casacore table format to xarray Dataset and zarr storage format.
 
-    This function requires CASA6 casatools module. Table rows may be renamed or expanded to n-dim arrays based on column values specified in keys.
+    This function uses the CASA6 casatools module when it is installed, otherwise the table is read by the native casacore
+    table reader in cngi. Table rows may be renamed or expanded to n-dim arrays based on column values specified in keys.
 
     Parameters
     ----------
@@ -48,6 +49,8 @@ def convert_table(infile, outfile=None, subtable=None, keys=None, timecols=None,
     nofile : bool
         Allows legacy table to be directly read without file conversion. If set to true, no output file will be written and entire table will be held in memory.
         Requires ~4x the memory of the table size.  Default is False
+    workers : int
+        Number of columns of each chunk of rows read concurrently, each thread reads from its own table tool.  Default is 1 (serial)
     Returns
     -------
     New xarray.core.dataset.Dataset
@@ -82,7 +85,8 @@ def convert_table(infile, outfile=None, subtable=None, keys=None, timecols=None,
                                            timecols=[] if timecols is None else timecols,
                                            compressor=compressor,
                                            chunk_shape=chunk_shape,
-                                           nofile=nofile)
+                                           nofile=nofile,
+                                           workers=workers)
     else:
         xds = tblconv.convert_expanded_table(infile, outfile,
                                              keys=keys,
@@ -92,6 +96,7 @@ def convert_table(infile, outfile=None, subtable=None, keys=None, timecols=None,
                                              dimnames={},
                                              compressor=compressor,
                                              chunk_shape=chunk_shape,
-                                             nofile=nofile)
+                                             nofile=nofile,
+                                             workers=workers)
     
     return xds
@@ -17,21 +17,108 @@ this module will be included in the api
 
 
 ###########################################
-def save_image(xds, outfile=None):
+def save_image(xds, outfile='image.fits', variable='IMAGE', workers=1):
     """
-    .. todo::
-        This function is not yet implemented
+    Convert xarray Image Dataset to FITS format
 
-    Convert xarray Image Dataset to legacy CASA Image format or FITS format
+    The FITS header is written once, then the data variable is streamed to the file one batch of channel planes at a time
+    (following the chan chunking of the dataset), so the cube is never held in memory.  Writing to the legacy CASA Image
+    format is not supported, use casatools to import the FITS file.
 
     Parameters
     ----------
     xds : xarray.core.dataset.Dataset
-        input Image Dataset
+        input Image Dataset with (d0, d1, chan, pol) dimensions
     outfile : str
-        Output image filename. If None, will use infile name with .image extension
+        Output FITS filename.  Default is 'image.fits'
+    variable : str
+        Name of the data variable to export.  Default is 'IMAGE'
+    workers : int
+        Number of channel batches computed concurrently ahead of the writer, memory use is about workers+1 batches.  Default is 1
 
     Returns
     -------
     """
+    import os
+    import numpy as np
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from astropy.io import fits
+    from cngi._helper.image_wcs import astropy_wcs
+
+    outfile = os.path.expanduser(outfile)
+    if not outfile.rstrip('/').lower().endswith(('.fits', '.fit', '.fts')):
+        print('######### ERROR : only FITS output is supported, outfile must end in .fits')
+        return False
+
+    xda = xds[variable]
+    if list(xda.dims) != ['d0', 'd1', 'chan', 'pol']:
+        print('######### ERROR : %s must have dimensions (d0, d1, chan, pol), found %s' % (variable, str(xda.dims)))
+        return False
+
+    # FITS images hold uint8, int16/32/64 and float32/64 values, other real types are widened to the nearest of these
+    bitpix = {'uint8': 8, 'int16': 16, 'int32': 32, 'int64': 64, 'float32': -32, 'float64': -64}
+    dtype = np.dtype({'bool': 'uint8', 'int8': 'int16', 'uint16': 'int32', 'uint32': 'int64', 'float16': 'float32'}.get(xda.dtype.name, xda.dtype.name))
+    if dtype.name not in bitpix:
+        print('######### ERROR : %s has type %s, it can not be stored in a FITS image' % (variable, xda.dtype.name))
+        return False
+
+    # celestial axes from the direction_wcs attribute, linear spectral and stokes axes from the chan and pol coordinates
+    header = fits.Header()
+    header['SIMPLE'] = True
+    header['BITPIX'] = bitpix[dtype.name]
+    header['NAXIS'] = 4
+    for ii, dd in enumerate(['d0', 'd1', 'chan', 'pol']):
+        header['NAXIS%i' % (ii + 1)] = xda.sizes[dd]
+    header['WCSAXES'] = 4
+    if 'direction_wcs' in xds.attrs:
+        # the celestial wcs only knows two axes and has no reference time, keep its keys but not WCSAXES or the MJDREF = 0 default
+        wcs_header = astropy_wcs(xds.attrs['direction_wcs']).to_header()
+        for key in ['WCSAXES', 'MJDREF']: wcs_header.remove(key, ignore_missing=True)
+        header.update(wcs_header)
+        system = xds.attrs['direction_wcs'].get('radesys', 'ICRS')
+        header['RADESYS'] = {'J2000': 'FK5', 'B1950': 'FK4'}.get(system, system)
+        if system in ['J2000', 'B1950']: header['EQUINOX'] = float(system[1:])
+        if 'equinox' in xds.attrs['direction_wcs']: header['EQUINOX'] = float(xds.attrs['direction_wcs']['equinox'])
+    else:
+        print('WARNING : no direction_wcs attribute, writing pixel coordinates for the spatial axes')
+
+    chan = xds.chan.values.astype(float) if 'chan' in xds.coords else np.arange(xda.sizes['chan'], dtype=float)
+    if (len(chan) > 2) and (not np.allclose(np.diff(chan), chan[1] - chan[0])):
+        print('WARNING : channels are not linearly spaced, the FITS spectral axis will only be approximate')
+    header.update({'CTYPE3': 'FREQ', 'CRPIX3': 1.0, 'CRVAL3': chan[0], 'CDELT3': chan[1] - chan[0] if len(chan) > 1 else 1.0, 'CUNIT3': 'Hz'})
+
+    casa_stokes = {1: 1, 2: 2, 3: 3, 4: 4, 5: -1, 8: -2, 6: -3, 7: -4, 9: -5, 12: -6, 10: -7, 11: -8}
+    pol = np.array([casa_stokes.get(int(pp), int(pp)) for pp in xds.pol.values]) if 'pol' in xds.coords else np.arange(1, xda.sizes['pol'] + 1)
+    if (len(pol) > 2) and (not np.all(np.diff(pol) == pol[1] - pol[0])):
+        print('WARNING : polarizations are not evenly spaced stokes codes, the FITS stokes axis will only be approximate')
+    header.update({'CTYPE4': 'STOKES', 'CRPIX4': 1.0, 'CRVAL4': float(pol[0]), 'CDELT4': float(pol[1] - pol[0]) if len(pol) > 1 else 1.0})
+
+    if len(xds.attrs.get('unit', '')) > 0: header['BUNIT'] = xds.attrs['unit']
+    if ('commonbeam' in xds.attrs) and (xds.attrs.get('commonbeam_units', ['arcsec'])[0] == 'arcsec'):
+        beam = xds.attrs['commonbeam']
+        header.update({'BMAJ': beam[0] / 3600.0, 'BMIN': beam[1] / 3600.0, 'BPA': beam[2]})
+
+    # the file is ordered (pol, chan, d1, d0), so planes are streamed by polarization then by batch of channels
+    nchan = xda.sizes['chan']
+    chan_batch = xda.chunks[2][0] if xda.chunks is not None else nchan
+    batches = [(pp, cc) for pp in range(xda.sizes['pol']) for cc in range(0, nchan, chan_batch)]
+
+    def compute_batch(batch):
+        pp, cc = batch
+        data = np.asarray(xda[:, :, cc:cc + chan_batch, pp].values).astype(dtype)
+        return np.ascontiguousarray(data.transpose(2, 1, 0))
+
+    if os.path.exists(outfile): os.remove(outfile)
+    shdu = fits.StreamingHDU(outfile, header)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = deque()
+        for ii, batch in enumerate(batches):
+            futures.append(executor.submit(compute_batch, batch))
+            if len(futures) > max(1, workers):
+                shdu.write(futures.popleft().result())
+            print('writing batch ' + str(ii + 1) + ' of ' + str(len(batches)), end='\r')
+        while len(futures) > 0:
+            shdu.write(futures.popleft().result())
+    shdu.close()
     return True
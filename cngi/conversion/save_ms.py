@@ -18,23 +18,144 @@ this module will be included in the api
 
 
 ###########################################
-def save_ms(xds, outfile, format='ms'):
+def save_ms(xds, outfile, format='ms', infile=None, workers=1):
     """
-    .. todo::
-        This function is not yet implemented
+    Save an xarray Visibility Dataset to Legacy CASA MS format
 
-    Save an xarray Visibility Dataset to Legacy CASA MS or FITS format
+    The (time, baseline) layout produced by convert_ms is turned back in to main table rows one batch of time steps at a
+    time (following the time chunking of the dataset).  Baselines that were NaN padded during conversion are dropped, and
+    each batch is appended to the main table with one bulk put per column.  Batches are computed by dask ahead of the
+    writer so that the computation of the next batches overlaps the table writes.
+
+    Only the main table is written.  When outfile does not exist and infile is given, infile is copied to outfile with an
+    empty main table first so that the result keeps its subtables, otherwise a bare main table is created from the data
+    variables.  When outfile already exists the rows are appended to it, so each DDI of a Visibility Dataset can be
+    saved in turn.  Requires casatools.
 
     Parameters
     ----------
     xds : xarray.core.dataset.Dataset
-        input Visibility Dataset
+        input Visibility Dataset of a single DDI with (time, baseline, ...) dimensions
     outfile : str
         Output MS filename
     format : str
-        Conversion output format, 'ms' or 'fits'.  Default = 'ms'
+        Conversion output format, only 'ms' is supported.  Default = 'ms'
+    infile : str
+        Optional MS used as a template for a new outfile, its subtables and column layout are copied.  Default None
+    workers : int
+        Number of time batches computed concurrently ahead of the writer, memory use is about workers+1 batches.  Default is 1
 
     Returns
     -------
     """
-    return True
\ No newline at end of file
+    import os
+    import numpy as np
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from cngi._helper.table_conversion import revert_time
+    try:
+        from casatools import table as tb
+    except ImportError:
+        print('######### ERROR : save_ms requires casatools to write the MS')
+        return False
+
+    if format != 'ms':
+        print('######### ERROR : only MS output is supported')
+        return False
+
+    outfile = os.path.expanduser(outfile)
+    if ('time' not in xds.dims) or ('baseline' not in xds.dims) or ('antennas' not in xds.coords):
+        print('######### ERROR : xds must be a Visibility Dataset with time and baseline dimensions and an antennas coordinate')
+        return False
+
+    # data variables that map back to main table columns, with the row axes first and the cell axes after
+    varnames = [vv for vv in xds.data_vars if (list(xds[vv].dims[:2]) == ['time', 'baseline']) and (xds[vv].dtype.kind in 'biufc')]
+
+    # baselines that were missing at a time step were NaN padded by convert_ms, the first float column marks them
+    marker = [vv for vv in ['TIME_CENTROID', 'EXPOSURE', 'UVW'] + varnames if (vv in varnames) and (xds[vv].dtype.kind in 'fc')]
+    marker = marker[0] if len(marker) > 0 else None
+
+    # per-time columns stored as coordinates, the remaining id coordinates hold global values and are not reverted
+    time_cols = [(cc, col) for cc, col in [('scan', 'SCAN_NUMBER'), ('interval', 'INTERVAL'), ('field_id', 'FIELD_ID')] if cc in xds.coords]
+    ant1, ant2 = xds.antennas.values[:, 0].astype(np.int32), xds.antennas.values[:, 1].astype(np.int32)
+    n_baseline = xds.sizes['baseline']
+    ddi = int(xds.attrs.get('ddi', 0))
+
+    # casa value types of the numpy dtypes, wider integer columns are written as int
+    value_types = {'b': 'boolean', 'i': 'int', 'u': 'int', 'f4': 'float', 'f8': 'double', 'c8': 'complex', 'c16': 'dcomplex'}
+    def value_type(dtype):
+        return value_types.get(dtype.kind + str(dtype.itemsize), value_types.get(dtype.kind))
+
+    def cast(data):
+        return data.astype(np.int32) if data.dtype.kind in 'iu' else data
+
+    # compute one time batch and flatten it to main table rows, dropping the padded baselines
+    # the batches follow the time chunks of the data variables, the coordinates may be chunked differently
+    chunked = [vv for vv in varnames if xds[vv].chunks is not None]
+    time_chunks = xds[chunked[0]].chunks[0] if len(chunked) > 0 else (xds.sizes['time'],)
+    starts = np.cumsum((0,) + tuple(time_chunks))
+    def compute_batch(tt):
+        bxds = xds[varnames].isel(time=slice(starts[tt], starts[tt + 1])).compute()
+        n_time = bxds.sizes['time']
+        if marker is None:
+            valid = np.ones(n_time * n_baseline, dtype=bool)
+        else:
+            mdata = bxds[marker].values.reshape(n_time * n_baseline, -1)
+            valid = ~np.all(np.isnan(mdata), axis=1)
+        rows = {'TIME': np.repeat(revert_time(bxds.time.values), n_baseline)[valid],
+                'ANTENNA1': np.tile(ant1, n_time)[valid], 'ANTENNA2': np.tile(ant2, n_time)[valid],
+                'DATA_DESC_ID': np.full(np.sum(valid), ddi, dtype=np.int32)}
+        for cc, col in time_cols:
+            rows[col] = cast(np.repeat(xds[cc].values[starts[tt]:starts[tt + 1]], n_baseline)[valid])
+        for col in varnames:
+            data = bxds[col].values
+            rows[col] = cast(data.reshape((n_time * n_baseline,) + data.shape[2:])[valid])
+        return rows
+
+    # the first batch also defines the columns of a new bare main table
+    first = compute_batch(0)
+    tb_tool = tb()
+    if not os.path.exists(outfile):
+        if infile is not None:
+            tb_tool.open(os.path.expanduser(infile), nomodify=True)
+            tb_tool.copy(outfile, deep=True, valuecopy=True, norows=True)
+            tb_tool.close()
+        else:
+            desc = {}
+            for col, data in first.items():
+                desc[col] = {'valueType': value_type(data.dtype), 'dataManagerType': 'StandardStMan', 'dataManagerGroup': 'StandardStMan',
+                             'option': 0, 'maxlen': 0, 'comment': '', 'keywords': {}}
+                if data.ndim > 1:  # array shapes vary between DDIs, so the shape is not fixed
+                    desc[col]['ndim'] = data.ndim - 1
+            tb_tool.create(outfile, desc)
+            tb_tool.putinfo({'type': 'Measurement Set', 'subType': '', 'readme': ''})
+            tb_tool.close()
+
+    tb_tool.open(outfile, nomodify=False)
+    columns = tb_tool.colnames()
+    missing = [col for col in first.keys() if col not in columns]
+    if len(missing) > 0: print('WARNING : columns %s not found in %s, skipping' % (str(missing), outfile))
+
+    # casatools column arrays have the cell axes reversed and the row axis last
+    def write_batch(rows):
+        startrow, nrow = tb_tool.nrows(), len(rows['TIME'])
+        if nrow == 0: return
+        tb_tool.addrows(nrow)
+        for col, data in rows.items():
+            if col not in columns: continue
+            tb_tool.putcol(col, data.transpose(), startrow, nrow)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        write_batch(first)
+        futures = deque()
+        for tt in range(1, len(time_chunks)):
+            futures.append(executor.submit(compute_batch, tt))
+            if len(futures) > max(1, workers):
+                write_batch(futures.popleft().result())
+            print('writing batch ' + str(tt + 1) + ' of ' + str(len(time_chunks)), end='\r')
+        while len(futures) > 0:
+            write_batch(futures.popleft().result())
+
+    tb_tool.flush()
+    tb_tool.close()
+    return True
@@ -13,3 +13,6 @@ from .read_image import *
 from .write_image import *
 from .write_zarr import *
 from .append_zarr import *
+from .select_codecs import *
+from .rechunk_vis import *
+from .rechunk_image import *
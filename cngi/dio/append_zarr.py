@@ -16,12 +16,7 @@ this module will be included in the api
 """
 
 #############################################
-'''
-To Do:
-1. zarr.consolidate_metadata(outfile) is very slow for a zarr group (datatset) with many chunks (there is a python for loop that checks each file). We might have to implement our own version. We could also look at just appending to the json file the information of the new data variables. This is also important for cngi.dio.write_zarr
-'''
-
-def append_zarr(list_xarray_data_variables,outfile,chunks_return={},compressor=None,graph_name='append_zarr'):
+def append_zarr(list_xarray_data_variables,outfile,chunks_return={},compressor=None,graph_name='append_zarr',encoding=None):
     """
     Append a list of dask arrays to a zarr file on disk. If a data variable with the same name is found it will be overwritten.
     Data will probably be corrupted if append_zarr overwrites the data variable from which the dask array gets its data.
@@ -42,6 +37,9 @@ def append_zarr(list_xarray_data_variables,outfile,chunks_return={},compressor=N
     graph_name : string
         The time taken to execute the graph and save the dataset is measured and saved as an attribute in the zarr file.
         The graph_name is the label for this timing information.
+    encoding : dict
+        zarr encoding of individual data variables, such as returned by cngi.dio.select_codecs. Variables not in encoding use the compressor.
+        Default None uses the compressor for every data variable
     Returns
     -------
     """
@@ -55,6 +53,7 @@ def append_zarr(list_xarray_data_variables,outfile,chunks_return={},compressor=N
     import dask.array as da
     import time
     from numcodecs import Blosc
+    from cngi._helper.zarr_regions import consolidate_metadata
     
     start = time.time()
     n_arrays = len(list_xarray_data_variables)
@@ -65,18 +64,19 @@ def append_zarr(list_xarray_data_variables,outfile,chunks_return={},compressor=N
     
     if compressor is None:
         compressor = Blosc(cname='zstd', clevel=2, shuffle=0)
+    if encoding is None:
+        encoding = {}
     ######################################################################################
     #Create a list of delayed zarr.create commands (list_target_zarr) for each dask array in list_dask_array.
     ######################################################################################
     
     list_target_zarr = []
     list_dask_array = []
+    list_new_dim_name = []
+    list_new_coord_name = []
+    list_new_coord_dim_names = []
     
     for i in range(n_arrays):
-        list_new_dim_name = []
-        list_new_coord_name = []
-        list_new_coord_dim_names = []
-    
         #Create list of dimension chunk sizes on disk
         chunksize_on_disk =[]
         
@@ -139,9 +139,11 @@ def append_zarr(list_xarray_data_variables,outfile,chunks_return={},compressor=N
         
         #Create list of delayed objects
         mapper = get_mapper(outfile+'/'+ list_xarray_data_variables[i].name)
+        var_encoding = dict({'compressor': compressor}, **encoding.get(list_xarray_data_variables[i].name, {}))
         list_target_zarr.append(dask.delayed(zarr.create)(
              shape=dask_array.shape,
-             compressor=compressor,
+             compressor=var_encoding['compressor'],
+             filters=var_encoding.get('filters'),
              chunks=chunksize_on_disk,
              dtype=dask_array.dtype,
              store=mapper,
@@ -170,8 +172,11 @@ def append_zarr(list_xarray_data_variables,outfile,chunks_return={},compressor=N
     print('Time to append and execute graph ', graph_name, time_to_calc_and_store)
     dataset_group.attrs[graph_name+'_time'] = time_to_calc_and_store
     
-    #Consolidate metadata #Can be improved by only adding appended metadata
-    zarr.consolidate_metadata(outfile)
+    #Consolidate metadata, only the appended variables and their dimensions and coordinates are merged in to the existing metadata
+    appended = set()
+    for xarray_data_variable in list_xarray_data_variables:
+        appended.update([xarray_data_variable.name] + list(xarray_data_variable.dims) + list(xarray_data_variable.coords))
+    consolidate_metadata(outfile, names=sorted(appended))
     
     if bool(chunks_return):
         return xr.open_zarr(outfile,chunks=chunks_return,overwrite_encoded_chunks=True,consolidated=True)
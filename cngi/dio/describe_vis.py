@@ -20,6 +20,9 @@ def describe_vis(infile):
     """
     Summarize the contents of a zarr format Visibility directory on disk
 
+    The summary is computed from the consolidated metadata of each DDI and cached in the directory, so only DDIs
+    written since the last call are read again.
+
     Parameters
     ----------
     infile : str
@@ -31,17 +34,7 @@ def describe_vis(infile):
         Summary information
     """
     import os
-    import pandas as pd
-    from xarray import open_zarr
+    from cngi._helper.vis_index import read_summary
     
     infile = os.path.expanduser(infile)  # does nothing if $HOME is unknown
-    summary = pd.DataFrame([])
-    for ii, ddi in enumerate(os.listdir(infile)):
-        if ddi == 'global': continue
-        dpath = os.path.join(infile, str(ddi))
-        xds = open_zarr(dpath)
-        sdf = {'ddi': ddi, 'spw_id':xds.spw.values[0], 'size_GB': xds.nbytes / 1024 ** 3, 'channels':len(xds.chan), 'times': len(xds.time),
-               'baselines':len(xds.baseline), 'fields':len(xds.field)}
-        summary = pd.concat([summary, pd.DataFrame(sdf, index=[ii])], axis=0, sort=False)
-    
-    return summary.set_index('ddi')
+    return read_summary(infile)
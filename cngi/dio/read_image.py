@@ -21,6 +21,9 @@ def read_image(infile):
   """
   Read xarray zarr format image from disk
 
+  Spatial world coordinates (ie right_ascension and declination) described by the direction_wcs attribute are added
+  as lazy dask arrays, each spatial chunk is only computed when its values are used.
+
   Parameters
   ----------
   infile : str
@@ -33,8 +36,10 @@ def read_image(infile):
   """
   import os
   from xarray import open_zarr
+  import cngi._helper.codecs  # registers the cngi zarr filters
+  from cngi._helper.image_wcs import assign_world_coords
   
   infile = os.path.expanduser(infile)
-  xds = open_zarr(infile)
+  xds = assign_world_coords(open_zarr(infile))
   return xds
 
@@ -16,26 +16,55 @@ this module will be included in the api
 """
 
 #############################################
-def read_vis(infile, ddi=0):
+def read_vis(infile, ddi=0, time_range=None, scans=None, fields=None, antennas=None, baselines=None, chan_range=None, pols=None,
+             max_flag_fraction=None, amp_range=None):
   """
   Read zarr format Visibility data from disk to xarray Dataset
 
+  The selections are resolved against the coordinates once and applied as isel indexers, contiguous selections become slices,
+  so only the zarr chunks holding selected data are ever read. Selections apply to every DDI when ddi is None but not to 'global'.
+
   Parameters
   ----------
   infile : str
       input Visibility filename
-  ddi : int
-      Data Description ID of Visibility data to read. Defaults to 0
+  ddi : int or str
+      Data Description ID of Visibility data to read, or 'global' for the metadata. The POINTING variables of the global metadata
+      are read lazily from their own group, so only the time ranges used are loaded. Use None to read every DDI and the global
+      metadata at once as a read only mapping of ddi to Dataset, each Dataset is opened from its consolidated metadata the first
+      time it is accessed. The summary attribute of the mapping is the same summary index returned by describe_vis. Defaults to 0
+  time_range : tuple
+      (start, end) times to select, in any form accepted by numpy.datetime64 (ie '2017-01-01T05:00:00'). Default None selects all times
+  scans : int or list of int
+      Scan numbers to select. Default None selects all scans
+  fields : int, str or list
+      Field ids or names to select. Default None selects all fields
+  antennas : int or list of int
+      Antenna ids to select, only baselines between two of these antennas are kept. Default None selects all antennas
+  baselines : list of tuple
+      (antenna1, antenna2) pairs of the baselines to select. Default None selects all baselines
+  chan_range : tuple
+      (start, end) channel frequencies in Hz to select. Default None selects all channels
+  pols : int or list of int
+      Polarization codes to select (ie 9 for XX). Default None selects all polarizations
+  max_flag_fraction : float
+      Skip the chunks with a larger fraction of flagged data, using the chunk statistics written by convert_ms or write_vis
+      with chunk_stats=True. Kept chunks may still hold flagged data. Default None keeps all chunks
+  amp_range : tuple
+      (min, max) visibility amplitude, skip the chunks whose amplitudes are all outside this range according to the chunk statistics.
+      Kept chunks may still hold amplitudes outside the range. Default None keeps all chunks
 
   Returns
   -------
   xarray.core.dataset.Dataset
-      New xarray Dataset of Visibility data contents
+      New xarray Dataset of Visibility data contents, or a mapping of ddi to Dataset when ddi is None
   """
   import os
-  from xarray import open_zarr
+  from cngi._helper.vis_index import read_partition, VisCollection
 
   infile = os.path.expanduser(infile)
-  xds = open_zarr(infile + '/' + str(ddi))
-  return xds
-
+  selection = {'time_range': time_range, 'scans': scans, 'fields': fields, 'antennas': antennas, 'baselines': baselines, 'chan_range': chan_range,
+               'pols': pols, 'max_flag_fraction': max_flag_fraction, 'amp_range': amp_range}
+  if ddi is None:
+    return VisCollection(infile, selection)
+  return read_partition(infile, ddi, selection)
@@ -0,0 +1,60 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+this module will be included in the api
+"""
+
+#############################################
+def rechunk_image(infile, outfile, chunks, max_memory=0.5, tmp_dir=None, workers=1):
+    """
+    Copy a zarr format image to a new zarr image with different chunking
+
+    Arrays are copied out-of-core one block at a time, in one pass when a block of whole source and target chunks fits in max_memory
+    and otherwise in two passes through a temporary intermediate store, see rechunk_vis. The chunking is recorded in the chunk_layout attribute.
+
+    Parameters
+    ----------
+    infile : str
+        input zarr image filename
+    outfile : str
+        output zarr image filename, generally ends in .img.zarr. Any existing outfile is replaced
+    chunks : dict of int
+        chunk size of each dimension to change, ie {'d0': -1, 'd1': -1, 'chan': 1}. Use -1 for an entire axis in one chunk,
+        dimensions not given keep their chunking
+    max_memory : float
+        memory budget in GB for the blocks held in memory, shared between the workers. Default is 0.5
+    tmp_dir : str
+        directory for the temporary intermediate store, removed when done. Default None uses the directory of outfile
+    workers : int
+        number of blocks copied concurrently. Default is 1 (serial)
+
+    Returns
+    -------
+    xarray.core.dataset.Dataset
+        New xarray Dataset of the rechunked image
+    """
+    import os
+    import shutil
+    from cngi._helper.rechunking import rechunk_group
+    from cngi.dio import read_image
+
+    infile, outfile = os.path.expanduser(infile), os.path.expanduser(outfile)
+    if os.path.abspath(infile) == os.path.abspath(outfile):
+        print('######### ERROR : outfile must be different from infile')
+        return None
+
+    shutil.rmtree(outfile, ignore_errors=True)
+    if not rechunk_group(infile, outfile, chunks, max_memory * 1024 ** 3, tmp_dir, workers):
+        return None
+    return read_image(outfile)
@@ -0,0 +1,76 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+this module will be included in the api
+"""
+
+#############################################
+def rechunk_vis(infile, outfile, chunks, ddi=None, max_memory=0.5, tmp_dir=None, workers=1):
+    """
+    Copy a zarr format Visibility directory to a new directory with different chunking, without converting from the MS again
+
+    Arrays are copied out-of-core one block at a time. When a block made of whole source chunks and whole target chunks fits in
+    max_memory it is copied in one pass, otherwise the source chunks are first copied to an intermediate store with chunking in
+    between the two and then in to the target chunks (two passes), so memory use stays bounded however different the chunkings are.
+    The chunking is recorded in the chunk_layout attribute of each DDI.
+
+    Parameters
+    ----------
+    infile : str
+        input Visibility filename
+    outfile : str
+        output Visibility filename, generally ends in .vis.zarr. Any existing outfile is replaced
+    chunks : dict of int
+        chunk size of each dimension to change, ie {'time': -1, 'baseline': 1} to put the full time axis of each baseline in a chunk
+        for flagging, or {'chan': 1} for cube imaging. Use -1 for an entire axis in one chunk, dimensions not given keep their chunking
+    ddi : int or list of int
+        DDIs to rechunk. Default None rechunks every DDI. The global metadata is always copied unchanged
+    max_memory : float
+        memory budget in GB for the blocks held in memory, shared between the workers. Default is 0.5
+    tmp_dir : str
+        directory for the temporary intermediate store, removed when done. Default None uses the directory of outfile
+    workers : int
+        number of blocks copied concurrently. Default is 1 (serial)
+
+    Returns
+    -------
+    xarray.core.dataset.Dataset
+        New xarray Dataset of the rechunked Visibility data when ddi is a single DDI, otherwise the mapping of ddi to Dataset of read_vis
+    """
+    import os
+    import shutil
+    import numpy as np
+    from cngi._helper.rechunking import rechunk_group
+    from cngi._helper.vis_index import list_partitions, write_chunk_stats, stats_file
+    from cngi.dio import read_vis
+
+    infile, outfile = os.path.expanduser(infile), os.path.expanduser(outfile)
+    if os.path.abspath(infile) == os.path.abspath(outfile):
+        print('######### ERROR : outfile must be different from infile')
+        return None
+
+    ddis = list_partitions(infile) if ddi is None else [int(dd) for dd in np.atleast_1d(ddi)]
+    shutil.rmtree(outfile, ignore_errors=True)
+    os.makedirs(outfile)
+    if os.path.isdir(os.path.join(infile, 'global')):
+        shutil.copytree(os.path.join(infile, 'global'), os.path.join(outfile, 'global'))
+
+    for dd in ddis:
+        if not rechunk_group(os.path.join(infile, str(dd)), os.path.join(outfile, str(dd)), chunks, max_memory * 1024 ** 3, tmp_dir, workers):
+            shutil.rmtree(outfile, ignore_errors=True)
+            return None
+        if os.path.exists(os.path.join(infile, str(dd), stats_file)):  # chunk statistics follow the new chunking
+            write_chunk_stats(os.path.join(outfile, str(dd)))
+
+    return read_vis(outfile, ddi=ddis[0] if np.ndim(ddi) == 0 and ddi is not None else None)
@@ -0,0 +1,111 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+this module will be included in the api
+"""
+
+#############################################
+def select_codecs(xds, variables=None, nsamples=3, candidates=None, bandwidth=500, repeats=2):
+    """
+    Benchmark zarr compressors and filters on a sample of chunks of each data variable and select the fastest for each
+
+    Each candidate is scored by the estimated time to write and read back the sampled chunks: the measured encode and decode time
+    plus twice the compressed size divided by the storage bandwidth.  A slow disk or network favors the best compression ratio, a fast one
+    favors the fastest codec.  The returned encoding is accepted by convert_ms, convert_image, write_vis, write_image, write_zarr and append_zarr.
+
+    Parameters
+    ----------
+    xds : xarray.core.dataset.Dataset
+        dataset to sample, such as one returned by read_vis or read_image. Dask backed variables are sampled by chunk
+    variables : list of str
+        data variables to benchmark. Default None benchmarks every numeric data variable
+    nsamples : int
+        number of chunks sampled per data variable, evenly spaced through the chunk grid. Default is 3
+    candidates : list of dict
+        zarr encodings to try, each a dict with a 'compressor' and optional 'filters' list. Default None tries blosc lz4 and zstd with no shuffle,
+        byte shuffle and bit shuffle, each also behind a ComplexSplit filter for complex data and a PackBits filter for boolean data
+    bandwidth : float
+        storage bandwidth in MB/s used to weigh compression ratio against codec speed. Default is 500
+    repeats : int
+        number of times each candidate is run on each sample, the fastest run is kept. Default is 2
+
+    Returns
+    -------
+    dict
+        zarr encoding of each data variable, ie {'DATA': {'compressor': Blosc(...), 'filters': [ComplexSplit(...)]}}
+    """
+    import numpy as np
+    import dask.array as da
+    import time
+    from numcodecs import Blosc, PackBits
+    from numcodecs.compat import ensure_ndarray
+    from cngi._helper.codecs import ComplexSplit
+
+    if variables is None:
+        variables = [vv for vv in xds.data_vars if xds[vv].dtype.kind in 'biufcmM']
+
+    encoding = {}
+    for vv in variables:
+        data = xds[vv].data
+        if not isinstance(data, da.Array):
+            data = da.from_array(data, chunks=xds[vv].encoding.get('chunks', 'auto'))
+        blocks = list(np.ndindex(*data.numblocks))
+        samples = [np.ascontiguousarray(data.blocks[blocks[ii]].compute())
+                   for ii in np.unique(np.linspace(0, len(blocks) - 1, min(nsamples, len(blocks))).astype(int))]
+        nbytes = np.sum([sample.nbytes for sample in samples])
+        if nbytes == 0: continue
+
+        tests = candidates
+        if tests is None:
+            compressors = [Blosc(cname=cname, clevel=clevel, shuffle=shuffle) for cname, clevel in [('lz4', 5), ('zstd', 2)]
+                           for shuffle in [Blosc.NOSHUFFLE, Blosc.SHUFFLE, Blosc.BITSHUFFLE]]
+            tests = [{'compressor': cc, 'filters': None} for cc in compressors]
+            if data.dtype.kind == 'c':
+                tests += [{'compressor': cc, 'filters': [ComplexSplit(dtype=data.dtype)]} for cc in compressors]
+            elif data.dtype.kind == 'b':
+                tests += [{'compressor': cc, 'filters': [PackBits()]} for cc in compressors]
+
+        best, best_cost = None, np.inf
+        for test in tests:
+            filters = test.get('filters') or []
+            encode_time, decode_time, csize = 0.0, 0.0, 0
+            try:
+                for sample in samples:
+                    times = []
+                    for rr in range(max(1, repeats)):
+                        t0 = time.perf_counter()
+                        buf = sample
+                        for ff in filters: buf = ff.encode(buf)
+                        buf = test['compressor'].encode(buf)
+                        t1 = time.perf_counter()
+                        out = test['compressor'].decode(buf)
+                        for ff in filters[::-1]: out = ff.decode(out)
+                        times += [(t1 - t0, time.perf_counter() - t1)]
+                    if ensure_ndarray(out).tobytes() != sample.tobytes(): raise ValueError('not lossless')
+                    encode_time += min([tt[0] for tt in times])
+                    decode_time += min([tt[1] for tt in times])
+                    csize += len(buf)
+            except Exception as err:
+                print('WARNING : skipping %s for %s, %s' % (test['compressor'], vv, err))
+                continue
+            cost = encode_time + decode_time + 2 * csize / (bandwidth * 1e6)
+            if cost < best_cost:
+                best, best_cost = test, cost
+                stats = (nbytes / csize, nbytes / encode_time / 1e6, nbytes / decode_time / 1e6)
+
+        if best is None: continue
+        encoding[vv] = {'compressor': best['compressor'], 'filters': best.get('filters')}
+        print('%s : %s %s ratio %.2f, encode %.0f MB/s, decode %.0f MB/s' % (vv, best['compressor'], best.get('filters') or '', *stats))
+
+    return encoding
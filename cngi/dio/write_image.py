@@ -16,9 +16,11 @@ this module will be included in the api
 """
 
 #############################################
-def write_image(xds, outfile='image.zarr'):
+def write_image(xds, outfile='image.zarr', encoding=None):
     """
     Write image dataset to xarray zarr format on disk
+
+    World coordinates described by the direction_wcs attribute are not stored, read_image rebuilds them lazily.
     
     Parameters
     ----------
@@ -26,19 +28,25 @@ def write_image(xds, outfile='image.zarr'):
         image Dataset to write to disk
     outfile : str
         output filename, generally ends in .zarr
+    encoding : dict
+        zarr encoding of individual data variables, such as returned by cngi.dio.select_codecs. Variables not in encoding use
+        the zstd compression algorithm with compression level 2. Default None
     
     Returns
     -------
     """
     import os
     from numcodecs import Blosc
-    from itertools import cycle
+    from cngi._helper.codecs import variable_encoding
+    from cngi._helper.zarr_regions import consolidate_metadata
     
     outfile = os.path.expanduser(outfile)
     compressor = Blosc(cname='zstd', clevel=2, shuffle=0)
-    encoding = dict(zip(list(xds.data_vars), 
-                        cycle([{'compressor': compressor}])))
+    encoding = variable_encoding(xds, compressor, encoding)
     
-    xds.to_zarr(outfile, mode='w', encoding=encoding)
+    lazy = [cc for cc in xds.attrs.get('direction_wcs', {}).get('names', []) if cc in xds.coords]
+    xds = xds.drop_vars(lazy)
+    xds.to_zarr(outfile, mode='w', encoding=encoding, consolidated=False)
+    consolidate_metadata(outfile)
 
 
@@ -16,7 +16,7 @@ this module will be included in the api
 """
 
 #############################################
-def write_vis(xds, outfile='vis.zarr', ddi=0, append=True):
+def write_vis(xds, outfile='vis.zarr', ddi=0, append=True, encoding=None, chunk_stats=False):
     """
     Write xarray Visibility Dataset to zarr format on disk
   
@@ -30,13 +30,21 @@ def write_vis(xds, outfile='vis.zarr', ddi=0, append=True):
         Data Description ID of Visibility data to write. Defaults to 0
     append : bool
         Append this DDI in to an existing zarr directory. False will erase old zarr directory. Default=True
+    encoding : dict
+        zarr encoding of individual data variables, such as returned by cngi.dio.select_codecs. Variables not in encoding use
+        the zstd compression algorithm with compression level 2, FLAG and FLAG_ROW are also bit packed unless they are given in encoding. Default None
+    chunk_stats : bool
+        Write a chunk statistics sidecar (time range, scans, fields, uvw range, flagged fraction and amplitude range of each chunk)
+        that read_vis uses to skip chunks. The DDI is read once more after it is written. Default is False
     
     Returns
     -------
     """
     import os
     from numcodecs import Blosc
-    from itertools import cycle
+    from cngi._helper.codecs import variable_encoding, flag_encoding
+    from cngi._helper.vis_index import write_chunk_stats
+    from cngi._helper.zarr_regions import consolidate_metadata
     
     outfile = os.path.expanduser(outfile)
     
@@ -49,5 +57,8 @@ def write_vis(xds, outfile='vis.zarr', ddi=0, append=True):
     tmp = os.system("mkdir " + outfile)
     
     compressor = Blosc(cname='zstd', clevel=2, shuffle=0)
-    encoding = dict(zip(list(xds.data_vars), cycle([{'compressor': compressor}])))
-    xds.to_zarr(outfile + '/' + str(ddi), mode='w', encoding=encoding)
+    encoding = variable_encoding(xds, compressor, flag_encoding(compressor, encoding))
+    xds.to_zarr(outfile + '/' + str(ddi), mode='w', encoding=encoding, consolidated=False)
+    consolidate_metadata(outfile + '/' + str(ddi))
+    if chunk_stats:
+        write_chunk_stats(outfile + '/' + str(ddi))
@@ -16,12 +16,7 @@ this module will be included in the api
 """
 
 
-'''
-To Do:
-1. zarr.consolidate_metadata(outfile) is very slow for a zarr group (datatset) with many chunks (there is a python for loop that checks each file). We might have to implement our own version. This is also important for cngi.dio.append_zarr
-'''
-
-def write_zarr(dataset, outfile, chunks_return={}, chunks_on_disk={}, compressor=None, graph_name='write_zarr'):
+def write_zarr(dataset, outfile, chunks_return={}, chunks_on_disk={}, compressor=None, graph_name='write_zarr', encoding=None):
     """
     Write xarray dataset to zarr format on disk. When chunks_on_disk is not specified the chunking in the input dataset is used.
     When chunks_on_disk is specified that dataset is saved using that chunking. The dataset on disk is then opened and rechunked using chunks_return or the chunking of dataset.
@@ -43,6 +38,9 @@ def write_zarr(dataset, outfile, chunks_return={}, chunks_on_disk={}, compressor
     graph_name : string
         The time taken to execute the graph and save the dataset is measured and saved as an attribute in the zarr file.
         The graph_name is the label for this timing information.
+    encoding : dict
+        zarr encoding of individual data variables, such as returned by cngi.dio.select_codecs. Variables not in encoding use the compressor.
+        Default None uses the compressor for every data variable
     Returns
     -------
     """
@@ -50,7 +48,8 @@ def write_zarr(dataset, outfile, chunks_return={}, chunks_on_disk={}, compressor
     import zarr
     import time
     from numcodecs import Blosc
-    from itertools import cycle
+    from cngi._helper.codecs import variable_encoding
+    from cngi._helper.zarr_regions import consolidate_metadata
     from zarr.meta import json_dumps, json_loads
     from zarr.creation import normalize_store_arg, open_array
     
@@ -64,7 +63,7 @@ def write_zarr(dataset, outfile, chunks_return={}, chunks_on_disk={}, compressor
         compressor = Blosc(cname='zstd', clevel=2, shuffle=0)
     
     #Create compression encoding for each datavariable
-    encoding = dict(zip(list(dataset_for_disk.data_vars), cycle([{'compressor': compressor}])))
+    encoding = variable_encoding(dataset_for_disk, compressor, encoding)
     start = time.time()
     #Consolidated is set to False so that the timing information is included in the consolidate metadata.
     xr.Dataset.to_zarr(dataset_for_disk, store=outfile, mode='w', encoding=encoding,consolidated=False)
@@ -75,8 +74,8 @@ def write_zarr(dataset, outfile, chunks_return={}, chunks_on_disk={}, compressor
     dataset_group = zarr.open_group(outfile,mode='a')
     dataset_group.attrs[graph_name+'_time'] = time_to_calc_and_store
     
-    #Consolidate metadata
-    zarr.consolidate_metadata(outfile)
+    #Consolidate metadata, reads only the metadata keys and not the chunks
+    consolidate_metadata(outfile)
     
     if bool(chunks_return):
         return xr.open_zarr(outfile,consolidated=True,overwrite_encoded_chunks=True)
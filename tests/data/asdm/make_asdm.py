@@ -0,0 +1,136 @@
+# generates the synthetic ASDM fixture used by tests/test_asdm_conversion.py, requires only numpy
+# every visibility is a simple function of the integration, antennas, channel and correlation (see value below)
+# so the tests can recompute them.  Two correlator configurations are used:
+#   config 0 : antennas 0-3, spw 0 (8 chans, XX XY YX YY) and spw 1 (4 chans, XX YY), float cross data, 5 integrations
+#   config 1 : antennas 0-2, spw 0 only, int32 cross data with scale factor 8, 4 integrations
+import numpy as np
+import shutil
+import os
+
+t0 = 4900000000 * 10 ** 9  # MJD ns
+tint = 10 ** 9  # 1 s integrations
+corr_names = [['XX', 'XY', 'YX', 'YY'], ['XX', 'YY']]
+sd_names = [['XX', 'XY', 'YY'], ['XX', 'YY']]
+nchans = [8, 4]
+
+
+def value(tt, a1, a2, ch, pp, spw):
+    return tt * 1000 + a1 * 100 + a2 * 10 + ch + 1j * (pp + 10 * spw)
+
+
+def flagged(tt, a1, a2, pp):
+    return (tt + a1 + 2 * a2 + pp) % 7 == 0
+
+
+def table(name, rows):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<%sTable xmlns="http://Alma/XASDM/%sTable">' % (name, name)]
+    for row in rows:
+        lines += ['<row>'] + ['<%s>%s</%s>' % (kk, vv, kk) for kk, vv in row.items()] + ['</row>']
+    return '\n'.join(lines + ['</%sTable>' % name]) + '\n'
+
+
+def arr(values):
+    values = np.array(values)
+    return ' '.join([str(values.ndim)] + [str(ss) for ss in values.shape] + [str(vv) for vv in values.ravel()])
+
+
+def bdf(filename, uid, antennas, spws, times, crosstype, scale):
+    nant = len(antennas)
+    bl = [(antennas[ii], antennas[jj]) for jj in range(1, nant) for ii in range(jj)]
+    parts = []
+    for ti in times:
+        cross, auto, flags = [], [], []
+        for a1, a2 in bl:
+            for ss in spws:
+                for ch in range(nchans[ss]):
+                    for pp, name in enumerate(corr_names[ss]):
+                        vv = value(ti, a1, a2, ch, pp, ss)
+                        cross += [vv.real * scale, vv.imag * scale]
+        for aa in antennas:
+            for ss in spws:
+                for ch in range(nchans[ss]):
+                    xx, xy, yy = value(ti, aa, aa, ch, 0, ss).real, value(ti, aa, aa, ch, 1, ss), value(ti, aa, aa, ch, len(corr_names[ss]) - 1, ss).real
+                    auto += [xx, xy.real, xy.imag, yy] if len(sd_names[ss]) == 3 else [xx, yy]
+        for a1, a2 in bl:
+            for ss in spws:
+                flags += [int(flagged(ti, a1, a2, pp)) for pp in range(len(corr_names[ss]))]
+        for aa in antennas:
+            for ss in spws:
+                flags += [int(flagged(ti, aa, aa, pp)) for pp in range(len(sd_names[ss]))]
+        path = '%s/%d/' % (uid, ti)
+        desc = ('<sdmDataSubsetHeader xmlns:xlink="http://www.w3.org/1999/xlink" projectPath="%s"><schedulePeriodTime><time>%d</time>'
+                '<interval>%d</interval></schedulePeriodTime><dataStruct ref="sdmDataHeader"/><flags xlink:href="%sflags.bin"/>'
+                '<crossData xlink:href="%scrossData.bin" type="%s"/><autoData xlink:href="%sautoData.bin"/></sdmDataSubsetHeader>'
+                % (path, t0 + ti * tint + tint // 2, tint, path, path, crosstype, path))
+        dtype = {'FLOAT32_TYPE': '<f4', 'INT32_TYPE': '<i4'}[crosstype]
+        parts += [b'--MIME_boundary-1\nContent-Type: multipart/related; boundary="MIME_boundary-2";type="text/xml"; start="<DataSubset.xml>"\n'
+                  b'Content-Description: Data and metadata subset\n\n'
+                  b'--MIME_boundary-2\nContent-Type: text/xml; charset="UTF-8"\nContent-Location: ' + path.encode() + b'desc.xml\n\n' + desc.encode() + b'\n']
+        for name, data in [('flags', np.array(flags, dtype='<u4')), ('crossData', np.array(cross, dtype=dtype)), ('autoData', np.array(auto, dtype='<f4'))]:
+            parts += [b'--MIME_boundary-2\nContent-Type: application/octet-stream\nContent-Location: ' + path.encode() + name.encode() + b'.bin\n\n'
+                      + data.tobytes() + b'\n']
+        parts += [b'--MIME_boundary-2--\n']
+    windows = ''.join(['<baseband name="BB_%d"><spectralWindow sw="%d" crossPolProducts="%s" sdPolProducts="%s" scaleFactor="%s" '
+                       'numSpectralPoint="%d" numBin="1" sideband="USB"/></baseband>' % (ss + 1, ss + 1, ' '.join(corr_names[ss]), ' '.join(sd_names[ss]),
+                                                                                         str(scale), nchans[ss]) for ss in spws])
+    header = ('<?xml version="1.0" encoding="UTF-8"?>\n<sdmDataHeader xmlns="http://Alma/XASDM/sdmbin" byteOrder="Little_Endian" projectPath="%s/">'
+              '<startTime>%d</startTime><numTime>%d</numTime><numAntenna>%d</numAntenna><correlationMode>CROSS_AND_AUTO</correlationMode>'
+              '<spectralResolution>FULL_RESOLUTION</spectralResolution><processorType>CORRELATOR</processorType>'
+              '<dataStruct correlationMode="CROSS_AND_AUTO" spectralResolution="FULL_RESOLUTION">%s'
+              '<flags size="0" axes="BAL ANT BAB SPW POL"/><crossData size="0" axes="BAL BAB SPW SPP POL"/>'
+              '<autoData size="0" axes="ANT BAB SPW SPP POL" normalized="false"/></dataStruct></sdmDataHeader>'
+              % (uid, t0 + times[0] * tint, len(times), nant, windows))
+    with open(filename, 'wb') as fh:
+        fh.write(b'MIME-Version: 1.0\nContent-Type: multipart/mixed; boundary="MIME_boundary-1";\n type="text/xml"\nContent-Description: Correlator\n'
+                 b'alma-uid:' + uid.encode() + b'\n\n--MIME_boundary-1\nContent-Type: text/xml; charset="UTF-8"\nContent-Transfer-Encoding: 8bit\n'
+                 b'Content-Location: sdmDataHeader.xml\n\n' + header.encode() + b'\n' + b''.join(parts) + b'--MIME_boundary-1--\n')
+
+
+def make_asdm(name):
+    shutil.rmtree(name, ignore_errors=True)
+    os.makedirs(os.path.join(name, 'ASDMBinary'))
+    tables = {'Antenna': [{'antennaId': 'Antenna_%d' % aa, 'name': 'DA4%d' % aa, 'antennaMake': 'UNDEFINED', 'antennaType': 'GROUND_BASED',
+                           'dishDiameter': 12.0, 'position': arr([0.0, 0.0, 0.0]), 'offset': arr([0.0, 0.0, float(aa)]), 'time': 0,
+                           'stationId': 'Station_%d' % aa} for aa in range(4)],
+              'Station': [{'stationId': 'Station_%d' % aa, 'name': 'A%03d' % aa, 'position': arr([1.0 * aa, 2.0, 3.0]), 'type': 'ANTENNA_PAD'}
+                          for aa in range(4)],
+              'Field': [{'fieldId': 'Field_%d' % ff, 'fieldName': 'src%d' % ff, 'numPoly': 0, 'delayDir': arr([[0.1 * ff, 0.2]]),
+                         'phaseDir': arr([[0.1 * ff, 0.2]]), 'referenceDir': arr([[0.1 * ff, 0.2]]), 'code': 'none'} for ff in range(2)],
+              'SpectralWindow': [{'spectralWindowId': 'SpectralWindow_%d' % ss, 'basebandName': 'BB_%d' % (ss + 1), 'netSideband': 'USB',
+                                  'numChan': nchans[ss], 'refFreq': 1e11 + 1e9 * ss, 'sidebandProcessingMode': 'NONE', 'totalBandwidth': 1e6 * nchans[ss],
+                                  'windowFunction': 'UNIFORM', 'chanFreqStart': 1e11 + 1e9 * ss, 'chanFreqStep': 1e6, 'chanWidth': 1e6,
+                                  'effectiveBw': 1e6, 'resolution': 1e6, 'name': 'spw%d' % ss} for ss in range(2)],
+              'Polarization': [{'polarizationId': 'Polarization_%d' % ss, 'numCorr': len(corr_names[ss]), 'corrType': arr(corr_names[ss]),
+                                'corrProduct': arr([list(cc) for cc in corr_names[ss]])} for ss in range(2)],
+              'DataDescription': [{'dataDescriptionId': 'DataDescription_%d' % ss, 'polOrHoloId': 'Polarization_%d' % ss,
+                                   'spectralWindowId': 'SpectralWindow_%d' % ss} for ss in range(2)],
+              'ConfigDescription': [{'configDescriptionId': 'ConfigDescription_0', 'numAntenna': 4, 'numDataDescription': 2, 'numFeed': 1,
+                                     'correlationMode': 'CROSS_AND_AUTO', 'numAtmPhaseCorrection': 1, 'atmPhaseCorrection': arr(['AP_UNCORRECTED']),
+                                     'processorType': 'CORRELATOR', 'spectralType': 'FULL_RESOLUTION', 'antennaId': arr(['Antenna_%d' % aa for aa in range(4)]),
+                                     'dataDescriptionId': arr(['DataDescription_0', 'DataDescription_1'])},
+                                    {'configDescriptionId': 'ConfigDescription_1', 'numAntenna': 3, 'numDataDescription': 1, 'numFeed': 1,
+                                     'correlationMode': 'CROSS_AND_AUTO', 'numAtmPhaseCorrection': 1, 'atmPhaseCorrection': arr(['AP_UNCORRECTED']),
+                                     'processorType': 'CORRELATOR', 'spectralType': 'FULL_RESOLUTION', 'antennaId': arr(['Antenna_%d' % aa for aa in range(3)]),
+                                     'dataDescriptionId': arr(['DataDescription_0'])}],
+              'Main': []}
+
+    # main rows of (configuration, first integration, number of integrations, scan, field, cross data type, scale factor)
+    for nn, (config, start, nint, scan, field, crosstype, scale) in enumerate([(0, 0, 3, 1, 0, 'FLOAT32_TYPE', 1.0), (0, 3, 2, 1, 0, 'FLOAT32_TYPE', 1.0),
+                                                                               (1, 5, 4, 2, 1, 'INT32_TYPE', 8.0)]):
+        uid = 'uid://A002/X1/X%d' % (nn + 1)
+        antennas = list(range(4)) if config == 0 else list(range(3))
+        spws = [0, 1] if config == 0 else [0]
+        bdf(os.path.join(name, 'ASDMBinary', 'uid___A002_X1_X%d' % (nn + 1)), uid, antennas, spws, list(range(start, start + nint)), crosstype, scale)
+        tables['Main'] += [{'time': t0 + start * tint + nint * tint // 2, 'numAntenna': len(antennas), 'timeSampling': 'INTEGRATION',
+                            'interval': nint * tint, 'numIntegration': nint, 'scanNumber': scan, 'subscanNumber': 1, 'dataSize': 0,
+                            'dataUID': '<EntityRef entityId="%s" partId="X00000000" entityTypeName="CorrelatorData" documentVersion="1"/>' % uid,
+                            'configDescriptionId': 'ConfigDescription_%d' % config, 'execBlockId': 'ExecBlock_0', 'fieldId': 'Field_%d' % field,
+                            'stateId': arr(['State_0'] * len(antennas))}]
+
+    for tname, rows in tables.items():
+        with open(os.path.join(name, tname + '.xml'), 'w') as fh:
+            fh.write(table(tname, rows))
+
+
+if __name__ == '__main__':
+    make_asdm(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tiny.asdm'))
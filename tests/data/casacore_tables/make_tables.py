@@ -0,0 +1,67 @@
+# generates the casacore table fixtures used by tests/test_casacore_tables.py, requires python-casacore
+# every column value is a simple function of the row number so the tests can recompute them without casacore
+import casacore.tables as ct
+import numpy as np
+import shutil
+import os
+
+
+def make_table(name, endian, nrow=20):
+    shutil.rmtree(name, ignore_errors=True)
+    cd = [ct.makescacoldesc('ITIME', 0.0, datamanagertype='IncrementalStMan', datamanagergroup='ISM'),
+          ct.makescacoldesc('IBOOL', False, datamanagertype='IncrementalStMan', datamanagergroup='ISM'),
+          ct.makescacoldesc('ISTR', '', datamanagertype='IncrementalStMan', datamanagergroup='ISM'),
+          ct.makearrcoldesc('IARR', 0.0, ndim=2, datamanagertype='IncrementalStMan', datamanagergroup='ISM'),
+          ct.makearrcoldesc('IFIX', 0.0, shape=[2, 2], options=1, datamanagertype='IncrementalStMan', datamanagergroup='ISM'),
+          ct.makescacoldesc('SINT', 0), ct.makescacoldesc('SBOOL', False), ct.makescacoldesc('SSTR', ''),
+          ct.makescacoldesc('SCPLX', 0j), ct.makescacoldesc('SFLT', 0.0, valuetype='float'),
+          ct.makescacoldesc('SSHORT', 0, valuetype='short'), ct.makescacoldesc('SI64', 0, valuetype='int64'),
+          ct.makearrcoldesc('SDIR', 0.0, shape=[3], options=1),
+          ct.makearrcoldesc('SDIRB', False, shape=[5], options=1),
+          ct.makearrcoldesc('SVARB', False, ndim=2),
+          ct.makearrcoldesc('SVARF', 0.0, ndim=1, valuetype='float'),
+          ct.makearrcoldesc('SFIXSTR', '', shape=[2]),
+          ct.makearrcoldesc('SVARSTR', '', ndim=1),
+          ct.makearrcoldesc('SUNDEF', 0.0, ndim=1),
+          ct.makearrcoldesc('DATA', 0j, ndim=2, datamanagertype='TiledShapeStMan', datamanagergroup='TSMData'),
+          ct.makearrcoldesc('FLAG', False, ndim=2, datamanagertype='TiledShapeStMan', datamanagergroup='TSMFlag'),
+          ct.makearrcoldesc('UVW', 0.0, shape=[3], datamanagertype='TiledColumnStMan', datamanagergroup='TSMUvw')]
+    td = ct.maketabdesc(cd)
+    dm = ct.makedminfo(td, {'StandardStMan': {'BUCKETSIZE': 512}, 'ISM': {'BUCKETSIZE': 1024},
+                            'TSMData': {'DEFAULTTILESHAPE': np.array([2, 3, 4], dtype=np.int32)},
+                            'TSMFlag': {'DEFAULTTILESHAPE': np.array([2, 3, 4], dtype=np.int32)},
+                            'TSMUvw': {'DEFAULTTILESHAPE': np.array([3, 8], dtype=np.int32)}})
+    tb = ct.table(name, td, dminfo=dm, nrow=nrow, endian=endian, ack=False)
+    rr = np.arange(nrow)
+    tb.putcol('ITIME', (rr // 7).astype(float))
+    tb.putcol('IBOOL', (rr // 5) % 2 == 1)
+    tb.putcol('ISTR', ['src%d' % (ii // 9) for ii in rr])
+    tb.putcol('IFIX', np.repeat(np.arange(4.).reshape(1, 2, 2), nrow, 0) + (rr // 3)[:, None, None])
+    tb.putcol('SINT', rr * 3 - 7)
+    tb.putcol('SBOOL', rr % 3 == 0)
+    tb.putcol('SSTR', ['s' * (ii % 23) + str(ii) for ii in rr])
+    tb.putcol('SCPLX', rr + 1j * rr)
+    tb.putcol('SFLT', rr.astype(np.float32) / 3)
+    tb.putcol('SSHORT', (rr - 10).astype(np.int16))
+    tb.putcol('SI64', rr.astype(np.int64) * 10**10)
+    tb.putcol('SDIR', np.arange(3 * nrow, dtype=float).reshape(nrow, 3))
+    tb.putcol('SDIRB', (np.arange(5 * nrow) % 4 == 1).reshape(nrow, 5))
+    tb.putcol('UVW', np.arange(3 * nrow, dtype=float).reshape(nrow, 3) - 5)
+    for ii in rr:
+        tb.putcell('IARR', ii, np.arange((ii // 4 % 3 + 1) * 2, dtype=float).reshape(-1, 2) + ii // 4)
+        tb.putcell('SVARB', ii, (np.arange((ii % 3 + 1) * 2) % 3 == 0).reshape(-1, 2))
+        tb.putcell('SVARF', ii, np.arange(ii % 4 + 1, dtype=np.float32) * ii)
+        tb.putcell('SFIXSTR', ii, np.array(['a%d' % ii, 'long string number %d' % ii]))
+        tb.putcell('SVARSTR', ii, np.array(['v%d' % kk for kk in range(ii % 3 + 1)]))
+        if ii % 4 == 1: tb.putcell('SUNDEF', ii, np.arange(2.) + ii)
+        nchan = 5 if ii < 12 else 3
+        tb.putcell('DATA', ii, (np.arange(nchan * 2) + 1j * ii).reshape(nchan, 2))
+        tb.putcell('FLAG', ii, ((np.arange(nchan * 2) + ii) % 3 == 0).reshape(nchan, 2))
+    tb.close()
+    os.remove(os.path.join(name, 'table.lock'))
+
+
+if __name__ == '__main__':
+    path = os.path.dirname(os.path.abspath(__file__))
+    make_table(os.path.join(path, 'little.tbl'), 'little')
+    make_table(os.path.join(path, 'big.tbl'), 'big')
@@ -0,0 +1,55 @@
+from cngi.dio import write_zarr, append_zarr
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import xarray as xr
+import zarr
+import json
+import os
+
+class AppendZarrTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.outdir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.outdir)
+
+    def test_consolidated_metadata(self):
+        outfile = os.path.join(self.outdir, 'append.zarr')
+        xds = xr.Dataset({'DATA': (('time', 'chan'), np.arange(1., 25.).reshape(6, 4), {'note': 'original'}),
+                          'FLAG': (('time', 'chan'), np.zeros((6, 4), dtype=bool))},
+                         coords={'time': np.arange(6), 'chan': 1e9 + 1e6 * np.arange(4)}).chunk({'time': 2})
+        write_zarr(xds, outfile)
+
+        # DATA is replaced by an integer array with a new pol dimension, WEIGHT is a new variable
+        data = xr.DataArray(np.ones((6, 4, 2), dtype=np.int32), dims=('time', 'chan', 'pol'), coords={'pol': [9, 12]}, name='DATA').chunk({'time': 3, 'pol': 1})
+        weight = (xds.DATA * 2).rename('WEIGHT')
+        append_zarr([data, weight], outfile)
+
+        # the incremental consolidation must match a full zarr consolidation of the same store
+        copyfile = os.path.join(self.outdir, 'copy.zarr')
+        shutil.copytree(outfile, copyfile)
+        zarr.consolidate_metadata(copyfile)
+        with open(os.path.join(outfile, '.zmetadata')) as fid:
+            metadata = json.load(fid)['metadata']
+        with open(os.path.join(copyfile, '.zmetadata')) as fid:
+            expected = json.load(fid)['metadata']
+        self.assertEqual(metadata, expected)
+
+        # nothing of the replaced DATA array survives in the metadata
+        self.assertEqual(metadata['DATA/.zarray']['shape'], [6, 4, 2])
+        self.assertEqual(metadata['DATA/.zarray']['dtype'], '<i4')
+        self.assertFalse('note' in metadata['DATA/.zattrs'])
+        self.assertTrue('pol/.zarray' in metadata)
+        self.assertTrue('WEIGHT/.zarray' in metadata)
+
+        xds = xr.open_zarr(outfile, consolidated=True)
+        self.assertEqual(dict(xds.DATA.sizes), {'time': 6, 'chan': 4, 'pol': 2})
+        self.assertTrue(np.array_equal(xds.WEIGHT.values, np.arange(1., 25.).reshape(6, 4) * 2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+from cngi.conversion import convert_asdm
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import os
+import sys
+
+# the fixture is written by tests/data/asdm/make_asdm.py, every visibility is a function of the integration, antennas, channel and correlation
+datapath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'asdm')
+sys.path.insert(0, datapath)
+from make_asdm import value, flagged, corr_names, sd_names, nchans
+
+class ASDMConversionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.outdir = tempfile.mkdtemp()
+        cls.xds_list = convert_asdm(os.path.join(datapath, 'tiny.asdm'), os.path.join(cls.outdir, 'tiny.vis.zarr'), chunk_shape=(2, -1, -1, -1), workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.outdir)
+
+    def test_layout(self):
+        self.assertEqual(len(self.xds_list), 3)
+        xds0, xds1 = self.xds_list[1], self.xds_list[2]
+        self.assertEqual(dict(xds0.DATA.sizes), {'time': 9, 'baseline': 10, 'chan': 8, 'pol': 4})
+        self.assertEqual(dict(xds1.DATA.sizes), {'time': 5, 'baseline': 10, 'chan': 4, 'pol': 2})
+        self.assertEqual(xds0.chunks['time'], (2, 2, 2, 2, 1))  # the time coordinates are chunked like the data
+        self.assertEqual(xds1.chunks['time'], (2, 2, 1))
+        self.assertEqual(list(xds0.pol.values), [9, 10, 11, 12])
+        self.assertTrue(np.allclose(xds1.chan.values, 1.01e11 + 1e6 * np.arange(4)))
+        self.assertTrue(np.all(np.diff(xds0.time.values) == np.timedelta64(1, 's')))
+        self.assertEqual(list(xds0.scan.values), [1] * 5 + [2] * 4)
+        self.assertEqual(list(xds0.field.values), ['src0'] * 5 + ['src1'] * 4)
+        self.assertEqual(xds0.corr_product.values.tolist(), [[0, 0, 1, 1], [0, 1, 0, 1]])
+        self.assertEqual([ff.codec_id for ff in xds0.FLAG.encoding['filters']], ['packbits'])
+
+    def test_global(self):
+        mxds = self.xds_list[0]
+        self.assertEqual(list(mxds.ANT_NAME.values), ['DA40', 'DA41', 'DA42', 'DA43'])
+        self.assertEqual(list(mxds.ANT_STATION.values), ['A000', 'A001', 'A002', 'A003'])
+        self.assertEqual(mxds.FIELD_PHASE_DIR.shape, (2, 1, 2))
+
+    def test_visibilities(self):
+        for ddi, xds in enumerate(self.xds_list[1:]):
+            data, flag, antennas = xds.DATA.values, xds.FLAG.values, xds.antennas.values
+            ntime = 9 if ddi == 0 else 5
+            for tt in range(ntime):
+                for bb, (a1, a2) in enumerate(antennas):
+                    if (tt >= 5) and (max(a1, a2) == 3):  # antenna 3 is not in the second configuration
+                        self.assertTrue(np.all(np.isnan(data[tt, bb])) and np.all(flag[tt, bb]))
+                        self.assertTrue(np.isnan(xds.EXPOSURE.values[tt, bb]))
+                        continue
+                    for pp, name in enumerate(corr_names[ddi]):
+                        expected = value(tt, a1, a2, np.arange(nchans[ddi]), pp, ddi)
+                        if a1 == a2:
+                            cross_hand = value(tt, a1, a2, np.arange(nchans[ddi]), 1, ddi)  # single dish XY, YX is its conjugate
+                            expected = expected.real if name[0] == name[1] else (cross_hand if name in sd_names[ddi] else np.conj(cross_hand))
+                            sd = sd_names[ddi].index(name if name in sd_names[ddi] else name[::-1])
+                            self.assertTrue(np.all(flag[tt, bb, :, pp] == flagged(tt, a1, a2, sd)))
+                        else:
+                            self.assertTrue(np.all(flag[tt, bb, :, pp] == flagged(tt, a1, a2, pp)))
+                        self.assertTrue(np.allclose(data[tt, bb, :, pp], expected))
+
+if __name__ == '__main__':
+    unittest.main()
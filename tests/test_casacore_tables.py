@@ -0,0 +1,102 @@
+from cngi._helper.casacore_tables import table
+import unittest
+import numpy as np
+import os
+
+# fixtures are written by tests/data/casacore_tables/make_tables.py, every value is a function of the row number
+datapath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'casacore_tables')
+nrow = 20
+rr = np.arange(nrow)
+
+class CasacoreTablesBase(unittest.TestCase):
+    tablename = 'little.tbl'
+
+    def setUp(self):
+        self.tb = table()
+        self.tb.open(os.path.join(datapath, self.tablename), nomodify=True, lockoptions={'option': 'usernoread'})
+
+    def tearDown(self):
+        self.tb.close()
+
+    def test_description(self):
+        self.assertEqual(self.tb.nrows(), nrow)
+        self.assertEqual(self.tb.colnames()[:3], ['ITIME', 'IBOOL', 'ISTR'])
+        self.assertTrue(self.tb.isvarcol('SVARF'))
+        self.assertFalse(self.tb.isvarcol('SDIR'))
+
+    def test_incremental_columns(self):
+        self.assertTrue(np.array_equal(self.tb.getcol('ITIME'), rr // 7))
+        self.assertTrue(np.array_equal(self.tb.getcol('IBOOL'), (rr // 5) % 2 == 1))
+        self.assertEqual(list(self.tb.getcol('ISTR')), ['src%d' % (ii // 9) for ii in rr])
+        ifix = self.tb.getcol('IFIX')
+        self.assertEqual(ifix.shape, (2, 2, nrow))
+        self.assertTrue(np.array_equal(ifix[..., 7], np.arange(4.).reshape(2, 2).T + 2))
+        iarr = self.tb.getvarcol('IARR', startrow=8, nrow=4)
+        self.assertEqual(sorted(iarr.keys()), ['r10', 'r11', 'r12', 'r9'])
+        self.assertTrue(np.array_equal(iarr['r9'][..., 0], np.arange(6.).reshape(3, 2).T + 2))
+
+    def test_standard_scalars(self):
+        self.assertTrue(np.array_equal(self.tb.getcol('SINT'), rr * 3 - 7))
+        self.assertTrue(np.array_equal(self.tb.getcol('SBOOL'), rr % 3 == 0))
+        self.assertEqual(list(self.tb.getcol('SSTR')), ['s' * (ii % 23) + str(ii) for ii in rr])
+        self.assertTrue(np.array_equal(self.tb.getcol('SCPLX'), rr + 1j * rr))
+        self.assertTrue(np.array_equal(self.tb.getcol('SFLT'), rr.astype(np.float32) / 3))
+        self.assertTrue(np.array_equal(self.tb.getcol('SSHORT'), rr - 10))
+        self.assertTrue(np.array_equal(self.tb.getcol('SI64'), rr.astype(np.int64) * 10**10))
+        self.assertTrue(np.array_equal(self.tb.getcol('SINT', startrow=5, nrow=3, rowincr=2), np.array([5, 7, 9]) * 3 - 7))
+
+    def test_standard_arrays(self):
+        self.assertTrue(np.array_equal(self.tb.getcol('SDIR'), np.arange(3 * nrow, dtype=float).reshape(nrow, 3).T))
+        self.assertTrue(np.array_equal(self.tb.getcol('SDIRB'), (np.arange(5 * nrow) % 4 == 1).reshape(nrow, 5).T))
+        fixstr = self.tb.getcol('SFIXSTR')
+        self.assertEqual(list(fixstr[:, 13]), ['a13', 'long string number 13'])
+        svarb = self.tb.getvarcol('SVARB')
+        self.assertTrue(np.array_equal(svarb['r3'][..., 0], (np.arange(6) % 3 == 0).reshape(3, 2).T))
+        svarf = self.tb.getvarcol('SVARF')
+        self.assertTrue(np.array_equal(svarf['r8'][..., 0], np.arange(4, dtype=np.float32) * 7))
+        self.assertEqual(list(self.tb.getcell('SVARSTR', 5)), ['v0', 'v1', 'v2'])
+        self.assertEqual(self.tb.getcolshapestring('SVARF', nrow=3), ['[1]', '[2]', '[3]'])
+
+    def test_undefined_cells(self):
+        self.assertTrue(self.tb.iscelldefined('SUNDEF', 5))
+        self.assertFalse(self.tb.iscelldefined('SUNDEF', 6))
+        sundef = self.tb.getvarcol('SUNDEF')
+        self.assertTrue(sundef['r1'] is False)
+        self.assertTrue(np.array_equal(sundef['r6'][..., 0], np.arange(2.) + 5))
+        with self.assertRaises(RuntimeError):
+            self.tb.getcol('SUNDEF')
+
+    def test_tiled_columns(self):
+        self.assertTrue(np.array_equal(self.tb.getcol('UVW'), np.arange(3 * nrow, dtype=float).reshape(nrow, 3).T - 5))
+        self.assertEqual(self.tb.getcolshapestring('DATA', startrow=10, nrow=4), ['[2, 5]', '[2, 5]', '[2, 3]', '[2, 3]'])
+        data = self.tb.getcol('DATA', startrow=12)
+        self.assertEqual(data.shape, (2, 3, nrow - 12))
+        self.assertTrue(np.array_equal(data[..., 3], (np.arange(6) + 15j).reshape(3, 2).T))
+        flag = self.tb.getvarcol('FLAG', nrow=12)
+        self.assertTrue(np.array_equal(flag['r5'][..., 0], ((np.arange(10) + 4) % 3 == 0).reshape(5, 2).T))
+
+    def test_shapes(self):
+        # shapes come from the storage manager metadata, they must match the cells read back
+        for col in ['IFIX', 'IARR', 'SDIR', 'SVARB', 'SVARF', 'SUNDEF', 'UVW', 'DATA', 'FLAG']:
+            cells = self.tb.getvarcol(col)
+            expected = [cells['r%d' % (ii + 1)].shape[:-1] if cells['r%d' % (ii + 1)] is not False else () for ii in rr]
+            self.assertEqual(self.tb.getcolshapes(col), expected, col)
+        self.assertEqual(self.tb.getcolshapes('SUNDEF', startrow=5, nrow=2), [(2,), ()])
+
+    def test_taql(self):
+        tablename = os.path.join(datapath, self.tablename)
+        sel = self.tb.taql('select distinct ITIME from %s' % tablename)
+        self.assertTrue(np.array_equal(sel.getcol('ITIME'), [0., 1., 2.]))
+        sel = self.tb.taql('select SINT, ISTR from %s where ITIME = 1 AND SSHORT IN [-2, 0, 3] ORDERBY ISTR, SINT' % tablename)
+        self.assertEqual(sel.colnames(), ['SINT', 'ISTR'])
+        self.assertTrue(np.array_equal(sel.getcol('SINT'), np.array([8, 10, 13]) * 3 - 7))
+        sel = self.tb.taql('select * from %s where SINT >= 20 AND SINT < 29 ORDERBY ITIME' % tablename)
+        self.assertTrue(np.array_equal(sel.getcol('DATA')[0, 0], np.array([9, 10, 11]) * 1j))
+
+
+class CasacoreTablesBigEndian(CasacoreTablesBase):
+    tablename = 'big.tbl'
+
+
+if __name__ == '__main__':
+    unittest.main()
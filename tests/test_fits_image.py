@@ -0,0 +1,61 @@
+from cngi.conversion import convert_fits, save_image
+from cngi.dio import read_image
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import os
+
+class FITSRoundTripTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from astropy.io import fits
+        cls.outdir = tempfile.mkdtemp()
+        cls.header = fits.Header({'NAXIS': 4, 'NAXIS1': 6, 'NAXIS2': 5, 'NAXIS3': 4, 'NAXIS4': 1,
+                                  'CTYPE1': 'RA---SIN', 'CRVAL1': 150.0, 'CDELT1': -1e-4, 'CRPIX1': 3.0, 'CUNIT1': 'deg',
+                                  'CTYPE2': 'DEC--SIN', 'CRVAL2': 2.5, 'CDELT2': 1e-4, 'CRPIX2': 2.0, 'CUNIT2': 'deg',
+                                  'CTYPE3': 'FREQ', 'CRVAL3': 1e11, 'CDELT3': 1e6, 'CRPIX3': 1.0, 'CUNIT3': 'Hz',
+                                  'CTYPE4': 'STOKES', 'CRVAL4': 1.0, 'CDELT4': 1.0, 'CRPIX4': 1.0,
+                                  'RADESYS': 'FK5', 'EQUINOX': 2000.0, 'BUNIT': 'Jy/beam'})
+        cls.data = np.random.default_rng(0).normal(size=(1, 4, 5, 6)).astype(np.float32)
+        cls.infile = os.path.join(cls.outdir, 'cube.fits')
+        fits.PrimaryHDU(cls.data, cls.header).writeto(cls.infile)
+        cls.xds = convert_fits(cls.infile, os.path.join(cls.outdir, 'cube.img.zarr'), chunk_shape=(-1, -1, 2, 1))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.outdir)
+
+    def test_convert(self):
+        self.assertEqual(dict(self.xds.IMAGE.sizes), {'d0': 6, 'd1': 5, 'chan': 4, 'pol': 1})
+        self.assertTrue(np.array_equal(self.xds.IMAGE.values, self.data.transpose(3, 2, 1, 0)))
+        self.assertTrue(np.allclose(self.xds.chan.values, 1e11 + 1e6 * np.arange(4)))
+        self.assertEqual(self.xds.attrs['direction_wcs']['radesys'], 'J2000')
+        xds = read_image(os.path.join(self.outdir, 'cube.img.zarr'))
+        self.assertTrue(np.allclose(np.rad2deg(xds.right_ascension.values[2, 1]), 150.0))
+        self.assertTrue(np.allclose(np.rad2deg(xds.declination.values[2, 1]), 2.5))
+
+    def test_round_trip(self):
+        from astropy.io import fits
+        from astropy.wcs import WCS
+        outfile = os.path.join(self.outdir, 'out.fits')
+        self.assertTrue(save_image(self.xds, outfile, workers=2))
+        with fits.open(outfile) as hdul:
+            header, data = hdul[0].header, hdul[0].data
+            self.assertTrue(np.array_equal(data, self.data))
+        for key in ['RADESYS', 'EQUINOX', 'BUNIT', 'CRVAL3', 'CDELT3', 'CRVAL4']:
+            self.assertEqual(header[key], self.header[key], key)
+        self.assertEqual(header['WCSAXES'], 4)
+        self.assertFalse('MJDREF' in header)
+        ww, expected = WCS(header).celestial, WCS(self.header).celestial
+        self.assertEqual(list(ww.wcs.ctype), list(expected.wcs.ctype))
+        for attr in ['crval', 'cdelt', 'crpix']:
+            self.assertTrue(np.allclose(getattr(ww.wcs, attr), getattr(expected.wcs, attr)), attr)
+
+    def test_unsupported_type(self):
+        xds = self.xds.assign(IMAGE=self.xds.IMAGE.astype(np.complex64))
+        self.assertFalse(save_image(xds, os.path.join(self.outdir, 'complex.fits')))
+
+if __name__ == '__main__':
+    unittest.main()
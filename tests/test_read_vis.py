@@ -0,0 +1,71 @@
+from cngi.dio import read_vis, write_vis, write_zarr, describe_vis
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import xarray as xr
+import os
+
+# every visibility of integration t has amplitude 1000 * (t + 1), scan 1 is the first five integrations and scan 2 the rest
+antennas = np.array([(a1, a2) for a1 in range(4) for a2 in range(a1, 4)])
+ntime = 9
+
+def make_ddi(ddi, nchan, pols, rng):
+    shape = (ntime, len(antennas), nchan, len(pols))
+    amp = 1000.0 * (np.arange(ntime) + 1)[:, None, None, None]
+    data = (amp * np.exp(2j * np.pi * rng.random(shape))).astype('complex64')
+    times = np.datetime64('2020-01-01T00:00:00', 'ns') + np.arange(ntime) * np.timedelta64(1, 's')
+    return xr.Dataset({'DATA': (('time', 'baseline', 'chan', 'pol'), data), 'FLAG': (('time', 'baseline', 'chan', 'pol'), rng.random(shape) > 0.8),
+                       'UVW': (('time', 'baseline', 'uvw_index'), rng.normal(size=(ntime, len(antennas), 3)))},
+                      coords={'time': times, 'baseline': np.arange(len(antennas)), 'chan': 1e11 * (ddi + 1) + 1e6 * np.arange(nchan), 'pol': pols,
+                              'spw': [ddi], 'antennas': (('baseline', 'pair'), antennas), 'scan': ('time', [1] * 5 + [2] * 4),
+                              'field': ('time', ['src0'] * 5 + ['src1'] * 4), 'field_id': ('time', [0] * 5 + [1] * 4)},
+                      attrs={'ddi': ddi}).chunk({'time': 2})
+
+class ReadVisTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.outdir = tempfile.mkdtemp()
+        cls.infile = os.path.join(cls.outdir, 'test.vis.zarr')
+        rng = np.random.default_rng(0)
+        cls.xds_list = [make_ddi(0, 8, [9, 10, 11, 12], rng), make_ddi(1, 4, [9, 12], rng)]
+        for ddi, xds in enumerate(cls.xds_list):
+            write_vis(xds, cls.infile, ddi=ddi, append=ddi > 0)
+        write_zarr(xr.Dataset({'ANT_NAME': ('antenna', ['DA40', 'DA41', 'DA42', 'DA43'])}), os.path.join(cls.infile, 'global'))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.outdir)
+
+    def test_collection(self):
+        vis = read_vis(self.infile, ddi=None)
+        self.assertEqual(list(vis), ['global', 0, 1])
+        self.assertEqual(dict(vis[1].DATA.sizes), dict(self.xds_list[1].DATA.sizes))
+        self.assertEqual(list(vis['global'].ANT_NAME.values), ['DA40', 'DA41', 'DA42', 'DA43'])
+        self.assertEqual(list(vis.summary.channels), [8, 4])
+        self.assertEqual(list(vis.summary.spw_id), [0, 1])
+        self.assertTrue(describe_vis(self.infile).equals(vis.summary))
+
+    def test_selection(self):
+        xds = read_vis(self.infile, ddi=0, scans=2, antennas=[0, 1], chan_range=(1.0e11 + 2e6, 1.0e11 + 4e6), pols=[9, 12])
+        self.assertEqual(dict(xds.DATA.sizes), {'time': 4, 'baseline': 3, 'chan': 3, 'pol': 2})
+        full = self.xds_list[0]
+        baselines = np.all(np.isin(full.antennas.values, [0, 1]), axis=1)
+        expected = full.DATA.values[5:][:, baselines][:, :, 2:5][..., [0, 3]]
+        self.assertTrue(np.array_equal(xds.DATA.values, expected))
+        xds = read_vis(self.infile, ddi=1, fields='src0', baselines=[(0, 1), (2, 3)], time_range=('2020-01-01T00:00:01', '2020-01-01T00:00:03'))
+        self.assertTrue(np.array_equal(xds.DATA.values, self.xds_list[1].DATA.values[1:4][:, [1, 8]]))
+        self.assertTrue(np.array_equal(read_vis(self.infile, ddi=1, fields=[1]).time.values, self.xds_list[1].time.values[5:]))
+
+    def test_chunk_stats(self):
+        outfile = os.path.join(self.outdir, 'stats.vis.zarr')
+        write_vis(self.xds_list[0], outfile, ddi=0, append=False, chunk_stats=True)
+        xds = read_vis(outfile, ddi=0, amp_range=(0, 1500))  # only the first time chunk has amplitudes below 1500
+        self.assertEqual(dict(xds.DATA.sizes), {'time': 2, 'baseline': 10, 'chan': 8, 'pol': 4})
+        self.assertTrue(np.array_equal(xds.DATA.values, self.xds_list[0].DATA.values[:2]))
+        xds = read_vis(outfile, ddi=0, max_flag_fraction=0.0)
+        self.assertEqual(xds.sizes['time'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+from cngi.dio import write_vis, rechunk_vis
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import xarray as xr
+import os
+
+class RechunkTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.outdir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        data = (rng.normal(size=(24, 10, 16, 2)) + 1j * rng.normal(size=(24, 10, 16, 2))).astype('complex64')
+        cls.xds = xr.Dataset({'DATA': (('time', 'baseline', 'chan', 'pol'), data), 'FLAG': (('time', 'baseline', 'chan', 'pol'), rng.random(data.shape) > 0.9)},
+                             coords={'chan': 1e9 + 1e6 * np.arange(16)}).chunk({'time': 5, 'baseline': 3, 'chan': 16, 'pol': 1})
+        cls.infile = os.path.join(cls.outdir, 'in.vis.zarr')
+        write_vis(cls.xds, cls.infile, ddi=0, append=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.outdir)
+
+    def check(self, xds, chunksize):
+        self.assertEqual(xds.DATA.data.chunksize, chunksize)
+        self.assertTrue(np.array_equal(xds.DATA.values, self.xds.DATA.values))
+        self.assertTrue(np.array_equal(xds.FLAG.values, self.xds.FLAG.values))
+
+    def test_one_pass(self):
+        xds = rechunk_vis(self.infile, os.path.join(self.outdir, 'chan.vis.zarr'), {'chan': 4}, ddi=0)
+        self.check(xds, (5, 3, 4, 1))
+        self.assertEqual(xds.attrs['chunk_layout'], {'chan': 4})
+
+    def test_two_pass(self):
+        # a block of whole source and target chunks needs 24 x 6 x 16 x 1 values, more than the budget
+        outfile = os.path.join(self.outdir, 'time.vis.zarr')
+        xds = rechunk_vis(self.infile, outfile, {'time': -1, 'baseline': 2}, ddi=0, max_memory=16000 / 1024 ** 3, workers=2)
+        self.check(xds, (24, 2, 16, 1))
+        self.assertEqual([name for name in os.listdir(self.outdir) if name.startswith('rechunk_')], [])
+
+if __name__ == '__main__':
+    unittest.main()
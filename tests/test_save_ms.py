@@ -0,0 +1,57 @@
+from cngi.conversion import save_ms
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import xarray as xr
+import os
+
+try:
+    from casatools import table
+except ImportError:
+    table = None
+
+@unittest.skipIf(table is None, 'save_ms requires casatools')
+class SaveMSTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.outdir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        ntime, antennas = 6, np.array([(a1, a2) for a1 in range(3) for a2 in range(a1, 3)])
+        shape = (ntime, len(antennas), 4, 2)
+        data = (rng.normal(size=shape) + 1j * rng.normal(size=shape)).astype('complex64')
+        uvw = rng.normal(size=(ntime, len(antennas), 3))
+        data[3:, -1], uvw[3:, -1] = np.nan, np.nan  # the last baseline is padding in the second scan
+        times = np.datetime64('2020-01-01T00:00:00', 'ns') + np.arange(ntime) * np.timedelta64(10, 's')
+        cls.xds = xr.Dataset({'DATA': (('time', 'baseline', 'chan', 'pol'), data), 'FLAG': (('time', 'baseline', 'chan', 'pol'), rng.random(shape) > 0.5),
+                              'UVW': (('time', 'baseline', 'uvw_index'), uvw)},
+                             coords={'time': times, 'antennas': (('baseline', 'pair'), antennas), 'scan': ('time', [1, 1, 1, 2, 2, 2])},
+                             attrs={'ddi': 1}).chunk({'time': 2})
+        # the coordinates of a converted dataset may be chunked differently from its data variables
+        cls.xds = cls.xds.assign_coords(scan=cls.xds.scan.chunk({'time': 3}))
+        cls.valid = ~np.isnan(uvw[..., 0]).ravel()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.outdir)
+
+    def test_rows(self):
+        outfile = os.path.join(self.outdir, 'bare.ms')
+        self.assertTrue(save_ms(self.xds, outfile, workers=2))
+        tb_tool = table()
+        tb_tool.open(outfile)
+        self.assertEqual(tb_tool.nrows(), np.sum(self.valid))
+        nbl = self.xds.sizes['baseline']
+        self.assertTrue(np.array_equal(tb_tool.getcol('ANTENNA1'), np.tile(self.xds.antennas.values[:, 0], 6)[self.valid]))
+        self.assertTrue(np.array_equal(tb_tool.getcol('SCAN_NUMBER'), np.repeat([1, 1, 1, 2, 2, 2], nbl)[self.valid]))
+        self.assertTrue(np.allclose(np.diff(np.unique(tb_tool.getcol('TIME'))), 10))
+        self.assertTrue(np.all(tb_tool.getcol('DATA_DESC_ID') == 1))
+        for col in ['DATA', 'FLAG', 'UVW']:
+            values = self.xds[col].values
+            expected = values.reshape((-1,) + values.shape[2:])[self.valid]
+            self.assertTrue(np.array_equal(tb_tool.getcol(col).transpose(), expected), col)
+        tb_tool.close()
+
+if __name__ == '__main__':
+    unittest.main()
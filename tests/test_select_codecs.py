@@ -0,0 +1,46 @@
+from cngi.dio import select_codecs, write_zarr
+from cngi._helper.codecs import ComplexSplit
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import xarray as xr
+import os
+
+class SelectCodecsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.outdir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        data = (rng.normal(size=(20, 6, 16, 2)) + 1j * rng.normal(size=(20, 6, 16, 2))).astype('complex64')
+        cls.xds = xr.Dataset({'DATA': (('time', 'baseline', 'chan', 'pol'), data),
+                              'FLAG': (('time', 'baseline', 'chan', 'pol'), rng.random(data.shape) > 0.9),
+                              'UVW': (('time', 'baseline', 'uvw_index'), rng.normal(size=(20, 6, 3)))}).chunk({'time': 5, 'chan': 8})
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.outdir)
+
+    def test_complex_split(self):
+        values = self.xds.DATA.values
+        codec = ComplexSplit(dtype=values.dtype)
+        self.assertTrue(np.array_equal(np.frombuffer(codec.decode(codec.encode(values)), dtype=values.dtype), values.ravel()))
+
+    def test_selection(self):
+        encoding = select_codecs(self.xds, nsamples=2, bandwidth=1)
+        self.assertEqual(sorted(encoding), ['DATA', 'FLAG', 'UVW'])
+        xds = write_zarr(self.xds, os.path.join(self.outdir, 'codecs.zarr'), encoding=encoding)
+        for vv in self.xds.data_vars:
+            self.assertEqual(xds[vv].encoding['compressor'], encoding[vv]['compressor'])
+            self.assertTrue(np.array_equal(xds[vv].values, self.xds[vv].values))
+
+    def test_candidates(self):
+        from numcodecs import Blosc, PackBits
+        candidates = [{'compressor': Blosc(cname='zstd', clevel=2, shuffle=Blosc.NOSHUFFLE)}]
+        encoding = select_codecs(self.xds, variables=['FLAG'], candidates=candidates + [{'compressor': Blosc(cname='zstd', clevel=2), 'filters': [PackBits()]}],
+                                 bandwidth=1e-3)
+        self.assertEqual(encoding['FLAG']['filters'], [PackBits()])
+
+if __name__ == '__main__':
+    unittest.main()